@@ -1,15 +1,27 @@
 import streamlit as st
 import pandas as pd
-import yfinance as yf
 import plotly.graph_objects as go
 import plotly.express as px
 from datetime import datetime, timedelta
 import numpy as np
 import json
-from collections import defaultdict
 import smtplib
+import time
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
+from market_data import (
+    ArticleStore, DividendStore, EtfUniverse, FetchGateway, GatewayProvider, MarketDataRefresher, PriceHistoryStore,
+    QuoteLadder, SWRCache, TTLCache, fetch_concurrently, provider_from_env, store_path
+)
+from income_engine import (
+    DIVIDEND_DECLINE_PCT, DIVIDEND_INCREASE_PCT, AnalyticsGraph, DividendTrendDetector, HeadlineSentiment,
+    RebalanceOptimizer, compute_portfolio_metrics, daily_panel, distribution_change, exit_rule_sweep, monthly_scenarios,
+    project_compound_growth, run_monte_carlo, score_factors, simulate_weekly_buys, solve_goal, sweep_compound_growth,
+    top_k, trailing_change, trailing_sum, walk_forward_rebalance, week_ends
+)
 
 # =====================================================
 # CONFIG
@@ -312,42 +324,27 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-ETF_LIST = ["QDTE", "CHPY", "XDTE"]
+@st.cache_resource
+def get_universe():
+    """Tracked funds and their metadata from etf_universe.json (or $ETF_UNIVERSE_PATH)"""
+    return EtfUniverse.load()
 
-# ETF underlying info
-ETF_INFO = {
-    "QDTE": {
-        "name": "NASDAQ-100 0DTE Covered Call ETF",
-        "underlying_index": "NASDAQ-100",
-        "top_holdings": ["AAPL", "MSFT", "NVDA", "GOOGL", "AMZN"],
-        "strategy": "0DTE covered calls on QQQ",
-        "risk_level": "Medium-High"
-    },
-    "CHPY": {
-        "name": "T-Rex 2X Long Nvidia Daily Target ETF",
-        "underlying_index": "Technology Sector",
-        "top_holdings": ["NVDA"],
-        "strategy": "2x leveraged NVDA with covered calls",
-        "risk_level": "High"
-    },
-    "XDTE": {
-        "name": "S&P 500 0DTE Covered Call ETF",
-        "underlying_index": "S&P 500",
-        "top_holdings": ["AAPL", "MSFT", "NVDA", "AMZN", "GOOGL"],
-        "strategy": "0DTE covered calls on SPY",
-        "risk_level": "Medium"
-    }
-}
+UNIVERSE = get_universe()
+ETF_LIST = list(UNIVERSE.tickers)
+ETF_INFO = UNIVERSE.info
+
+# Rows per page wherever the UI lists one block per ticker
+PAGE_SIZE = 12
 
 # =====================================================
 # SESSION STATE - ENHANCED
 # =====================================================
 if "holdings" not in st.session_state:
-    st.session_state.holdings = {
-        "QDTE": {"shares": 125, "div": 0.177, "cost_basis": 19.50},
-        "CHPY": {"shares": 63,  "div": 0.52, "cost_basis": 25.80},
-        "XDTE": {"shares": 84,  "div": 0.16, "cost_basis": 18.50},
-    }
+    # Starting positions come from the universe file
+    st.session_state.holdings = {ticker: dict(position) for ticker, position in UNIVERSE.positions.items()}
+# Every fund in the universe gets a (possibly empty) position
+for ticker in ETF_LIST:
+    st.session_state.holdings.setdefault(ticker, {"shares": 0, "div": 0.0, "cost_basis": 0.0})
 
 if "cash" not in st.session_state:
     st.session_state.cash = 0.0
@@ -367,27 +364,11 @@ if "snapshots" not in st.session_state:
 if "dividend_drop_threshold" not in st.session_state:
     st.session_state.dividend_drop_threshold = 10.0
 
-# NEW: Dividend history tracking
-if "dividend_history" not in st.session_state:
-    st.session_state.dividend_history = defaultdict(list)
-    # Initialize with some sample data
-    for ticker in ETF_LIST:
-        current_div = st.session_state.holdings[ticker]["div"]
-        for i in range(12):  # Last 12 weeks
-            variation = np.random.uniform(-0.02, 0.02)
-            st.session_state.dividend_history[ticker].append({
-                "date": datetime.now() - timedelta(weeks=12-i),
-                "dividend": current_div + (current_div * variation),
-                "verified": True
-            })
-
 # NEW: Price alerts
 if "price_alerts" not in st.session_state:
-    st.session_state.price_alerts = {
-        "QDTE": {"stop_loss_pct": 20, "target_price": None, "enabled": False},
-        "CHPY": {"stop_loss_pct": 20, "target_price": None, "enabled": False},
-        "XDTE": {"stop_loss_pct": 20, "target_price": None, "enabled": False},
-    }
+    st.session_state.price_alerts = {}
+for ticker in ETF_LIST:
+    st.session_state.price_alerts.setdefault(ticker, {"stop_loss_pct": 20, "target_price": None, "enabled": False})
 
 # NEW: Alert settings
 if "alert_settings" not in st.session_state:
@@ -412,6 +393,10 @@ if "autopilot" not in st.session_state:
         "require_approval": True
     }
 
+# Rebalancer keeps its last plan as the warm start for the next solve
+if "rebalance_optimizer" not in st.session_state:
+    st.session_state.rebalance_optimizer = RebalanceOptimizer()
+
 # NEW: News cache
 if "news_cache" not in st.session_state:
     st.session_state.news_cache = {
@@ -424,42 +409,185 @@ if "news_cache" not in st.session_state:
 if "recommendations" not in st.session_state:
     st.session_state.recommendations = []
 
+# Memoised results of the derived analytics graph, one entry per node
+if "analytics_memo" not in st.session_state:
+    st.session_state.analytics_memo = {}
+
 # =====================================================
 # HELPER FUNCTIONS - ENHANCED
 # =====================================================
 
-@st.cache_data(ttl=600)
+@st.cache_resource
+def get_market_data_provider():
+    """
+    Market data backend for this server process.
+    Live yfinance by default; MARKET_DATA_PROVIDER=replay serves recorded files.
+    Every call goes through one shared gateway (coalescing, rate limit, circuit breakers).
+    """
+    return GatewayProvider(provider_from_env(), FetchGateway())
+
+@st.cache_resource
+def get_quote_ladder():
+    """Quote-first price ladder shared by every session; keeps per-source win/latency stats"""
+    return QuoteLadder(get_market_data_provider())
+
+QUOTE_STALE_AFTER = 120  # seconds before a cached quote is served stale and revalidated in the background
+
+@st.cache_resource
+def get_quote_cache():
+    """Stale-while-revalidate quote cache shared by every session"""
+    return SWRCache(ttl=QUOTE_STALE_AFTER)
+
+def load_quotes(provider, ladder, tickers):
+    """
+    Quote cache loader -> {ticker: {"price", "source"}}.
+    A lone ticker takes the quote ladder; several share one batched download.
+    Failed fetches are left out so they never replace a good stale quote.
+    """
+    tickers = tuple(tickers)
+    if len(tickers) == 1:
+        price, source = ladder.fetch(tickers[0])
+        return {tickers[0]: {"price": price, "source": source}} if price is not None else {}
+    snapshot = download_price_snapshot(provider, ladder, tickers)
+    return {
+        t: {"price": price, "source": snapshot["sources"][t]}
+        for t, price in snapshot["prices"].items() if price is not None
+    }
+
+def refresh_quotes(provider, ladder, cache, tickers):
+    """Background job: reload every quote so readers rarely see a stale one"""
+    cache.put_many(load_quotes(provider, ladder, tickers))
+    return tuple(tickers)
+
+def get_quotes(tickers):
+    """
+    {ticker: (quote, fetched_at, stale)} from the quote cache.
+    Expired quotes are returned immediately and refreshed in the background;
+    only tickers never seen before are fetched inline.
+    """
+    provider = get_market_data_provider()
+    ladder = get_quote_ladder()
+    return get_quote_cache().get_many(tickers, lambda keys: load_quotes(provider, ladder, keys))
+
 def get_price(ticker):
+    """Get the latest price for a single ticker"""
+    quote = get_quotes([ticker]).get(ticker)
+    return quote[0]["price"] if quote else None
+
+
+def download_price_snapshot(provider, ladder, tickers):
+    """
+    Fetch latest prices for all tickers in one batched download.
+    Only symbols missing from the batch fall back to the per-ticker quote ladder.
+    """
+    tickers = tuple(tickers)
+    prices = {}
+    sources = {}
+
     try:
-        stock = yf.Ticker(ticker)
+        closes = provider.download(tickers, period="1d", interval="1m")
+
+        for ticker in tickers:
+            if ticker in closes.columns:
+                series = closes[ticker].dropna()
+                if not series.empty:
+                    prices[ticker] = round(float(series.iloc[-1]), 2)
+                    sources[ticker] = "batch"
+    except Exception:
+        pass
 
-        # Try intraday first
-        hist = stock.history(period="1d", interval="1m")
-        if not hist.empty:
-            return round(hist["Close"].iloc[-1], 2)
+    missing = [ticker for ticker in tickers if ticker not in prices]
+    answers = fetch_concurrently(missing, ladder.fetch, timeout=ladder.deadline + 1)
+    for ticker in missing:
+        price, source = answers.get(ticker, (None, None))
+        prices[ticker] = price
+        sources[ticker] = source or "missing"
 
-        # Fallback to daily
-        hist = stock.history(period="5d")
-        if not hist.empty:
-            return round(hist["Close"].iloc[-1], 2)
+    return {
+        "prices": prices,
+        "sources": sources,
+        "fetched_at": datetime.now()
+    }
 
-        # Fallback to fast_info
-        if hasattr(stock, "fast_info"):
-            price = stock.fast_info.get("last_price")
-            if price:
-                return round(price, 2)
 
-        return None
-    except:
-        return None
+# Module globals are rebuilt on every Streamlit rerun, so this dict lives for exactly one rerun
+_RERUN_CACHE = {}
+
+def get_market_snapshot():
+    """
+    Latest immutable snapshot published by the background refresher.
+    Read once per rerun so every helper sees the same data.
+    """
+    if "market_snapshot" not in _RERUN_CACHE:
+        refresher = get_market_refresher()
+        # Only reruns during a fresh server process's warm-up window wait here
+        refresher.wait_warmup(REFRESHER_WARMUP_TIMEOUT)
+        _RERUN_CACHE["market_snapshot"] = refresher.snapshot()
+    return _RERUN_CACHE["market_snapshot"]
+
+def get_price_snapshot():
+    """Price snapshot shared by every helper within the current rerun, with per-ticker data age"""
+    if "price_snapshot" not in _RERUN_CACHE:
+        get_market_snapshot()  # lets a fresh process finish its warm-up fill of the quote cache
+        quotes = get_quotes(ETF_LIST)
+        now = time.time()
+        fetched = {t: quotes[t][1] for t in quotes}
+        _RERUN_CACHE["price_snapshot"] = {
+            "prices": {t: quotes[t][0]["price"] if t in quotes else None for t in ETF_LIST},
+            "sources": {t: quotes[t][0]["source"] if t in quotes else "missing" for t in ETF_LIST},
+            "ages": {t: now - fetched[t] for t in fetched},
+            "stale": {t: quotes[t][2] for t in quotes},
+            "fetched_at": datetime.fromtimestamp(min(fetched.values())) if fetched else datetime.now()
+        }
+    return _RERUN_CACHE["price_snapshot"]
+
+def format_age(seconds):
+    """Compact age label: 42s, 5m, 3h"""
+    if seconds < 60:
+        return f"{int(seconds)}s"
+    elif seconds < 3600:
+        return f"{int(seconds / 60)}m"
+    return f"{int(seconds / 3600)}h"
+
+def signed_dollars(amount):
+    """+$1,234 / -$1,234"""
+    return f"{'+' if amount >= 0 else '-'}${abs(amount):,.0f}"
+
+def page_picker(total, key, page_size=PAGE_SIZE):
+    """Render a page picker when `total` rows overflow one page; returns the current page's offset"""
+    pages = max(1, -(-total // page_size))
+    if pages == 1:
+        return 0
+    page = st.selectbox(f"Page (of {pages})", range(1, pages + 1), key=key)
+    st.caption(f"Showing {(page - 1) * page_size + 1}-{min(page * page_size, total)} of {total}")
+    return (page - 1) * page_size
+
+def paginate(items, key, page_size=PAGE_SIZE):
+    """Render a page picker when items overflow one page; returns the items on the current page"""
+    items = list(items)
+    offset = page_picker(len(items), key, page_size)
+    return items[offset:offset + page_size]
+
+def held_tickers():
+    """Funds with a non-zero position, in universe order"""
+    return [t for t in ETF_LIST if st.session_state.holdings[t]["shares"] > 0]
+
+def priced_positions(holdings):
+    """
+    Mask of held funds with a usable quote, and the held funds left out for lack of one.
+    Projections value every position at today's price, so one NaN would poison the whole run.
+    """
+    held = holdings["shares"] > 0
+    priced = np.nan_to_num(holdings["price"]) > 0
+    missing = [t for t, h, p in zip(holdings.tickers, held, priced) if h and not p]
+    return held & priced, missing
 
 
 @st.cache_data(ttl=3600)
 def get_etf_info(ticker):
     """Get ETF information"""
     try:
-        stock = yf.Ticker(ticker)
-        info = stock.info
+        info = get_market_data_provider().info(ticker)
         return {
             "name": info.get("longName", ticker),
             "description": info.get("longBusinessSummary", "No description available"),
@@ -471,96 +599,79 @@ def get_etf_info(ticker):
     except:
         return {"name": ticker, "description": "Information unavailable", "yield": 0, "nav": 0}
 
-@st.cache_data(ttl=3600)
-def get_price_history(ticker, period="3mo"):
-    """Get historical price data"""
-    try:
-        stock = yf.Ticker(ticker)
-        hist = stock.history(period=period)
-        return hist
-    except:
-        return pd.DataFrame()
+@st.cache_resource
+def get_history_store():
+    """On-disk price history shared by every session in this server process"""
+    provider = get_market_data_provider()
+    return PriceHistoryStore(fetcher=provider.history, path=store_path(provider))
+
+@st.cache_resource
+def get_dividend_store():
+    """On-disk distribution history shared by every session in this server process"""
+    provider = get_market_data_provider()
+    return DividendStore(fetcher=provider.dividends, path=store_path(provider))
+
+def sync_dividends(store, tickers, detector=None):
+    """
+    Append new distributions for every ticker and feed them to the trend detector;
+    returns the tickers that synced cleanly
+    """
+    synced = []
+    for ticker in tickers:
+        try:
+            store.sync(ticker, max_age=0)
+            synced.append(ticker)
+        except Exception:
+            continue
+    if detector is not None and synced:
+        detector.update(store.recent(synced, detector.history))
+    return tuple(synced)
+
+def sync_price_histories(store, tickers, interval="1d"):
+    """Append new bars for every ticker; returns the tickers that synced cleanly"""
+    synced = []
+    for ticker in tickers:
+        try:
+            store.sync(ticker, interval, max_age=0)
+            synced.append(ticker)
+        except Exception:
+            continue
+    return tuple(synced)
+
+def get_price_history(ticker, period="3mo", interval="1d"):
+    """Get historical price data, appending only new bars to the local store"""
+    store = get_history_store()
+    if interval != "1d" or ticker not in ETF_LIST:
+        # Not kept warm by the background refresher - sync on demand
+        try:
+            store.sync(ticker, interval)
+        except Exception:
+            pass  # Serve whatever is already stored
+    return store.load(ticker, interval, period=period)
 
 def calculate_current_metrics():
     """Calculate current portfolio metrics"""
-    prices = {t: get_price(t) for t in ETF_LIST}
-    
-    total_weekly = 0
-    total_value = 0
-    total_cost_basis = 0
-    holdings_data = []
-    
-    for ticker in ETF_LIST:
-        shares = st.session_state.holdings[ticker]["shares"]
-        div = st.session_state.holdings[ticker]["div"]
-        price = prices[ticker]
-        cost_basis = st.session_state.holdings[ticker].get("cost_basis", price)
-        
-        weekly = shares * div
-        monthly = weekly * 52 / 12
-        annual = weekly * 52
-        value = shares * price
-        yield_pct = (annual / value * 100) if value > 0 else 0
-        
-        # Calculate gain/loss
-        cost_total = shares * cost_basis
-        gain_loss = value - cost_total
-        gain_loss_pct = ((value / cost_total) - 1) * 100 if cost_total > 0 else 0
-        
-        total_weekly += weekly
-        total_value += value
-        total_cost_basis += cost_total
-        
-        holdings_data.append({
-            "ticker": ticker,
-            "shares": shares,
-            "div": div,
-            "price": price,
-            "weekly": weekly,
-            "monthly": monthly,
-            "annual": annual,
-            "value": value,
-            "yield_pct": yield_pct,
-            "cost_basis": cost_basis,
-            "gain_loss": gain_loss,
-            "gain_loss_pct": gain_loss_pct
-        })
-    
-    total_value += st.session_state.cash
-    monthly_income = total_weekly * 52 / 12
-    annual_income = monthly_income * 12
-    total_yield = (annual_income / total_value * 100) if total_value > 0 else 0
-    total_gain_loss = total_value - total_cost_basis - st.session_state.cash
-    total_gain_loss_pct = ((total_value / (total_cost_basis + st.session_state.cash)) - 1) * 100 if (total_cost_basis + st.session_state.cash) > 0 else 0
-    
-    return {
-        "holdings": holdings_data,
-        "prices": prices,
-        "total_weekly": total_weekly,
-        "monthly_income": monthly_income,
-        "annual_income": annual_income,
-        "total_value": total_value,
-        "total_yield": total_yield,
-        "total_gain_loss": total_gain_loss,
-        "total_gain_loss_pct": total_gain_loss_pct
-    }
+    return get_analytics().get("metrics")
 
 def check_price_alerts():
     """Check if any price alerts should trigger"""
+    return get_analytics().get("price_alerts")
+
+def compute_price_alerts(metrics, price_alert_settings):
     alerts = []
-    metrics = calculate_current_metrics()
     
-    for holding in metrics["holdings"]:
-        ticker = holding["ticker"]
-        price = holding["price"]
-        cost_basis = holding["cost_basis"]
-        
-        if st.session_state.price_alerts[ticker]["enabled"]:
-            # Stop loss check
-            stop_loss_pct = st.session_state.price_alerts[ticker]["stop_loss_pct"]
-            loss_from_basis = ((price / cost_basis) - 1) * 100
+    for ticker, settings in price_alert_settings.items():
+        if settings["enabled"] and ticker in metrics["holdings"]:
+            holding = metrics["holdings"].row(ticker)
+            price = holding["price"]
+            cost_basis = holding["cost_basis"]
             
-            if loss_from_basis <= -stop_loss_pct:
+            # Stop loss check - only meaningful for a position with a cost basis
+            stop_loss_pct = settings["stop_loss_pct"]
+            has_basis = holding["shares"] > 0 and cost_basis > 0
+            loss_from_basis = ((price / cost_basis) - 1) * 100 if has_basis else 0.0
+            
+            if has_basis and loss_from_basis <= -stop_loss_pct:
                 alerts.append({
                     "ticker": ticker,
                     "type": "stop_loss",
@@ -571,9 +682,9 @@ def check_price_alerts():
                     "threshold": cost_basis * (1 - stop_loss_pct/100)
                 })
             
-            # Target price check
-            target = st.session_state.price_alerts[ticker]["target_price"]
-            if target and price >= target:
+            # Target price check - only for a position there is something to take profit on
+            target = settings["target_price"]
+            if target and holding["shares"] > 0 and price >= target:
                 alerts.append({
                     "ticker": ticker,
                     "type": "target_reached",
@@ -586,75 +697,71 @@ def check_price_alerts():
     
     return alerts
 
+@st.cache_resource
+def get_dividend_trend_detector():
+    """Rolling dividend trends for the whole universe, seeded from the store and fed by each sync"""
+    detector = DividendTrendDetector(ETF_LIST)
+    detector.update(get_dividend_store().recent(ETF_LIST, detector.history))
+    return detector
+
+def get_dividend_trends_version():
+    """Version of the trend detector's data, the analytics graph's dividend input"""
+    get_market_snapshot()  # a fresh process backfills the store during warm-up
+    return get_dividend_trend_detector().version
+
 def analyze_dividend_trends():
     """Analyze dividend payment trends"""
+    return get_analytics().get("dividend_trends")
+
+def compute_dividend_trends(version, drop_threshold):
+    trends = get_dividend_trend_detector().evaluate(drop_threshold)
     alerts = []
-    
-    for ticker in ETF_LIST:
-        history = st.session_state.dividend_history[ticker]
-        if len(history) < 4:
-            continue
-        
-        # Get last 4 weeks
-        recent = history[-4:]
-        recent_avg = np.mean([d["dividend"] for d in recent])
-        
-        # Get previous 4 weeks
-        previous = history[-8:-4] if len(history) >= 8 else history[:-4]
-        if not previous:
-            continue
-        previous_avg = np.mean([d["dividend"] for d in previous])
-        
-        # Calculate change
-        change_pct = ((recent_avg / previous_avg) - 1) * 100 if previous_avg > 0 else 0
-        
-        if change_pct < -st.session_state.dividend_drop_threshold:
-            alerts.append({
-                "ticker": ticker,
-                "type": "dividend_drop",
+
+    for i in np.flatnonzero(trends["kind"] != ""):
+        ticker = trends["tickers"][i]
+        kind = trends["kind"][i]
+        change_pct = float(trends["change_pct"][i])
+        alert = {
+            "ticker": ticker,
+            "type": kind,
+            "change_pct": change_pct,
+            "current_avg": float(trends["recent_avg"][i]),
+            "previous_avg": float(trends["previous_avg"][i])
+        }
+        if kind == "dividend_drop":
+            alert.update({
                 "severity": "critical",
-                "change_pct": change_pct,
-                "current_avg": recent_avg,
-                "previous_avg": previous_avg,
                 "message": f"🚨 DIVIDEND DROP: {ticker} dividend decreased {abs(change_pct):.1f}% over last 4 weeks",
                 "action": f"Review {ticker} position - consider reducing exposure"
             })
-        elif change_pct < -5:
-            alerts.append({
-                "ticker": ticker,
-                "type": "dividend_decline",
+        elif kind == "dividend_decline":
+            alert.update({
                 "severity": "warning",
-                "change_pct": change_pct,
-                "current_avg": recent_avg,
-                "previous_avg": previous_avg,
                 "message": f"⚠️ DIVIDEND DECLINE: {ticker} dividend down {abs(change_pct):.1f}%",
                 "action": f"Monitor {ticker} closely for further declines"
             })
-        elif change_pct > 10:
-            alerts.append({
-                "ticker": ticker,
-                "type": "dividend_increase",
+        else:
+            alert.update({
                 "severity": "success",
-                "change_pct": change_pct,
-                "current_avg": recent_avg,
-                "previous_avg": previous_avg,
                 "message": f"✅ DIVIDEND INCREASE: {ticker} dividend up {change_pct:.1f}%",
                 "action": f"Consider increasing {ticker} position"
             })
+        alerts.append(alert)
     
     return alerts
 
 def calculate_portfolio_risk_score():
     """Calculate comprehensive portfolio risk score (0-100)"""
-    metrics = calculate_current_metrics()
+    return get_analytics().get("risk_score")
+
+def compute_risk_score(metrics, div_alerts):
     scores = {}
     
     # 1. Diversification score (0-20 points)
-    values = [h["value"] for h in metrics["holdings"]]
-    total = sum(values)
+    values = metrics["holdings"]["value"]
+    total = values.sum()
     if total > 0:
-        concentrations = [v/total for v in values]
-        max_concentration = max(concentrations)
+        max_concentration = values.max() / total
         # Perfect = 33% each, worst = 100% in one
         diversification_score = 20 * (1 - (max_concentration - 0.33) / 0.67) if max_concentration > 0.33 else 20
     else:
@@ -662,7 +769,6 @@ def calculate_portfolio_risk_score():
     scores["diversification"] = max(0, min(20, diversification_score))
     
     # 2. Dividend stability score (0-25 points)
-    div_alerts = analyze_dividend_trends()
     critical_div_alerts = [a for a in div_alerts if a["severity"] == "critical"]
     warning_div_alerts = [a for a in div_alerts if a["severity"] == "warning"]
     dividend_stability = 25 - (len(critical_div_alerts) * 10) - (len(warning_div_alerts) * 5)
@@ -670,7 +776,7 @@ def calculate_portfolio_risk_score():
     
     # 3. Price performance score (0-20 points)
     # Check if holdings are in profit or loss
-    avg_gain_loss_pct = np.mean([h["gain_loss_pct"] for h in metrics["holdings"]])
+    avg_gain_loss_pct = metrics["holdings"]["gain_loss_pct"].mean()
     if avg_gain_loss_pct >= 10:
         price_score = 20
     elif avg_gain_loss_pct >= 0:
@@ -685,7 +791,7 @@ def calculate_portfolio_risk_score():
     
     # 4. Yield sustainability score (0-20 points)
     # Very high yields (>100%) are risky
-    avg_yield = np.mean([h["yield_pct"] for h in metrics["holdings"]])
+    avg_yield = metrics["holdings"]["yield_pct"].mean()
     if avg_yield > 150:
         yield_score = 5
     elif avg_yield > 100:
@@ -699,13 +805,8 @@ def calculate_portfolio_risk_score():
     # 5. Risk exposure score (0-15 points)
     # Based on ETF risk levels
     risk_weights = {"Low": 1, "Medium": 2, "Medium-High": 3, "High": 4}
-    weighted_risk = 0
-    for holding in metrics["holdings"]:
-        ticker = holding["ticker"]
-        weight = holding["value"] / metrics["total_value"] if metrics["total_value"] > 0 else 0
-        etf_risk = ETF_INFO[ticker]["risk_level"]
-        risk_level = risk_weights.get(etf_risk, 2)
-        weighted_risk += weight * risk_level
+    risk_levels = np.array([risk_weights.get(ETF_INFO[t]["risk_level"], 2) for t in metrics["holdings"].tickers])
+    weighted_risk = float(metrics["holdings"]["weight"] @ risk_levels)
     
     # Lower weighted risk = higher score
     risk_score = 15 * (1 - (weighted_risk - 1) / 3)
@@ -777,188 +878,255 @@ def generate_rebalance_recommendation(metrics, risk_score):
     
     return recommendations
 
-def analyze_sentiment_from_title(title):
+# Headline keywords and their sentiment weights
+POSITIVE_WORDS = {
+    'surge': 2, 'soar': 2, 'rally': 2, 'jump': 2, 'boom': 2,
+    'gain': 1.5, 'rise': 1.5, 'climb': 1.5, 'advance': 1.5,
+    'beat': 1.5, 'exceed': 1.5, 'outperform': 1.5,
+    'strong': 1, 'growth': 1, 'profit': 1, 'bullish': 1.5,
+    'upgrade': 1.5, 'record': 1.5, 'high': 1, 'boost': 1,
+    'positive': 1, 'win': 1, 'success': 1, 'breakthrough': 1.5,
+    'optimistic': 1, 'confident': 1
+}
+
+NEGATIVE_WORDS = {
+    'crash': 2, 'plunge': 2, 'collapse': 2, 'tumble': 2,
+    'fall': 1.5, 'drop': 1.5, 'decline': 1.5, 'sink': 1.5,
+    'loss': 1.5, 'miss': 1.5, 'weak': 1, 'bearish': 1.5,
+    'downgrade': 1.5, 'concern': 1, 'worry': 1, 'risk': 1,
+    'threat': 1.5, 'negative': 1, 'cut': 1.5, 'slash': 1.5,
+    'warning': 1, 'crisis': 2, 'trouble': 1.5, 'struggle': 1.5,
+    'disappointing': 1, 'uncertain': 1
+}
+
+# Forms each keyword also matches, spelled out so no suffix rule invents false hits ("win" -> "wines")
+SENTIMENT_INFLECTIONS = {
+    'surge': ['surges', 'surged', 'surging'],
+    'soar': ['soars', 'soared', 'soaring'],
+    'rally': ['rallies', 'rallied', 'rallying'],
+    'jump': ['jumps', 'jumped', 'jumping'],
+    'boom': ['booms', 'boomed', 'booming'],
+    'gain': ['gains', 'gained', 'gaining'],
+    'rise': ['rises', 'rose', 'risen', 'rising'],
+    'climb': ['climbs', 'climbed', 'climbing'],
+    'advance': ['advances', 'advanced', 'advancing'],
+    'beat': ['beats', 'beaten', 'beating'],
+    'exceed': ['exceeds', 'exceeded', 'exceeding'],
+    'outperform': ['outperforms', 'outperformed', 'outperforming', 'outperformance'],
+    'strong': ['stronger', 'strongest', 'strongly'],
+    'profit': ['profits', 'profited', 'profitable'],
+    'upgrade': ['upgrades', 'upgraded'],
+    'high': ['highs', 'higher', 'highest'],
+    'boost': ['boosts', 'boosted', 'boosting'],
+    'positive': ['positively'],
+    'win': ['wins', 'won', 'winning', 'winner', 'winners'],
+    'success': ['successes', 'successful', 'successfully'],
+    'breakthrough': ['breakthroughs'],
+    'optimistic': ['optimism'],
+    'confident': ['confidence'],
+    'crash': ['crashes', 'crashed', 'crashing'],
+    'plunge': ['plunges', 'plunged', 'plunging'],
+    'collapse': ['collapses', 'collapsed', 'collapsing'],
+    'tumble': ['tumbles', 'tumbled', 'tumbling'],
+    'fall': ['falls', 'fell', 'fallen', 'falling'],
+    'drop': ['drops', 'dropped', 'dropping'],
+    'decline': ['declines', 'declined', 'declining'],
+    'sink': ['sinks', 'sank', 'sunk', 'sinking'],
+    'loss': ['losses'],
+    'miss': ['misses', 'missed'],
+    'weak': ['weaker', 'weakest', 'weakness', 'weakened', 'weakening'],
+    'downgrade': ['downgrades', 'downgraded'],
+    'concern': ['concerns', 'concerned'],
+    'worry': ['worries', 'worried', 'worrying'],
+    'risk': ['risks', 'risky', 'riskier'],
+    'threat': ['threats', 'threaten', 'threatens', 'threatened'],
+    'negative': ['negatively'],
+    'cut': ['cuts', 'cutting'],
+    'slash': ['slashes', 'slashed', 'slashing'],
+    'warning': ['warnings', 'warn', 'warns', 'warned'],
+    'crisis': ['crises'],
+    'trouble': ['troubles', 'troubled', 'troubling'],
+    'struggle': ['struggles', 'struggled', 'struggling'],
+    'disappointing': ['disappoint', 'disappoints', 'disappointed', 'disappointment'],
+    'uncertain': ['uncertainty']
+}
+
+@st.cache_resource
+def get_headline_scorer():
+    """Compiled headline sentiment matcher with a process-wide score memo"""
+    return HeadlineSentiment(POSITIVE_WORDS, NEGATIVE_WORDS, SENTIMENT_INFLECTIONS)
+
+# Index proxies used for connected-market news
+INDEX_TICKER_MAP = UNIVERSE.index_proxies
+
+NEWS_FETCH_TIMEOUT = 10       # seconds allowed for one concurrent news fan-out
+NEWS_CACHE_TTL = 600          # per-symbol headline cache, shorter than the refresher's news schedule
+NEWS_HALF_LIFE = 3 * 86400    # seconds for a headline's weight in an ETF's sentiment to halve
+NEWS_ARTICLES_PER_TICKER = 4  # newest stored headlines shown per ETF
+NEWS_PAGE_SIZE = 10           # search results per page in the news tab
+
+# News search filters: inclusive sentiment ranges matching sentiment_band(), and lookback in days
+NEWS_SENTIMENT_BANDS = {
+    "Any": None,
+    "Positive": (float(np.nextafter(0.3, 1)), 1.0),
+    "Neutral": (-0.3, 0.3),
+    "Negative": (-1.0, float(np.nextafter(-0.3, -1)))
+}
+NEWS_PERIODS = {"Any time": None, "Past day": 1, "Past week": 7, "Past month": 30, "Past year": 365, "Custom range": None}
+
+def normalize_news_item(item):
+    """Flatten both the legacy (flat) and current (nested "content") yfinance news payloads"""
+    content = item.get("content") or item
+    link = content.get("link") or (content.get("canonicalUrl") or {}).get("url") \
+        or (content.get("clickThroughUrl") or {}).get("url") or ""
+
+    published = item.get("providerPublishTime") or 0
+    if not published and content.get("pubDate"):
+        try:
+            published = int(pd.Timestamp(content["pubDate"]).timestamp())
+        except Exception:
+            published = 0
+
+    return {
+        "id": item.get("id") or item.get("uuid") or link,
+        "title": content.get("title") or "",
+        "publisher": content.get("publisher") or (content.get("provider") or {}).get("displayName"),
+        "link": link,
+        "published": published
+    }
+
+def fetch_symbol_news(provider, symbol):
+    """Headlines for one symbol (reads the provider's news exactly once)"""
+    return [normalize_news_item(item) for item in provider.news(symbol)]
+
+@st.cache_resource
+def get_article_store():
+    """On-disk headlines and decayed per-ETF sentiment shared by every session"""
+    return ArticleStore(path=store_path(get_market_data_provider()), half_life=NEWS_HALF_LIFE)
+
+@st.cache_resource
+def get_news_cache():
+    """Per-symbol headline cache shared by every session, so overlapping holdings are fetched once"""
+    return TTLCache(ttl=NEWS_CACHE_TTL)
+
+def format_time_ago(published):
+    """Human readable age of a unix timestamp"""
+    if not published:
+        return "Recent"
+    try:
+        hours_ago = (datetime.now() - datetime.fromtimestamp(published)).total_seconds() / 3600
+        if hours_ago < 1:
+            return f"{int(hours_ago * 60)}m ago"
+        elif hours_ago < 24:
+            return f"{int(hours_ago)}h ago"
+        return f"{int(hours_ago/24)}d ago"
+    except:
+        return "Recent"
+
+def news_sources(t):
     """
-    Enhanced sentiment analysis based on keywords and patterns
+    News sources searched for one ETF: (symbol, weight, kind).
+    The ETF itself, its top 2 holdings (weighted 0.7 since indirect) and its
+    market index proxy (weighted 0.5 since most indirect).
     """
-    title_lower = title.lower()
-    
-    # Extended keyword lists with weights
-    positive_words = {
-        'surge': 2, 'soar': 2, 'rally': 2, 'jump': 2, 'boom': 2,
-        'gain': 1.5, 'rise': 1.5, 'climb': 1.5, 'advance': 1.5,
-        'beat': 1.5, 'exceed': 1.5, 'outperform': 1.5,
-        'strong': 1, 'growth': 1, 'profit': 1, 'bullish': 1.5,
-        'upgrade': 1.5, 'record': 1.5, 'high': 1, 'boost': 1,
-        'positive': 1, 'win': 1, 'success': 1, 'breakthrough': 1.5,
-        'optimistic': 1, 'confident': 1
-    }
-    
-    negative_words = {
-        'crash': 2, 'plunge': 2, 'collapse': 2, 'tumble': 2,
-        'fall': 1.5, 'drop': 1.5, 'decline': 1.5, 'sink': 1.5,
-        'loss': 1.5, 'miss': 1.5, 'weak': 1, 'bearish': 1.5,
-        'downgrade': 1.5, 'concern': 1, 'worry': 1, 'risk': 1,
-        'threat': 1.5, 'negative': 1, 'cut': 1.5, 'slash': 1.5,
-        'warning': 1, 'crisis': 2, 'trouble': 1.5, 'struggle': 1.5,
-        'disappointing': 1, 'uncertain': 1
+    sources = [(t, 1.0, "etf")]
+    sources += [(stock, 0.7, "holding") for stock in ETF_INFO[t]["top_holdings"][:2]]
+    index_ticker = INDEX_TICKER_MAP.get(ETF_INFO[t]["underlying_index"])
+    if index_ticker:
+        sources.append((index_ticker, 0.5, "index"))
+    return sources
+
+def sentiment_band(sentiment):
+    """POSITIVE / NEUTRAL / NEGATIVE label of a headline score"""
+    return "POSITIVE" if sentiment > 0.3 else "NEGATIVE" if sentiment < -0.3 else "NEUTRAL"
+
+def build_news_article(t, symbol, kind, item, sentiment):
+    """Display record for one headline found while searching ETF t"""
+    title = item["title"]
+    if kind == "etf":
+        label, headline = t, f"[{t} ETF] {title}"
+        summary = title[:200] + "..." if len(title) > 200 else title
+    elif kind == "holding":
+        label, headline = f"{t} ({symbol})", f"[{symbol}] {title}"
+        summary = f"Holding in {t}: {title[:150]}" + ("..." if len(title) > 150 else "")
+    else:
+        label, headline = f"{t} (Market)", f"[{ETF_INFO[t]['underlying_index']}] {title}"
+        summary = f"Market: {title[:150]}" + ("..." if len(title) > 150 else "")
+
+    band = sentiment_band(sentiment)
+    return {
+        "ticker": label,
+        "title": headline,
+        "sentiment": band,
+        "sentiment_class": f"sentiment-{band.lower()}",
+        "sentiment_score": sentiment,
+        "source": item.get("publisher") or ("Market News" if kind == "index" else "Financial News"),
+        "time": format_time_ago(item.get("published")),
+        "summary": summary,
+        "link": item.get("link", "")
     }
-    
-    positive_score = sum(weight for word, weight in positive_words.items() if word in title_lower)
-    negative_score = sum(weight for word, weight in negative_words.items() if word in title_lower)
-    
-    # Normalize to [-1, 1]
-    if positive_score + negative_score == 0:
-        return 0
-    
-    net_score = (positive_score - negative_score) / (positive_score + negative_score)
-    
-    # Apply damping to avoid extreme values
-    return net_score * 0.8
 
-@st.cache_data(ttl=1800)  # Cache for 30 minutes
 def fetch_real_news_sentiment(ticker=None):
+    """
+    Real news and sentiment analysis for one ETF or the whole list.
+    The full list is served from the background refresher's latest snapshot.
+    """
+    if ticker is None:
+        news = get_market_snapshot().get("news")
+        if news is not None:
+            return news
+    return fetch_news_sentiment((ticker,) if ticker else tuple(ETF_LIST))
+
+@st.cache_data(ttl=1800)  # Cache for 30 minutes
+def fetch_news_sentiment(tickers):
+    """Cached news fetch, used until the background refresher has data"""
+    return collect_news_sentiment(get_market_data_provider(), tickers, get_article_store(), get_headline_scorer(),
+                                  get_news_cache())
+
+def collect_news_sentiment(provider, tickers, store, scorer, cache=None):
     """
     Fetch real news and perform sentiment analysis
     Searches: ETFs, underlying stocks, and connected markets
-    Uses yfinance news API which aggregates from multiple sources
+    Uses yfinance news API which aggregates from multiple sources.
+    Every distinct symbol is fetched once, concurrently, even when it backs several ETFs.
+    Only headlines the article store has not linked to an ETF yet are scored and stored;
+    each ETF's score is the store's time-decayed average over its whole news history.
     """
     articles = []
     sentiment_scores = {}
     
     try:
-        tickers_to_search = [ticker] if ticker else ETF_LIST
-        
-        for t in tickers_to_search:
-            ticker_articles = []
-            ticker_sentiments = []
-            
-            # 1. ETF news via yfinance (aggregates from Yahoo Finance, which pulls from Reuters, Bloomberg, etc.)
-            try:
-                stock = yf.Ticker(t)
-                if hasattr(stock, 'news') and stock.news:
-                    for item in stock.news[:2]:  # Top 2 ETF articles
-                        title = item.get('title', '')
-                        if title:
-                            sentiment = analyze_sentiment_from_title(title)
-                            ticker_sentiments.append(sentiment)
-                            
-                            # Parse timestamp
-                            pub_time = item.get('providerPublishTime', 0)
-                            time_ago = "Recent"
-                            if pub_time:
-                                try:
-                                    pub_date = datetime.fromtimestamp(pub_time)
-                                    hours_ago = (datetime.now() - pub_date).total_seconds() / 3600
-                                    if hours_ago < 1:
-                                        time_ago = f"{int(hours_ago * 60)}m ago"
-                                    elif hours_ago < 24:
-                                        time_ago = f"{int(hours_ago)}h ago"
-                                    else:
-                                        time_ago = f"{int(hours_ago/24)}d ago"
-                                except:
-                                    time_ago = "Recent"
-                            
-                            ticker_articles.append({
-                                "ticker": t,
-                                "title": f"[{t} ETF] {title}",
-                                "sentiment": "POSITIVE" if sentiment > 0.3 else "NEGATIVE" if sentiment < -0.3 else "NEUTRAL",
-                                "sentiment_class": "sentiment-positive" if sentiment > 0.3 else "sentiment-negative" if sentiment < -0.3 else "sentiment-neutral",
-                                "sentiment_score": sentiment,
-                                "source": item.get('publisher', 'Financial News'),
-                                "time": time_ago,
-                                "summary": title[:200] + "..." if len(title) > 200 else title,
-                                "link": item.get('link', '')
-                            })
-            except Exception:
-                pass
-            
-            # 2. Underlying stocks news (weighted 0.7 since indirect)
-            underlying_stocks = ETF_INFO[t]["top_holdings"]
-            for stock_ticker in underlying_stocks[:2]:  # Top 2 holdings
-                try:
-                    stock = yf.Ticker(stock_ticker)
-                    if hasattr(stock, 'news') and stock.news:
-                        item = stock.news[0]
-                        title = item.get('title', '')
-                        if title:
-                            sentiment = analyze_sentiment_from_title(title)
-                            ticker_sentiments.append(sentiment * 0.7)  # Weighted lower
-                            
-                            pub_time = item.get('providerPublishTime', 0)
-                            time_ago = "Recent"
-                            if pub_time:
-                                try:
-                                    pub_date = datetime.fromtimestamp(pub_time)
-                                    hours_ago = (datetime.now() - pub_date).total_seconds() / 3600
-                                    time_ago = f"{int(hours_ago)}h ago" if hours_ago < 24 else f"{int(hours_ago/24)}d ago"
-                                except:
-                                    pass
-                            
-                            ticker_articles.append({
-                                "ticker": f"{t} ({stock_ticker})",
-                                "title": f"[{stock_ticker}] {title}",
-                                "sentiment": "POSITIVE" if sentiment > 0.3 else "NEGATIVE" if sentiment < -0.3 else "NEUTRAL",
-                                "sentiment_class": "sentiment-positive" if sentiment > 0.3 else "sentiment-negative" if sentiment < -0.3 else "sentiment-neutral",
-                                "sentiment_score": sentiment,
-                                "source": item.get('publisher', 'Financial News'),
-                                "time": time_ago,
-                                "summary": f"Holding in {t}: {title[:150]}" + ("..." if len(title) > 150 else ""),
-                                "link": item.get('link', '')
-                            })
-                except Exception:
-                    continue
-            
-            # 3. Market index news (weighted 0.5 since most indirect)
-            underlying_index = ETF_INFO[t]["underlying_index"]
-            index_ticker_map = {
-                "NASDAQ-100": "QQQ",
-                "S&P 500": "SPY",
-                "Technology Sector": "XLK"
-            }
-            
-            if underlying_index in index_ticker_map:
-                index_ticker = index_ticker_map[underlying_index]
-                try:
-                    index = yf.Ticker(index_ticker)
-                    if hasattr(index, 'news') and index.news:
-                        item = index.news[0]
-                        title = item.get('title', '')
-                        if title:
-                            sentiment = analyze_sentiment_from_title(title)
-                            ticker_sentiments.append(sentiment * 0.5)  # Weighted even lower
-                            
-                            pub_time = item.get('providerPublishTime', 0)
-                            time_ago = "Recent"
-                            if pub_time:
-                                try:
-                                    pub_date = datetime.fromtimestamp(pub_time)
-                                    hours_ago = (datetime.now() - pub_date).total_seconds() / 3600
-                                    time_ago = f"{int(hours_ago)}h ago" if hours_ago < 24 else f"{int(hours_ago/24)}d ago"
-                                except:
-                                    pass
-                            
-                            ticker_articles.append({
-                                "ticker": f"{t} (Market)",
-                                "title": f"[{underlying_index}] {title}",
-                                "sentiment": "POSITIVE" if sentiment > 0.3 else "NEGATIVE" if sentiment < -0.3 else "NEUTRAL",
-                                "sentiment_class": "sentiment-positive" if sentiment > 0.3 else "sentiment-negative" if sentiment < -0.3 else "sentiment-neutral",
-                                "sentiment_score": sentiment,
-                                "source": item.get('publisher', 'Market News'),
-                                "time": time_ago,
-                                "summary": f"Market: {title[:150]}" + ("..." if len(title) > 150 else ""),
-                                "link": item.get('link', '')
-                            })
-                except Exception:
-                    pass
-            
-            # Calculate average sentiment for this ETF
-            if ticker_sentiments:
-                sentiment_scores[t] = np.mean(ticker_sentiments)
-                articles.extend(ticker_articles)
+        plan = {t: news_sources(t) for t in tickers}
+        symbols = [symbol for sources in plan.values() for symbol, _, _ in sources]
+        news_by_symbol = fetch_concurrently(symbols, lambda symbol: fetch_symbol_news(provider, symbol),
+                                            cache=cache, timeout=NEWS_FETCH_TIMEOUT)
+        
+        # Every fetched headline linked to each ETF it informs, minus the links already stored
+        links = [
+            (t, symbol, kind, weight, item)
+            for t in tickers
+            for symbol, weight, kind in plan[t]
+            for item in news_by_symbol.get(symbol, [])
+            if item["title"] and item["id"]
+        ]
+        known = store.known([item["id"] for *_, item in links])
+        links = [link for link in links if (link[0], link[4]["id"]) not in known]
+        
+        # Score the new headlines in one batch and fold them into the decayed averages
+        scores = scorer.score_many([item["title"] for *_, item in links]).tolist()
+        store.ingest([
+            (t, symbol, kind, weight, dict(item, sentiment=score))
+            for (t, symbol, kind, weight, item), score in zip(links, scores)
+        ])
+        
+        sentiment = store.sentiment(tickers)
+        recent = store.recent(tickers, NEWS_ARTICLES_PER_TICKER)
+        for t in tickers:
+            sentiment_scores[t] = sentiment[t][0]
+            if recent[t]:
+                articles.extend(build_news_article(t, a["symbol"], a["kind"], a, a["sentiment"]) for a in recent[t])
             else:
                 # No news found
-                sentiment_scores[t] = 0
                 articles.append({
                     "ticker": t,
                     "title": f"{t}: No Recent News Available",
@@ -984,7 +1152,7 @@ def fetch_real_news_sentiment(ticker=None):
     except Exception as e:
         # If everything fails, return neutral sentiment
         return {
-            "sentiment_scores": {t: 0 for t in ETF_LIST},
+            "sentiment_scores": {t: 0 for t in tickers},
             "overall_sentiment": 0,
             "articles": [{
                 "ticker": "SYSTEM",
@@ -1176,164 +1344,172 @@ def generate_weekly_investment_recommendation():
     Analyze all factors and recommend which ETF to invest in this week
     Returns detailed recommendation with reasoning
     """
-    metrics = calculate_current_metrics()
-    
-    # Fetch real news sentiment
+    return get_analytics().get("weekly_rec")
+
+# Weekly advisor factors, scored for the whole universe at once. Each factor is an
+# if/elif ladder of (op, threshold) rungs; "cases" holds the explanation and warning
+# for each rung, then the default and, where a value can be missing, the NaN case.
+# Placeholders: {points}, {value} and {magnitude} (absolute value).
+DIVIDEND_STATUS = ["critical", "warning", "increase", "stable"]
+RISK_LEVELS = ["High", "Medium-High", "Medium"]
+
+WEEKLY_ADVISOR_FACTORS = {
+    # News sentiment (weight: 30%)
+    "sentiment": {
+        "weight": 30,
+        "rungs": [(">", 0.3), ("<", -0.3)],
+        "cases": [
+            ("✅ Positive news sentiment (+{points:.1f} pts)", None),
+            ("❌ Negative news sentiment ({points:.1f} pts)", "Recent negative news coverage"),
+            ("➖ Neutral news sentiment ({points:.1f} pts)", None)
+        ]
+    },
+    # 5-day price trend (weight: 25%) - contrarian, buying dips is good
+    "trend": {
+        "rungs": [("<", -5), ("<", -2), (">", 10)],
+        "points": [25, 20, 5, 15, 15],
+        "cases": [
+            ("✅ Price dipped {magnitude:.1f}% - buying opportunity! (+{points} pts)", None),
+            ("✅ Slight dip {magnitude:.1f}% - good entry (+{points} pts)", None),
+            ("⚠️ Price up {value:.1f}% - expensive (+{points} pts)", "Price near recent highs"),
+            ("➖ Price stable {value:+.1f}% (+{points} pts)", None),
+            ("➖ Insufficient price data (+{points} pts)", None)
+        ]
+    },
+    # Dividend stability (weight: 20%), value is the index into DIVIDEND_STATUS
+    "dividend": {
+        "rungs": [("==", 0), ("==", 1), ("==", 2)],
+        "points": [-10, 10, 25, 20],
+        "cases": [
+            ("🚨 Dividend dropping severely ({points} pts)", "Critical dividend decline"),
+            ("⚠️ Dividend declining moderately (+{points} pts)", "Dividend showing weakness"),
+            ("✅ Dividend increasing! (+{points} pts)", None),
+            ("✅ Dividend stable (+{points} pts)", None)
+        ]
+    },
+    # Current annual yield (weight: 15%)
+    "yield": {
+        "rungs": [(">", 80), (">", 50), (">", 30)],
+        "points": [15, 12, 10, 8],
+        "cases": [
+            ("✅ High annual yield {value:.1f}% (+{points} pts)", None),
+            ("✅ Good annual yield {value:.1f}% (+{points} pts)", None),
+            ("✅ Solid annual yield {value:.1f}% (+{points} pts)", None),
+            ("➖ Moderate annual yield {value:.1f}% (+{points} pts)", None)
+        ]
+    },
+    # Portfolio concentration (weight: 10%)
+    "concentration": {
+        "rungs": [(">", 50), (">", 40), ("<", 20)],
+        "points": [-10, 0, 10, 5],
+        "cases": [
+            ("⚠️ Overweight {value:.1f}% ({points} pts)", "Already {value:.1f}% of portfolio - diversify"),
+            ("⚠️ Near limit {value:.1f}% ({points} pts)", "Getting concentrated"),
+            ("✅ Underweight {value:.1f}% - room to grow (+{points} pts)", None),
+            ("➖ Balanced {value:.1f}% (+{points} pts)", None)
+        ]
+    },
+    # Risk level (weight: 10%), value is the index into RISK_LEVELS
+    "risk": {
+        "rungs": [("==", 0), ("==", 1), ("==", 2)],
+        "points": [5, 7, 10, 8],
+        "cases": [
+            ("⚠️ High risk level (+{points} pts)", None),
+            ("➖ Medium-high risk (+{points} pts)", None),
+            ("✅ Medium risk (+{points} pts)", None),
+            ("✅ Lower risk (+{points} pts)", None)
+        ]
+    }
+}
+
+# Price bars used for the trend factor
+TREND_DAYS = 5
+
+def price_trend(hist, days=TREND_DAYS):
+    """% change over the last `days` closes, NaN without enough data"""
     try:
-        news_data = fetch_real_news_sentiment()
+        if hist.empty or len(hist) < days:
+            return np.nan
+        closes = hist["Close"].tail(days)
+        return ((closes.iloc[-1] / closes.iloc[0]) - 1) * 100
     except Exception:
-        # Fallback to neutral if news fails
-        news_data = {
-            "sentiment_scores": {t: 0 for t in ETF_LIST},
-            "overall_sentiment": 0
-        }
-    
-    # Get price history for trend analysis
-    etf_scores = {}
-    
-    for ticker in ETF_LIST:
-        score = 0
-        factors = []
-        warnings = []
-        
-        # Factor 1: News Sentiment (Weight: 30%)
-        sentiment = news_data["sentiment_scores"].get(ticker, 0)
-        sentiment_score = sentiment * 30
-        score += sentiment_score
-        
-        if sentiment > 0.3:
-            factors.append(f"✅ Positive news sentiment (+{sentiment_score:.1f} pts)")
-        elif sentiment < -0.3:
-            factors.append(f"❌ Negative news sentiment ({sentiment_score:.1f} pts)")
-            warnings.append("Recent negative news coverage")
-        else:
-            factors.append(f"➖ Neutral news sentiment ({sentiment_score:.1f} pts)")
-        
-        # Factor 2: Price Trend (Weight: 25%)
-        try:
-            hist = get_price_history(ticker, period="1mo")
-            if not hist.empty and len(hist) >= 5:
-                recent_prices = hist['Close'].tail(5)
-                price_change = ((recent_prices.iloc[-1] / recent_prices.iloc[0]) - 1) * 100
-                
-                # Contrarian approach: buying dips is good
-                if price_change < -5:
-                    trend_score = 25  # Great buying opportunity
-                    factors.append(f"✅ Price dipped {abs(price_change):.1f}% - buying opportunity! (+25 pts)")
-                elif price_change < -2:
-                    trend_score = 20
-                    factors.append(f"✅ Slight dip {abs(price_change):.1f}% - good entry (+20 pts)")
-                elif price_change > 10:
-                    trend_score = 5  # Expensive, maybe wait
-                    factors.append(f"⚠️ Price up {price_change:.1f}% - expensive (+5 pts)")
-                    warnings.append("Price near recent highs")
-                else:
-                    trend_score = 15  # Normal
-                    factors.append(f"➖ Price stable {price_change:+.1f}% (+15 pts)")
-                
-                score += trend_score
-            else:
-                score += 15  # Default if no data
-                factors.append("➖ Insufficient price data (+15 pts)")
-        except:
-            score += 15
-            factors.append("➖ Could not analyze price trend (+15 pts)")
-        
-        # Factor 3: Dividend Stability (Weight: 20%)
-        div_alerts = [a for a in analyze_dividend_trends() if a["ticker"] == ticker]
-        
-        if any(a["severity"] == "critical" for a in div_alerts):
-            div_score = -10
-            factors.append(f"🚨 Dividend dropping severely ({div_score} pts)")
-            warnings.append("Critical dividend decline")
-        elif any(a["severity"] == "warning" for a in div_alerts):
-            div_score = 10
-            factors.append(f"⚠️ Dividend declining moderately (+{div_score} pts)")
-            warnings.append("Dividend showing weakness")
-        elif any(a["type"] == "dividend_increase" for a in div_alerts):
-            div_score = 25
-            factors.append(f"✅ Dividend increasing! (+{div_score} pts)")
-        else:
-            div_score = 20
-            factors.append(f"✅ Dividend stable (+{div_score} pts)")
-        
-        score += div_score
-        
-        # Factor 4: Current Yield (Weight: 15%)
-        holding = next((h for h in metrics["holdings"] if h["ticker"] == ticker), None)
-        if holding:
-            yield_pct = holding["yield_pct"]
-            
-            if yield_pct > 80:
-                yield_score = 15
-                factors.append(f"✅ High annual yield {yield_pct:.1f}% (+{yield_score} pts)")
-            elif yield_pct > 50:
-                yield_score = 12
-                factors.append(f"✅ Good annual yield {yield_pct:.1f}% (+{yield_score} pts)")
-            elif yield_pct > 30:
-                yield_score = 10
-                factors.append(f"✅ Solid annual yield {yield_pct:.1f}% (+{yield_score} pts)")
-            else:
-                yield_score = 8
-                factors.append(f"➖ Moderate annual yield {yield_pct:.1f}% (+{yield_score} pts)")
-            
-            score += yield_score
-        
-        # Factor 5: Portfolio Concentration (Weight: 10%)
-        concentration = (holding["value"] / metrics["total_value"] * 100) if metrics["total_value"] > 0 else 0
-        
-        if concentration > 50:
-            conc_score = -10
-            factors.append(f"⚠️ Overweight {concentration:.1f}% ({conc_score} pts)")
-            warnings.append(f"Already {concentration:.1f}% of portfolio - diversify")
-        elif concentration > 40:
-            conc_score = 0
-            factors.append(f"⚠️ Near limit {concentration:.1f}% (0 pts)")
-            warnings.append("Getting concentrated")
-        elif concentration < 20:
-            conc_score = 10
-            factors.append(f"✅ Underweight {concentration:.1f}% - room to grow (+{conc_score} pts)")
-        else:
-            conc_score = 5
-            factors.append(f"➖ Balanced {concentration:.1f}% (+{conc_score} pts)")
-        
-        score += conc_score
-        
-        # Factor 6: Risk Level (Weight: 10%)
-        risk_level = ETF_INFO[ticker]["risk_level"]
-        
-        if risk_level == "High":
-            risk_score = 5
-            factors.append(f"⚠️ High risk level (+{risk_score} pts)")
-        elif risk_level == "Medium-High":
-            risk_score = 7
-            factors.append(f"➖ Medium-high risk (+{risk_score} pts)")
-        elif risk_level == "Medium":
-            risk_score = 10
-            factors.append(f"✅ Medium risk (+{risk_score} pts)")
+        return np.nan
+
+def risk_levels(tickers):
+    """Index of each fund's risk level in RISK_LEVELS, len(RISK_LEVELS) for anything lower"""
+    return np.array([
+        RISK_LEVELS.index(ETF_INFO[t]["risk_level"]) if ETF_INFO[t]["risk_level"] in RISK_LEVELS else len(RISK_LEVELS)
+        for t in tickers
+    ])
+
+def describe_factors(i, values, breakdown, field):
+    """Explanation (field 0) or warning (field 1) strings for candidate i"""
+    lines = []
+    for name, (points, case) in breakdown.items():
+        template = WEEKLY_ADVISOR_FACTORS[name]["cases"][case[i]][field]
+        if template:
+            value = values[name][i]
+            lines.append(template.format(points=points[i], value=value, magnitude=abs(value)))
+    return lines
+
+def compute_weekly_recommendation(metrics, news_data, div_alerts, *histories):
+    holdings = metrics["holdings"]
+    tickers = holdings.tickers
+    index = holdings.index
+
+    dividend_status = np.full(len(tickers), DIVIDEND_STATUS.index("stable"))
+    for alert in div_alerts:
+        if alert["ticker"] not in index:
+            continue
+        if alert["severity"] in ("critical", "warning"):
+            status = DIVIDEND_STATUS.index(alert["severity"])
+        elif alert["type"] == "dividend_increase":
+            status = DIVIDEND_STATUS.index("increase")
         else:
-            risk_score = 8
-            factors.append(f"✅ Lower risk (+{risk_score} pts)")
-        
-        score += risk_score
-        
-        # Store results
+            continue
+        i = index[alert["ticker"]]
+        dividend_status[i] = min(dividend_status[i], status)
+
+    total_value = metrics["total_value"]
+    values = {
+        "sentiment": np.array([news_data["sentiment_scores"].get(t, 0) for t in tickers], dtype=float),
+        "trend": np.array([price_trend(h) for h in histories], dtype=float),
+        "dividend": dividend_status,
+        "yield": holdings["yield_pct"],
+        "concentration": holdings["value"] / total_value * 100 if total_value > 0 else np.zeros(len(tickers)),
+        "risk": risk_levels(tickers)
+    }
+    total, breakdown = score_factors(values, WEEKLY_ADVISOR_FACTORS)
+    total = np.round(total, 1)
+
+    # Warnings feed the rebalance plan for every fund; explanations only for the podium
+    warned = np.zeros(len(tickers), dtype=bool)
+    for name, (points, case) in breakdown.items():
+        cases = WEEKLY_ADVISOR_FACTORS[name]["cases"]
+        warned |= np.isin(case, [c for c, (_, warning) in enumerate(cases) if warning])
+    # A fund without a quote can't be bought this week, however well it scores
+    priced = np.nan_to_num(holdings["price"]) > 0
+    top = top_k(np.where(priced, total, -np.inf), min(3, max(int(priced.sum()), 1)))
+
+    etf_scores = {}
+    for i, ticker in enumerate(tickers):
         etf_scores[ticker] = {
-            "total_score": round(score, 1),
-            "factors": factors,
-            "warnings": warnings,
-            "sentiment": sentiment,
-            "yield": holding["yield_pct"] if holding else 0,
-            "concentration": concentration,
-            "price": holding["price"] if holding else 0
+            "total_score": float(total[i]),
+            "warnings": describe_factors(i, values, breakdown, 1) if warned[i] else [],
+            "sentiment": float(values["sentiment"][i]),
+            "yield": float(values["yield"][i]),
+            "concentration": float(values["concentration"][i]),
+            "price": float(holdings["price"][i])
         }
-    
-    # Find best option
-    best_ticker = max(etf_scores.keys(), key=lambda t: etf_scores[t]["total_score"])
+    for i in top:
+        etf_scores[tickers[i]]["factors"] = describe_factors(i, values, breakdown, 0)
+
+    best_ticker = tickers[top[0]]
     best_score = etf_scores[best_ticker]
+    alternative = tickers[top[1]] if len(top) > 1 else best_ticker
     
     # Generate recommendation confidence
-    score_diff = best_score["total_score"] - sorted([s["total_score"] for s in etf_scores.values()])[-2]
+    score_diff = best_score["total_score"] - etf_scores[alternative]["total_score"]
     
     if score_diff > 20:
         confidence = "VERY HIGH"
@@ -1353,121 +1529,106 @@ def generate_weekly_investment_recommendation():
         "confidence": confidence,
         "confidence_color": confidence_color,
         "all_scores": etf_scores,
+        "top": [tickers[i] for i in top],
         "reasoning": best_score["factors"],
         "warnings": best_score["warnings"],
-        "alternative": sorted(etf_scores.keys(), key=lambda t: etf_scores[t]["total_score"])[-2]
+        "alternative": alternative
     }
 
 def generate_auto_rebalance_plan():
     """
     Generate automatic rebalancing plan based on current conditions
     """
-    metrics = calculate_current_metrics()
-    risk_score = calculate_portfolio_risk_score()
+    return get_analytics().get("rebalance_plan")
+
+# Rebalancer constraints: largest position (% of portfolio), weighted risk budget per
+# autopilot risk tolerance, and the advisor score below which a fund is never bought
+REBALANCE_CONCENTRATION_CAP = 35
+RISK_WEIGHTS = {"Low": 1, "Medium": 2, "Medium-High": 3, "High": 4}
+RISK_BUDGETS = {"conservative": 2.5, "moderate": 3.0, "aggressive": 4.0}
+WEAK_SCORE = 40
+
+def risk_weights(tickers):
+    """Per-$ risk weight of each fund for the rebalancer's risk budget"""
+    return np.array([RISK_WEIGHTS.get(ETF_INFO[t]["risk_level"], 2) for t in tickers], dtype=float)
+
+def compute_rebalance_plan(metrics, weekly_rec, settings, optimizer):
+    holdings = metrics["holdings"]
+    tickers = holdings.tickers
+    shares, price = holdings["shares"], holdings["price"]
+    monthly_div = holdings["div"] * 52 / 12
+    scores = np.array([weekly_rec["all_scores"][t]["total_score"] for t in tickers])
+    risk = risk_weights(tickers)
+
+    plan = optimizer.solve(
+        shares, price, monthly_div, risk,
+        cash=0.0,
+        cap=REBALANCE_CONCENTRATION_CAP / 100,
+        risk_budget=RISK_BUDGETS[settings["risk_tolerance"]],
+        turnover=settings["max_action_size"] / 100,
+        buyable=scores >= WEAK_SCORE
+    )
+    buy, sell = plan["buy"], plan["sell"]
+
+    total_value = metrics["total_value"]
+    before = holdings["value"] / total_value * 100 if total_value > 0 else np.zeros(len(tickers))
+    after = price * (shares + buy - sell) / total_value * 100 if total_value > 0 else np.zeros(len(tickers))
     
     rebalance_actions = []
-    
-    # Check if rebalancing is needed
-    needs_rebalancing = False
-    
-    # Check 1: Concentration risk
-    for holding in metrics["holdings"]:
-        concentration = (holding["value"] / metrics["total_value"] * 100) if metrics["total_value"] > 0 else 0
-        
-        if concentration > 45:
-            needs_rebalancing = True
-            
-            # Calculate how much to sell
-            target_concentration = 35
-            excess_pct = concentration - target_concentration
-            shares_to_sell = int(holding["shares"] * (excess_pct / concentration))
-            proceeds = shares_to_sell * holding["price"]
-            
-            rebalance_actions.append({
-                "type": "SELL",
-                "ticker": holding["ticker"],
-                "shares": shares_to_sell,
-                "proceeds": proceeds,
-                "reason": f"Reduce concentration from {concentration:.1f}% to ~{target_concentration}%",
-                "priority": "HIGH"
-            })
-    
-    # Check 2: Weak performers with bad news
-    weekly_rec = generate_weekly_investment_recommendation()
-    
-    for ticker, score_data in weekly_rec["all_scores"].items():
-        if score_data["total_score"] < 40 and score_data["warnings"]:
-            holding = next((h for h in metrics["holdings"] if h["ticker"] == ticker), None)
-            
-            if holding and holding["shares"] > 0:
-                # Suggest reducing by 20%
-                shares_to_sell = int(holding["shares"] * 0.2)
-                proceeds = shares_to_sell * holding["price"]
-                
-                rebalance_actions.append({
-                    "type": "SELL",
-                    "ticker": ticker,
-                    "shares": shares_to_sell,
-                    "proceeds": proceeds,
-                    "reason": f"Weak performance (score: {score_data['total_score']:.1f}/100) + warnings",
-                    "priority": "MEDIUM"
-                })
-    
-    # Check 3: Where to reinvest proceeds
-    if rebalance_actions:
-        total_proceeds = sum(a["proceeds"] for a in rebalance_actions if a["type"] == "SELL")
-        
-        # Recommend buying the best performer
-        best_ticker = weekly_rec["recommended_ticker"]
-        best_price = metrics["prices"][best_ticker]
-        shares_to_buy = int(total_proceeds / best_price)
-        
+    for i in np.flatnonzero(sell):
+        ticker = tickers[i]
+        score_data = weekly_rec["all_scores"][ticker]
+        if before[i] > REBALANCE_CONCENTRATION_CAP:
+            reason, priority = f"Reduce concentration from {before[i]:.1f}% to ~{after[i]:.1f}%", "HIGH"
+        elif score_data["total_score"] < WEAK_SCORE and score_data["warnings"]:
+            reason, priority = f"Weak performance (score: {score_data['total_score']:.1f}/100) + warnings", "MEDIUM"
+        else:
+            reason, priority = f"Rotate into higher-income funds ({holdings['yield_pct'][i]:.1f}% yield)", "MEDIUM"
+        rebalance_actions.append({
+            "type": "SELL",
+            "ticker": ticker,
+            "shares": int(sell[i]),
+            "proceeds": float(sell[i] * price[i]),
+            "reason": reason,
+            "priority": priority
+        })
+    for i in np.flatnonzero(buy):
+        ticker = tickers[i]
         rebalance_actions.append({
             "type": "BUY",
-            "ticker": best_ticker,
-            "shares": shares_to_buy,
-            "cost": shares_to_buy * best_price,
-            "reason": f"Highest score ({weekly_rec['all_scores'][best_ticker]['total_score']:.1f}/100)",
+            "ticker": ticker,
+            "shares": int(buy[i]),
+            "cost": float(buy[i] * price[i]),
+            "reason": f"Adds ${buy[i] * monthly_div[i]:.2f}/month (score: {scores[i]:.1f}/100)",
             "priority": "HIGH"
         })
     
     # Calculate income impact
     income_before = metrics["monthly_income"]
-    income_after = income_before
-    
-    for action in rebalance_actions:
-        ticker = action["ticker"]
-        div = st.session_state.holdings[ticker]["div"]
-        
-        if action["type"] == "SELL":
-            income_after -= action["shares"] * div * 52 / 12
-        else:  # BUY
-            income_after += action["shares"] * div * 52 / 12
-    
+    income_after = income_before + plan["income_change"]
     income_change = income_after - income_before
     
+    if any(a["type"] == "SELL" for a in rebalance_actions):
+        risk_improvement = f"Largest position {before.max():.1f}% → {after.max():.1f}% of portfolio"
+    else:
+        risk_improvement = "Maintains balance"
+    
     return {
-        "needs_rebalancing": needs_rebalancing or len(rebalance_actions) > 0,
+        "needs_rebalancing": len(rebalance_actions) > 0,
         "actions": rebalance_actions,
         "income_before": income_before,
         "income_after": income_after,
         "income_change": income_change,
-        "risk_improvement": "Reduces concentration risk" if any(a["type"] == "SELL" for a in rebalance_actions) else "Maintains balance"
+        "risk_improvement": risk_improvement
     }
 
 def generate_ai_recommendations():
     """Generate AI-powered actionable recommendations"""
+    return get_analytics().get("ai_recommendations")
+
+def compute_ai_recommendations(metrics, risk_score, div_alerts, price_alerts, news_data, cash, target_income):
     recommendations = []
-    metrics = calculate_current_metrics()
-    risk_score = calculate_portfolio_risk_score()
-    div_alerts = analyze_dividend_trends()
-    price_alerts = check_price_alerts()
-    
-    # Fetch real news sentiment
-    try:
-        news_data = fetch_real_news_sentiment()
-    except:
-        news_data = {"sentiment_scores": {t: 0 for t in ETF_LIST}, "overall_sentiment": 0}
+    holdings = metrics["holdings"]
     
     # 1. Dividend-based recommendations
     for alert in div_alerts:
@@ -1479,7 +1640,7 @@ def generate_ai_recommendations():
                 "title": f"🚨 Action Required: {alert['ticker']} Dividend Crisis",
                 "description": alert["message"],
                 "action": alert["action"],
-                "impact": f"Potential income loss: ${abs(alert['change_pct']) * st.session_state.holdings[alert['ticker']]['shares'] * alert['current_avg'] * 52 / 100:.2f}/year",
+                "impact": f"Potential income loss: ${abs(alert['change_pct']) * holdings.row(alert['ticker'])['shares'] * alert['current_avg'] * 52 / 100:.2f}/year",
                 "confidence": 95
             })
     
@@ -1492,8 +1653,8 @@ def generate_ai_recommendations():
                 "ticker": alert["ticker"],
                 "title": alert["message"],
                 "description": alert["action"],
-                "action": f"Sell {st.session_state.holdings[alert['ticker']]['shares']} shares at market price",
-                "impact": f"Lock in loss of ${metrics['holdings'][[h['ticker'] for h in metrics['holdings']].index(alert['ticker'])]['gain_loss']:.2f}",
+                "action": f"Sell {holdings.row(alert['ticker'])['shares']} shares at market price",
+                "impact": f"Lock in loss of ${holdings.row(alert['ticker'])['gain_loss']:.2f}",
                 "confidence": 100
             })
     
@@ -1511,7 +1672,7 @@ def generate_ai_recommendations():
                 "confidence": 70
             })
         elif sentiment > 0.5:
-            current_concentration = next((h["value"] / metrics["total_value"] * 100 for h in metrics["holdings"] if h["ticker"] == ticker), 0)
+            current_concentration = holdings.row(ticker)["weight"] * 100 if ticker in holdings else 0
             if current_concentration < 40:
                 recommendations.append({
                     "priority": "LOW",
@@ -1538,20 +1699,21 @@ def generate_ai_recommendations():
         })
     
     # 5. Income optimization
-    if metrics["monthly_income"] < st.session_state.target_income:
-        gap = st.session_state.target_income - metrics["monthly_income"]
+    if metrics["monthly_income"] < target_income:
+        gap = target_income - metrics["monthly_income"]
         # Find best yielding ETF
-        best_yield_holding = max(metrics["holdings"], key=lambda x: x["yield_pct"])
-        shares_needed = int((gap * 12 / 52) / best_yield_holding["div"])
+        best_yield_holding = holdings.row(holdings.tickers[int(np.argmax(holdings["yield_pct"]))])
+        has_yield = best_yield_holding["div"] > 0
+        shares_needed = int((gap * 12 / 52) / best_yield_holding["div"]) if has_yield else 0
         cost = shares_needed * best_yield_holding["price"]
         
-        if st.session_state.cash >= cost:
+        if has_yield and cash >= cost:
             recommendations.append({
                 "priority": "MEDIUM",
                 "type": "income_boost",
                 "ticker": best_yield_holding["ticker"],
                 "title": "💰 Income Opportunity Available",
-                "description": f"You have ${st.session_state.cash:.2f} in cash and need ${gap:.2f}/month more income",
+                "description": f"You have ${cash:.2f} in cash and need ${gap:.2f}/month more income",
                 "action": f"Buy {shares_needed} shares of {best_yield_holding['ticker']} (highest yield at {best_yield_holding['yield_pct']:.1f}%)",
                 "impact": f"Close income gap by ${shares_needed * best_yield_holding['div'] * 52 / 12:.2f}/month",
                 "confidence": 80
@@ -1563,6 +1725,354 @@ def generate_ai_recommendations():
     
     return recommendations
 
+# =====================================================
+# DERIVED ANALYTICS GRAPH
+# =====================================================
+
+def load_news_data():
+    """News sentiment for the analytics graph, neutral if news is unavailable"""
+    try:
+        return fetch_real_news_sentiment()
+    except Exception:
+        return {"sentiment_scores": {t: 0 for t in ETF_LIST}, "overall_sentiment": 0}
+
+def load_trend_history(ticker):
+    """One month of daily bars for the weekly advisor's price trend factor"""
+    try:
+        return get_price_history(ticker, period="1mo")
+    except Exception:
+        return pd.DataFrame()
+
+def get_analytics():
+    """
+    Every derived quantity as a node keyed by its inputs, built once per rerun.
+    Results persist in session state, so a node only recomputes when one of its
+    inputs changed - e.g. editing a holding leaves dividend trends untouched.
+    """
+    if "analytics" in _RERUN_CACHE:
+        return _RERUN_CACHE["analytics"]
+
+    graph = AnalyticsGraph(st.session_state.analytics_memo)
+    histories = [f"history:{t}" for t in ETF_LIST]
+
+    # Inputs - session state is volatile because widgets edit it mid-rerun
+    graph.input("cash", lambda: st.session_state.cash, volatile=True)
+    graph.input("target_income", lambda: st.session_state.target_income, volatile=True)
+    graph.input("dividend_drop_threshold", lambda: st.session_state.dividend_drop_threshold, volatile=True)
+    graph.input("price_alert_settings", lambda: st.session_state.price_alerts, volatile=True)
+    graph.input("holdings", lambda: st.session_state.holdings, volatile=True)
+    graph.input("rebalance_settings", lambda: {
+        k: st.session_state.autopilot[k] for k in ("risk_tolerance", "max_action_size")
+    }, volatile=True)
+    graph.input("prices", lambda: get_price_snapshot()["prices"])
+    graph.input("dividends", get_dividend_trends_version)
+    graph.input("news", load_news_data)
+    for ticker in ETF_LIST:
+        graph.input(f"history:{ticker}", lambda t=ticker: load_trend_history(t))
+
+    # Derived nodes
+    graph.node("metrics", ["holdings", "prices", "cash"],
+               lambda holdings, prices, cash: compute_portfolio_metrics(ETF_LIST, holdings, prices, cash))
+    graph.node("dividend_trends", ["dividends", "dividend_drop_threshold"], compute_dividend_trends)
+    graph.node("price_alerts", ["metrics", "price_alert_settings"], compute_price_alerts)
+    graph.node("risk_score", ["metrics", "dividend_trends"], compute_risk_score)
+    graph.node("weekly_rec", ["metrics", "news", "dividend_trends"] + histories, compute_weekly_recommendation)
+    graph.node("rebalance_plan", ["metrics", "weekly_rec", "rebalance_settings"],
+               lambda *args: compute_rebalance_plan(*args, st.session_state.rebalance_optimizer))
+    graph.node("ai_recommendations",
+               ["metrics", "risk_score", "dividend_trends", "price_alerts", "news", "cash", "target_income"],
+               compute_ai_recommendations)
+
+    _RERUN_CACHE["analytics"] = graph
+    return graph
+
+# =====================================================
+# SCENARIO SWEEP
+# =====================================================
+
+# Share of each distribution put back into the portfolio; the rest is paid out
+REINVEST_POLICIES = {
+    "Reinvest 100%": 1.0,
+    "Reinvest 75%": 0.75,
+    "Reinvest 50%": 0.5,
+    "Reinvest 25%": 0.25
+}
+
+# Grid points along each axis of the sweep
+SWEEP_STEPS = 11
+
+# Horizon of the sweep - 30 years, as in the single projection
+SWEEP_MONTHS = 360
+
+@st.cache_data(max_entries=64)
+def compute_scenario_sweep(shares, div, price, deposits, targets, policies):
+    """Years to target over the deposit x target x policy grid, cached on its inputs"""
+    months = sweep_compound_growth(
+        np.array(shares), np.array(div), np.array(price),
+        deposits, targets, [REINVEST_POLICIES[p] for p in policies], max_months=SWEEP_MONTHS
+    )
+    years = np.where(months < SWEEP_MONTHS, months / 12, np.nan)
+    return {policy: years[i] for i, policy in enumerate(policies)}
+
+# Labels for what the goal solver can solve for
+GOAL_OPTIONS = {
+    "deposit": "Monthly deposit",
+    "cash": "Starting lump sum",
+    "yield": "Annual portfolio yield"
+}
+
+# =====================================================
+# MONTE CARLO PROJECTION
+# =====================================================
+
+# Path counts offered in the projections tab
+MC_PATH_OPTIONS = [10_000, 100_000, 250_000]
+
+# Shards per worker - a few per worker keeps the pool busy when shards finish unevenly
+MC_SHARDS_PER_WORKER = 4
+
+# Fewer joint months than this and the bootstrap mostly replays the same handful of rows
+MC_MIN_SCENARIOS = 6
+
+@st.cache_resource
+def get_simulation_pool():
+    """Process pool for Monte Carlo shards, shared by all sessions"""
+    return ProcessPoolExecutor(
+        max_workers=os.cpu_count() or 1,
+        mp_context=multiprocessing.get_context("spawn")
+    )
+
+def load_stored_history(tickers):
+    """({ticker: raw daily closes}, {ticker: distributions by ex-date}) from the local stores"""
+    history_store = get_history_store()
+    dividend_store = get_dividend_store()
+    closes = {}
+    distributions = {}
+    for ticker in tickers:
+        try:
+            bars = history_store.load(ticker, "1d")
+            closes[ticker] = bars["Close"] if not bars.empty else pd.Series(dtype=float)
+            dividends = dividend_store.load(ticker)
+            distributions[ticker] = dividends.set_index("ex_date")["amount"]
+        except Exception:
+            closes[ticker] = pd.Series(dtype=float)
+            distributions[ticker] = pd.Series(dtype=float)
+    return closes, distributions
+
+def load_monthly_scenarios(tickers):
+    """Joint monthly price-return / distribution-change rows from the local stores"""
+    return monthly_scenarios(*load_stored_history(tickers))
+
+def run_monte_carlo_projection(n_paths):
+    """Percentile bands for value, income and time to target over bootstrapped market paths"""
+    holdings = calculate_current_metrics()["holdings"]
+    held = holdings["shares"] > 0
+    tickers = [t for t, h in zip(holdings.tickers, held) if h]
+    price_returns, dist_changes = load_monthly_scenarios(tickers)
+    workers = os.cpu_count() or 1
+    try:
+        pool = get_simulation_pool()
+    except Exception:
+        pool = None
+    result = run_monte_carlo(
+        pool, n_paths, workers * MC_SHARDS_PER_WORKER,
+        shares=holdings["shares"][held], div=holdings["div"][held], price=holdings["price"][held],
+        cash=st.session_state.cash, monthly_deposit=st.session_state.monthly_deposit,
+        target=st.session_state.target_income,
+        price_returns=price_returns, dist_changes=dist_changes
+    )
+    result["scenarios"] = len(price_returns)
+    return result
+
+# =====================================================
+# HISTORICAL BACKTESTS
+# =====================================================
+
+# Years of stored history offered for replays
+BACKTEST_YEARS = [1, 3, 5, 10]
+
+# Trailing window for a fund's distribution yield at each replayed week
+BACKTEST_YIELD_DAYS = 365
+
+# Trading-cost scenarios the walk-forward rebalancer starts with; the autopilot
+# settings fill in the rest of each row
+WALK_FORWARD_COSTS = [
+    {"commission": 0.0, "spread_pct": 0.0, "whole_shares": False},
+    {"commission": 0.0, "spread_pct": 0.1, "whole_shares": True},
+    {"commission": 1.0, "spread_pct": 0.3, "whole_shares": True}
+]
+
+# Stop-loss / target-gain grid (% from entry) for the price alert backtest; inf turns a rule off
+ALERT_STOP_LOSS_PCTS = [5, 10, 15, 20, 25, 30, 40, 50, np.inf]
+ALERT_TARGET_PCTS = [10, 20, 30, 50, 75, 100, 150, np.inf]
+ALERT_BACKTEST_INTERVALS = {"1d": "Daily bars", "1h": "Hourly bars", "1m": "1-minute bars"}
+
+def backtest_weeks(dates, years):
+    """Last trading day of every week within the final `years` of `dates`"""
+    weeks = week_ends(dates)
+    return weeks[dates[weeks] >= dates[-1] - pd.DateOffset(years=years)]
+
+def advisor_week_scores(tickers, dates, close, dist, weeks, drop_threshold):
+    """
+    Weekly advisor score of every fund at every week, from every factor but
+    concentration (which depends on what a replay holds by then)
+    """
+    change = distribution_change(dist)[weeks]
+    dividend = np.select(
+        [change < -drop_threshold, change < DIVIDEND_DECLINE_PCT, change > DIVIDEND_INCREASE_PCT],
+        [DIVIDEND_STATUS.index("critical"), DIVIDEND_STATUS.index("warning"), DIVIDEND_STATUS.index("increase")],
+        default=DIVIDEND_STATUS.index("stable")
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        yield_pct = trailing_sum(dates, dist, BACKTEST_YIELD_DAYS)[weeks] / close[weeks] * 100
+    values = {
+        "sentiment": np.zeros(dividend.shape),  # no headline history - every fund scores neutral
+        "trend": trailing_change(close, TREND_DAYS)[weeks],
+        "dividend": dividend,
+        "yield": np.nan_to_num(yield_pct),
+        "risk": np.broadcast_to(risk_levels(tickers), dividend.shape)
+    }
+    weekly_factors = {name: f for name, f in WEEKLY_ADVISOR_FACTORS.items() if name != "concentration"}
+    return score_factors(values, weekly_factors)[0]
+
+@st.cache_data(ttl=3600, max_entries=16, show_spinner=False)
+def compute_advisor_backtest(tickers, years, amount, drop_threshold):
+    """
+    Replay the weekly advisor over the last `years` of stored history: each week
+    scores every fund on WEEKLY_ADVISOR_FACTORS as of that week and buys the best,
+    against splitting the same amount equally. Returns None without history.
+    """
+    dates, close, dist = daily_panel(*load_stored_history(tickers))
+    if len(dates) == 0:
+        return None
+    weeks = backtest_weeks(dates, years)
+    score = advisor_week_scores(tickers, dates, close, dist, weeks, drop_threshold)
+
+    result = simulate_weekly_buys(close, dist, weeks, amount, score, WEEKLY_ADVISOR_FACTORS["concentration"])
+    result["dates"] = dates[weeks]
+    result["tickers"] = list(tickers)
+    return result
+
+@st.cache_data(ttl=3600, max_entries=16, show_spinner=False)
+def compute_alert_backtest(positions, interval, years):
+    """
+    Sweep ALERT_STOP_LOSS_PCTS x ALERT_TARGET_PCTS over stored (raw) bars: each
+    (ticker, value) position is bought at the first close of the window and
+    sold at the first stop or target crossing. Capital and income per setting,
+    summed over positions, against holding every position to the end.
+    """
+    dividend_store = get_dividend_store()
+    shape = (len(ALERT_STOP_LOSS_PCTS), len(ALERT_TARGET_PCTS))
+    result = {
+        "capital": np.zeros(shape), "income": np.zeros(shape),
+        "stopped": np.zeros(shape, dtype=int), "targeted": np.zeros(shape, dtype=int),
+        "hold_capital": 0.0, "hold_income": 0.0, "positions": []
+    }
+    for ticker, value in positions:
+        try:
+            bars = get_price_history(ticker, period=f"{years}y" if interval == "1d" else "max", interval=interval)
+            bars = bars.dropna(subset=["Open", "High", "Low", "Close"])
+            dividends = dividend_store.load(ticker, start=bars.index[0]) if len(bars) else None
+        except Exception:
+            continue
+        if len(bars) < 2:
+            continue
+
+        dist = np.zeros(len(bars))
+        rows = bars.index.searchsorted(dividends["ex_date"])
+        keep = rows < len(bars)
+        np.add.at(dist, rows[keep], dividends["amount"].to_numpy()[keep])
+        sweep = exit_rule_sweep(bars["Open"].to_numpy(), bars["Low"].to_numpy(), bars["High"].to_numpy(),
+                                bars["Close"].to_numpy(), dist, ALERT_STOP_LOSS_PCTS, ALERT_TARGET_PCTS)
+
+        shares = value / bars["Close"].iloc[0]
+        capital, income = shares * sweep["exit_price"], shares * sweep["income"]
+        hold_capital, hold_income = shares * bars["Close"].iloc[-1], shares * dist[1:].sum()
+        result["capital"] += capital
+        result["income"] += income
+        result["stopped"] += sweep["kind"] == 1
+        result["targeted"] += sweep["kind"] == 2
+        result["hold_capital"] += hold_capital
+        result["hold_income"] += hold_income
+        result["positions"].append({
+            "ticker": ticker, "start": bars.index[0], "kind": sweep["kind"],
+            "exit_time": bars.index[sweep["exit_bar"].ravel()].to_numpy().reshape(shape),
+            "capital": capital, "income": income, "hold_capital": hold_capital, "hold_income": hold_income
+        })
+    return result
+
+def run_rebalance_walk_forward(param_sets, years):
+    """
+    Follow the auto-rebalancer weekly over the last `years` from today's holdings,
+    once per parameter set, on the simulation pool. Returns None without history.
+    """
+    metrics = calculate_current_metrics()
+    holdings = metrics["holdings"]
+    tickers = holdings.tickers
+    dates, close, dist = daily_panel(*load_stored_history(tickers))
+    if len(dates) == 0 or holdings["value"].sum() <= 0:
+        return None
+    weeks = backtest_weeks(dates, years)
+
+    common = dict(
+        close=close, dist=dist, weeks=weeks,
+        income=trailing_sum(dates, dist, BACKTEST_YIELD_DAYS)[weeks] / 12,
+        weights=holdings["value"], capital=float(holdings["value"].sum()),
+        risk=risk_weights(tickers),
+        score=advisor_week_scores(tickers, dates, close, dist, weeks, st.session_state.dividend_drop_threshold),
+        concentration=WEEKLY_ADVISOR_FACTORS["concentration"], min_score=WEAK_SCORE,
+        cap=REBALANCE_CONCENTRATION_CAP / 100
+    )
+    runs = [dict(
+        common, risk_budget=RISK_BUDGETS[p["risk_tolerance"]], turnover=p["max_action_size"] / 100,
+        commission=p["commission"], spread_pct=p["spread_pct"], whole_shares=p["whole_shares"]
+    ) for p in param_sets]
+    try:
+        pool = get_simulation_pool()
+    except Exception:
+        pool = None
+    if pool is None:
+        results = [walk_forward_rebalance(**run) for run in runs]
+    else:
+        futures = [pool.submit(walk_forward_rebalance, **run) for run in runs]
+        results = [future.result() for future in futures]
+    return {"dates": dates[weeks], "params": list(param_sets), "results": results}
+
+# =====================================================
+# BACKGROUND MARKET DATA REFRESHER
+# =====================================================
+
+# Seconds between background refreshes of each dataset
+REFRESH_SCHEDULE = {
+    "prices": 60,
+    "histories": 900,
+    "news": 900,
+    "dividends": 21600
+}
+
+# How long the first rerun of a fresh server process waits for initial data
+REFRESHER_WARMUP_TIMEOUT = 20
+
+@st.cache_resource
+def get_market_refresher():
+    """Single background refresher per server process, shared by all sessions"""
+    tickers = tuple(ETF_LIST)
+    provider = get_market_data_provider()
+    store = get_history_store()
+    dividend_store = get_dividend_store()
+    trend_detector = get_dividend_trend_detector()
+    headline_scorer = get_headline_scorer()
+    article_store = get_article_store()
+    news_cache = get_news_cache()
+    quote_cache = get_quote_cache()
+    quote_ladder = get_quote_ladder()
+    return MarketDataRefresher({
+        "prices": (REFRESH_SCHEDULE["prices"], lambda: refresh_quotes(provider, quote_ladder, quote_cache, tickers)),
+        "histories": (REFRESH_SCHEDULE["histories"], lambda: sync_price_histories(store, tickers)),
+        "news": (REFRESH_SCHEDULE["news"], lambda: collect_news_sentiment(provider, tickers, article_store, headline_scorer, news_cache)),
+        "dividends": (REFRESH_SCHEDULE["dividends"], lambda: sync_dividends(dividend_store, tickers, trend_detector))
+    }).start()
+
 # =====================================================
 # SIDEBAR - AI AUTOPILOT & SETTINGS
 # =====================================================
@@ -1586,6 +2096,15 @@ with st.sidebar:
             value=st.session_state.autopilot["risk_tolerance"]
         )
         
+        st.session_state.autopilot["max_action_size"] = st.slider(
+            "Max Action Size (% of portfolio)",
+            min_value=1.0,
+            max_value=50.0,
+            step=1.0,
+            value=float(st.session_state.autopilot["max_action_size"]),
+            help="Most of the portfolio the rebalancer may sell (and buy) in one plan"
+        )
+        
         st.session_state.autopilot["require_approval"] = st.checkbox(
             "Require approval for actions",
             value=st.session_state.autopilot["require_approval"]
@@ -1628,14 +2147,22 @@ with st.sidebar:
     
     # Price alert settings
     st.subheader("🎯 Price Alerts")
-    for ticker in ETF_LIST:
+    # Funds sold since an alert was set stay listed so the alert can be switched off
+    alertable = [
+        t for t in ETF_LIST
+        if st.session_state.holdings[t]["shares"] > 0 or st.session_state.price_alerts[t]["enabled"]
+    ]
+    if not alertable:
+        st.caption("Add a position to set price alerts")
+    else:
+        ticker = st.selectbox("Fund", alertable, key="alert_ticker")
         with st.expander(f"{ticker} Alerts"):
             st.session_state.price_alerts[ticker]["enabled"] = st.checkbox(
                 f"Enable {ticker} alerts",
                 value=st.session_state.price_alerts[ticker]["enabled"],
                 key=f"alert_enable_{ticker}"
             )
-            
+        
             if st.session_state.price_alerts[ticker]["enabled"]:
                 st.session_state.price_alerts[ticker]["stop_loss_pct"] = st.slider(
                     "Stop Loss %",
@@ -1644,8 +2171,8 @@ with st.sidebar:
                     value=st.session_state.price_alerts[ticker]["stop_loss_pct"],
                     key=f"stop_loss_{ticker}"
                 )
-                
-                current_price = get_price(ticker)
+            
+                current_price = get_price_snapshot()["prices"][ticker]
                 st.session_state.price_alerts[ticker]["target_price"] = st.number_input(
                     "Target Price ($)",
                     min_value=0.0,
@@ -1653,10 +2180,30 @@ with st.sidebar:
                     step=0.50,
                     key=f"target_{ticker}"
                 )
-                
-                if st.session_state.price_alerts[ticker]["target_price"]:
+            
+                if st.session_state.price_alerts[ticker]["target_price"] and current_price is not None:
                     st.caption(f"Current: ${current_price:.2f}")
 
+    st.divider()
+    
+    # Market data gateway health
+    st.subheader("📡 Market Data Feed")
+    feed_stats = get_market_data_provider().gateway.stats()
+    open_breakers = [endpoint for endpoint, state in feed_stats["breakers"].items() if state != "closed"]
+    if open_breakers:
+        st.warning(f"Serving last-known-good data for: {', '.join(open_breakers)}")
+    with st.expander("Gateway counters"):
+        for counter in FetchGateway.COUNTERS:
+            st.caption(f"{counter.replace('_', ' ').title()}: {feed_stats[counter]}")
+        for endpoint, state in sorted(feed_stats["breakers"].items()):
+            st.caption(f"Breaker `{endpoint}`: {state}")
+    with st.expander("Quote ladder"):
+        ladder_stats = get_quote_ladder().stats()
+        for source, counters in ladder_stats["sources"].items():
+            latency = f"p50 {counters['p50_ms']}ms · p95 {counters['p95_ms']}ms" if counters["p50_ms"] is not None else "no answers yet"
+            st.caption(f"`{source}`: {counters['wins']} wins / {counters['attempts']} tries · {latency}")
+        st.caption(f"Deadline misses: {ladder_stats['deadline_misses']}")
+
 # =====================================================
 # MAIN HEADER
 # =====================================================
@@ -1685,12 +2232,25 @@ with col3:
     if st.session_state.autopilot["enabled"]:
         st.markdown('<div class="autopilot-active">🤖 AI ACTIVE</div>', unsafe_allow_html=True)
 
+# Quote freshness - stale quotes are still shown while a background refresh runs
+price_snapshot = get_price_snapshot()
+quote_labels = []
+for ticker in held_tickers():
+    price = price_snapshot["prices"].get(ticker)
+    if price is None:
+        quote_labels.append(f"{ticker} n/a")
+        continue
+    age = format_age(price_snapshot["ages"].get(ticker, 0))
+    stale_mark = " ⏳" if price_snapshot["stale"].get(ticker) else ""
+    quote_labels.append(f"{ticker} ${price:.2f} · {age} old{stale_mark}")
+st.caption("**Quotes:** " + " | ".join(quote_labels))
+
 st.divider()
 
 # =====================================================
 # TABS
 # =====================================================
-tab1, tab2, tab3, tab4, tab5, tab6, tab7, tab8, tab9 = st.tabs([
+tab1, tab2, tab3, tab4, tab5, tab6, tab7, tab8, tab9, tab10 = st.tabs([
     "🎯 AI Command Center",
     "💡 Weekly Advisor",
     "📊 Dashboard",
@@ -1699,7 +2259,8 @@ tab1, tab2, tab3, tab4, tab5, tab6, tab7, tab8, tab9 = st.tabs([
     "🚀 Compound Projections",
     "📁 Portfolio Editor",
     "📈 Performance Tracking",
-    "📸 Snapshots"
+    "📸 Snapshots",
+    "🧪 Backtests"
 ])
 
 # =====================================================
@@ -1882,7 +2443,8 @@ with tab2:
         st.markdown("### 📊 All ETF Scores (This Week)")
         
         cols = st.columns(3)
-        for idx, (ticker, score_data) in enumerate(sorted(rec["all_scores"].items(), key=lambda x: x[1]["total_score"], reverse=True)):
+        for idx, ticker in enumerate(rec["top"]):
+            score_data = rec["all_scores"][ticker]
             with cols[idx]:
                 # Determine rank
                 rank_emoji = ["🥇", "🥈", "🥉"][idx]
@@ -1910,6 +2472,19 @@ with tab2:
                 if score_data['warnings']:
                     st.warning(f"⚠️ {score_data['warnings'][0]}", icon="⚠️")
         
+        if len(rec["all_scores"]) > 3:
+            with st.expander(f"All {len(rec['all_scores'])} funds ranked"):
+                ranked_scores = sorted(rec["all_scores"].items(), key=lambda x: x[1]["total_score"], reverse=True)
+                st.dataframe(pd.DataFrame([{
+                    "Rank": rank,
+                    "Ticker": ticker,
+                    "Score": score_data["total_score"],
+                    "Yield": f"{score_data['yield']:.1f}%",
+                    "Concentration": f"{score_data['concentration']:.1f}%",
+                    "Warnings": "; ".join(score_data["warnings"])
+                } for rank, (ticker, score_data) in enumerate(ranked_scores, start=1)]),
+                    use_container_width=True, hide_index=True)
+        
         # SUGGESTED INVESTMENT AMOUNTS
         st.divider()
         st.markdown("### 💰 Suggested Investment Amount")
@@ -1928,7 +2503,8 @@ with tab2:
         with col2:
             if investment_amount > 0:
                 best_ticker = rec["recommended_ticker"]
-                best_price = get_price(best_ticker)
+                best_price = get_price_snapshot()["prices"][best_ticker]
+                best_price = best_price or 0.0
                 shares_to_buy = int(investment_amount / best_price) if best_price > 0 else 0
                 leftover = investment_amount - (shares_to_buy * best_price)
                 
@@ -2087,9 +2663,10 @@ with tab3:
             # Income by holding
             income_data = []
             for h in metrics["holdings"]:
-                income_data.append({"ETF": h["ticker"], "Monthly Income": h["monthly"]})
+                if h["shares"] > 0:
+                    income_data.append({"ETF": h["ticker"], "Monthly Income": h["monthly"]})
             
-            df_income = pd.DataFrame(income_data)
+            df_income = pd.DataFrame(income_data, columns=["ETF", "Monthly Income"])
             fig_income = px.bar(df_income, x="ETF", y="Monthly Income",
                                title="Monthly Income by Holding",
                                color="Monthly Income", color_continuous_scale="Greens")
@@ -2100,9 +2677,10 @@ with tab3:
             # Portfolio allocation
             allocation_data = []
             for h in metrics["holdings"]:
-                allocation_data.append({"ETF": h["ticker"], "Value": h["value"]})
+                if h["shares"] > 0:
+                    allocation_data.append({"ETF": h["ticker"], "Value": h["value"]})
             
-            df_allocation = pd.DataFrame(allocation_data)
+            df_allocation = pd.DataFrame(allocation_data, columns=["ETF", "Value"])
             fig_pie = px.pie(df_allocation, values="Value", names="ETF",
                             title="Portfolio Allocation by Value",
                             color_discrete_sequence=px.colors.sequential.Blues_r)
@@ -2125,7 +2703,7 @@ with tab3:
             "Annual": f"${h['annual']:,.0f}",
             "Value": f"${h['value']:,.0f}",
             "Yield": f"{h['yield_pct']:.1f}%"
-        } for h in metrics["holdings"]])
+        } for h in metrics["holdings"] if h["shares"] > 0])
         
         st.dataframe(holdings_df, use_container_width=True, hide_index=True)
 
@@ -2203,8 +2781,10 @@ with tab4:
         
         selected_ticker = st.selectbox("Select ETF to analyze", ETF_LIST, key="div_trend_select")
         
-        if st.session_state.dividend_history[selected_ticker]:
-            df_div = pd.DataFrame(st.session_state.dividend_history[selected_ticker])
+        df_div = get_dividend_store().load(selected_ticker, start=datetime.now() - timedelta(weeks=12))
+        df_div = df_div.rename(columns={"ex_date": "date", "amount": "dividend"})
+        
+        if not df_div.empty:
             
             fig = go.Figure()
             fig.add_trace(go.Scatter(
@@ -2261,15 +2841,11 @@ with tab5:
         
         with col2:
             if st.button("🔄 Refresh News", type="primary", use_container_width=True):
-                with st.spinner("Fetching latest news..."):
-                    st.session_state.news_cache = fetch_real_news_sentiment()
-                    st.success("News updated!")
-        
-        # Get news data
-        if not st.session_state.news_cache.get("articles"):
-            with st.spinner("Loading news..."):
-                st.session_state.news_cache = fetch_real_news_sentiment()
+                get_market_refresher().refresh_now("news")
+                st.success("News refresh requested - new articles appear on the next update")
         
+        # Get news data (latest background snapshot - never blocks on the network)
+        st.session_state.news_cache = fetch_real_news_sentiment()
         news_data = st.session_state.news_cache
         
         # Overall Sentiment Dashboard
@@ -2302,27 +2878,61 @@ with tab5:
         
         st.divider()
         
-        # News Articles
+        # News Articles - full-text search over every stored headline
         st.markdown("### Latest News & Analysis")
         
-        articles_to_show = news_data["articles"]
-        if selected_etf != "ALL":
-            articles_to_show = [a for a in articles_to_show if selected_etf in a["ticker"]]
+        article_store = get_article_store()
+        col1, col2, col3, col4 = st.columns([2, 1, 1, 1])
+        with col1:
+            query = st.text_input("Search headlines", placeholder="e.g. earnings, Fed, NVDA", key="news_query")
+        with col2:
+            publisher = st.selectbox("Publisher", ["Any"] + article_store.publishers(), key="news_publisher")
+        with col3:
+            band = st.selectbox("Sentiment", list(NEWS_SENTIMENT_BANDS), key="news_band")
+        with col4:
+            period = st.selectbox("Published", list(NEWS_PERIODS), key="news_period")
+        
+        start = end = None
+        dates = ()
+        if period == "Custom range":
+            today = datetime.now().date()
+            dates = st.date_input("Date range", value=(today - timedelta(days=30), today), key="news_dates")
+            if len(dates) == 2:
+                start = datetime.combine(dates[0], datetime.min.time()).timestamp()
+                end = datetime.combine(dates[1] + timedelta(days=1), datetime.min.time()).timestamp()
+        elif NEWS_PERIODS[period]:
+            start = time.time() - NEWS_PERIODS[period] * 86400
+        
+        filters = {
+            "text": query,
+            "ticker": None if selected_etf == "ALL" else selected_etf,
+            "publisher": None if publisher == "Any" else publisher,
+            "sentiment": NEWS_SENTIMENT_BANDS[band],
+            "start": start,
+            "end": end
+        }
+        # A new search starts from page 1
+        page_key = "news_page:" + json.dumps([query, selected_etf, publisher, band, period, [str(d) for d in dates]])
+        offset = page_picker(article_store.search_count(**filters), key=page_key, page_size=NEWS_PAGE_SIZE)
+        results = article_store.search(limit=NEWS_PAGE_SIZE, offset=offset, **filters)
+        
+        if not results:
+            st.info("No stored articles match these filters yet")
         
-        for article in articles_to_show:
+        for article in results:
+            article_band = sentiment_band(article["sentiment"])
             st.markdown(f"""
             <div class="news-card">
                 <div style="display: flex; justify-content: space-between; align-items: start; margin-bottom: 0.75rem;">
                     <div style="flex: 1;">
                         <div style="font-size: 1.1rem; font-weight: 700; margin-bottom: 0.25rem;">{article['title']}</div>
-                        <div style="font-size: 0.85rem; color: #64748b;">{article['source']} • {article['time']}</div>
+                        <div style="font-size: 0.85rem; color: #64748b;">{article['publisher'] or 'Financial News'} • {format_time_ago(article['published'])}</div>
                     </div>
                     <div style="display: flex; gap: 0.5rem; align-items: center;">
-                        <span class="{article['sentiment_class']}">{article['sentiment']}</span>
-                        <span style="background: #334155; padding: 0.5rem; border-radius: 0.5rem; font-weight: 700;">{article['ticker']}</span>
+                        <span class="sentiment-{article_band.lower()}">{article_band}</span>
+                        <span style="background: #334155; padding: 0.5rem; border-radius: 0.5rem; font-weight: 700;">{', '.join(article['tickers'])}</span>
                     </div>
                 </div>
-                <div style="color: #94a3b8; line-height: 1.6;">{article['summary']}</div>
             </div>
             """, unsafe_allow_html=True)
         
@@ -2341,6 +2951,14 @@ with tab5:
         
         st.info(f"**{selected_for_underlying}** tracks: {ETF_INFO[selected_for_underlying]['underlying_index']}")
         st.write(f"**Top Holdings:** {', '.join(underlying_stocks)}")
+        
+        # Other tracked funds with the same index or the same top holdings
+        same_index = [t for t in UNIVERSE.by_index.get(ETF_INFO[selected_for_underlying]["underlying_index"], []) if t != selected_for_underlying]
+        overlap = sorted({t for stock in underlying_stocks for t in UNIVERSE.by_holding.get(stock, []) if t != selected_for_underlying})
+        if same_index:
+            st.caption(f"Same index: {', '.join(same_index)}")
+        if overlap:
+            st.caption(f"Overlapping holdings: {', '.join(overlap)}")
 
 # =====================================================
 # TAB 6: COMPOUND PROJECTIONS
@@ -2352,80 +2970,23 @@ with tab6:
         st.warning("⚠️ Fix validation errors to view projections")
     else:
         # Projection function
-        def project_compound_growth():
+        def run_compound_projection():
             """Project portfolio growth with dividend reinvestment + monthly deposits"""
-            current_metrics = calculate_current_metrics()
-            target = st.session_state.target_income
-            monthly_deposit = st.session_state.monthly_deposit
-            
-            # Starting values
-            portfolio = {ticker: st.session_state.holdings[ticker]["shares"] for ticker in ETF_LIST}
-            cash = st.session_state.cash
-            
-            # Track projection
-            projection_data = []
-            month = 0
-            max_months = 360  # 30 years max
-            
-            while month < max_months:
-                # Calculate current monthly income
-                monthly_income = 0
-                portfolio_value = cash
-                
-                for ticker in ETF_LIST:
-                    shares = portfolio[ticker]
-                    div = st.session_state.holdings[ticker]["div"]
-                    price = current_metrics["prices"][ticker]
-                    
-                    weekly_income = shares * div
-                    monthly_income += weekly_income * 52 / 12
-                    portfolio_value += shares * price
-                
-                # Record projection point
-                projection_data.append({
-                    "month": month,
-                    "portfolio_value": portfolio_value,
-                    "monthly_income": monthly_income,
-                    "portfolio": portfolio.copy()
-                })
-                
-                # Check if target reached
-                if monthly_income >= target:
-                    return {
-                        "months_to_target": month,
-                        "years_to_target": month / 12,
-                        "projection_data": projection_data,
-                        "final_portfolio": portfolio,
-                        "final_value": portfolio_value,
-                        "final_income": monthly_income,
-                        "reached": True
-                    }
-                
-                # Simulate one month of growth
-                monthly_dividends = monthly_income
-                available_cash = monthly_dividends + monthly_deposit
-                
-                # Reinvest proportionally
-                total_shares_value = sum(portfolio[t] * current_metrics["prices"][t] for t in ETF_LIST)
-                
-                for ticker in ETF_LIST:
-                    if total_shares_value > 0:
-                        ticker_weight = (portfolio[ticker] * current_metrics["prices"][ticker]) / total_shares_value
-                        ticker_investment = available_cash * ticker_weight
-                        shares_to_buy = ticker_investment / current_metrics["prices"][ticker]
-                        portfolio[ticker] += shares_to_buy
-                
-                month += 1
-            
-            return {
-                "months_to_target": max_months,
-                "years_to_target": max_months / 12,
-                "projection_data": projection_data,
-                "final_portfolio": portfolio,
-                "final_value": projection_data[-1]["portfolio_value"],
-                "final_income": projection_data[-1]["monthly_income"],
-                "reached": False
-            }
+            holdings = calculate_current_metrics()["holdings"]
+            usable, missing = priced_positions(holdings)
+            projection = project_compound_growth(
+                holdings["shares"][usable], holdings["div"][usable], holdings["price"][usable],
+                st.session_state.cash, st.session_state.monthly_deposit, st.session_state.target_income
+            )
+            tickers = [t for t, ok in zip(holdings.tickers, usable) if ok]
+            projection.update({
+                "missing_quotes": missing,
+                "years_to_target": projection["months_to_target"] / 12,
+                "final_portfolio": dict(zip(tickers, projection["final_shares"].tolist())),
+                "final_value": float(projection["value"][-1]),
+                "final_income": float(projection["income"][-1])
+            })
+            return projection
         
         col1, col2 = st.columns([1, 2])
         
@@ -2450,12 +3011,14 @@ with tab6:
             
             if st.button("🔄 Run Projection", type="primary"):
                 with st.spinner("Calculating compound growth..."):
-                    projection = project_compound_growth()
-                    st.session_state.projection = projection
+                    st.session_state.projection = run_compound_projection()
         
         with col2:
             if "projection" in st.session_state:
                 proj = st.session_state.projection
+                if proj.get("missing_quotes"):
+                    st.warning(f"⚠️ No current quote for {', '.join(proj['missing_quotes'])} - "
+                               "left out of this projection")
                 
                 if proj["reached"]:
                     st.markdown(f"""
@@ -2487,13 +3050,13 @@ with tab6:
             st.divider()
             st.subheader("Growth Timeline")
             
-            proj_df = pd.DataFrame(st.session_state.projection["projection_data"])
+            proj = st.session_state.projection
             
             fig = go.Figure()
             
             fig.add_trace(go.Scatter(
-                x=proj_df["month"] / 12,
-                y=proj_df["portfolio_value"],
+                x=proj["months"] / 12,
+                y=proj["value"],
                 mode='lines',
                 name='Portfolio Value',
                 line=dict(color='#3b82f6', width=3),
@@ -2502,8 +3065,8 @@ with tab6:
             ))
             
             fig.add_trace(go.Scatter(
-                x=proj_df["month"] / 12,
-                y=proj_df["monthly_income"],
+                x=proj["months"] / 12,
+                y=proj["income"],
                 mode='lines',
                 name='Monthly Income',
                 line=dict(color='#22c55e', width=3),
@@ -2529,13 +3092,17 @@ with tab6:
             st.divider()
             st.subheader("Final Portfolio Composition")
             
-            col1, col2, col3 = st.columns(3)
-            for idx, ticker in enumerate(ETF_LIST):
-                final_shares = st.session_state.projection["final_portfolio"][ticker]
+            final_portfolio = st.session_state.projection["final_portfolio"]
+            projected = [t for t in ETF_LIST if final_portfolio.get(t, 0) > 0]
+            page = paginate(projected, key="projection_page")
+            for idx, ticker in enumerate(page):
+                final_shares = final_portfolio[ticker]
                 current_shares = st.session_state.holdings[ticker]["shares"]
                 shares_added = final_shares - current_shares
                 
-                with [col1, col2, col3][idx]:
+                if idx % 3 == 0:
+                    cols = st.columns(3)
+                with cols[idx % 3]:
                     st.markdown(f"""
                     <div style="background: linear-gradient(135deg, #1e293b 0%, #0f172a 100%); border: 1px solid #334155; border-radius: 1rem; padding: 1.5rem;">
                         <div style="font-size: 1.5rem; font-weight: 700; color: #3b82f6; margin-bottom: 0.5rem;">{ticker}</div>
@@ -2548,14 +3115,178 @@ with tab6:
                     </div>
                     """, unsafe_allow_html=True)
 
+        # MONTE CARLO MODE
+        st.divider()
+        st.subheader("🎲 Monte Carlo Mode")
+        st.caption("Replays randomly drawn historical months of price moves and distribution changes "
+                   "for your held funds, instead of assuming today's prices and payouts stay fixed.")
+
+        mc_col1, mc_col2 = st.columns([1, 3])
+        with mc_col1:
+            n_paths = st.selectbox("Simulated paths", MC_PATH_OPTIONS, index=1,
+                                   format_func=lambda n: f"{n:,}", key="mc_paths")
+            if st.button("🎲 Run Simulation", key="run_mc"):
+                with st.spinner(f"Simulating {n_paths:,} paths..."):
+                    st.session_state.mc_projection = run_monte_carlo_projection(n_paths)
+
+        with mc_col2:
+            if "mc_projection" in st.session_state:
+                mc = st.session_state.mc_projection
+                if mc["scenarios"] < MC_MIN_SCENARIOS:
+                    st.warning(f"⚠️ Only {mc['scenarios']} months of joint price and distribution history - "
+                               "bands will understate the real spread")
+
+                def format_months(months):
+                    return "Not reached" if months is None else f"{months / 12:.1f} yrs"
+
+                m1, m2, m3, m4 = st.columns(4)
+                m1.metric("Reach Target", f"{mc['reach_probability']:.0%}")
+                m2.metric("Optimistic (P10)", format_months(mc["months_to_target"][10]))
+                m3.metric("Median (P50)", format_months(mc["months_to_target"][50]))
+                m4.metric("Pessimistic (P90)", format_months(mc["months_to_target"][90]))
+
+                years = mc["years"]
+                fig = go.Figure()
+                for low, high, name, color in [(10, 90, "P10-P90", "rgba(59, 130, 246, 0.15)"),
+                                               (25, 75, "P25-P75", "rgba(59, 130, 246, 0.3)")]:
+                    fig.add_trace(go.Scatter(x=years, y=mc["value_bands"][high], mode="lines",
+                                             line=dict(width=0), showlegend=False, hoverinfo="skip"))
+                    fig.add_trace(go.Scatter(x=years, y=mc["value_bands"][low], mode="lines",
+                                             line=dict(width=0), fill="tonexty", fillcolor=color,
+                                             name=f"Value {name}"))
+                fig.add_trace(go.Scatter(x=years, y=mc["value_bands"][50], mode="lines",
+                                         name="Median Value", line=dict(color="#3b82f6", width=3)))
+                fig.add_trace(go.Scatter(x=years, y=mc["income_bands"][50], mode="lines",
+                                         name="Median Income", line=dict(color="#22c55e", width=3),
+                                         yaxis="y2"))
+                fig.add_trace(go.Scatter(x=years, y=mc["income_bands"][10], mode="lines",
+                                         name="Income P10", line=dict(color="#22c55e", width=1, dash="dot"),
+                                         yaxis="y2"))
+                fig.add_trace(go.Scatter(x=years, y=mc["income_bands"][90], mode="lines",
+                                         name="Income P90", line=dict(color="#22c55e", width=1, dash="dot"),
+                                         yaxis="y2"))
+                fig.add_hline(y=st.session_state.target_income, line_dash="dash",
+                              line_color="#eab308", annotation_text="Target Income", yref="y2")
+                fig.update_layout(
+                    xaxis_title="Years",
+                    yaxis_title="Portfolio Value ($)",
+                    yaxis2=dict(title="Monthly Income ($)", overlaying="y", side="right"),
+                    hovermode="x unified",
+                    height=450,
+                    legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
+                )
+                st.plotly_chart(fig, use_container_width=True)
+                st.caption(f"{mc['paths']:,} paths bootstrapped from {mc['scenarios']} historical months")
+
+        # SCENARIO SWEEP
+        st.divider()
+        st.subheader("📊 Scenario Sweep")
+        st.caption("Years to reach the income target across a whole grid of deposits, targets and "
+                   "reinvestment policies. Blank cells never reach the target within 30 years.")
+
+        sw_col1, sw_col2 = st.columns([1, 3])
+        with sw_col1:
+            deposit_range = st.slider("Monthly deposit range ($)", 0, 5000, (0, 1000), step=50, key="sweep_deposits")
+            target_range = st.slider("Income target range ($)", 100, 20000, (500, 5000), step=100, key="sweep_targets")
+            policies = st.multiselect("Reinvestment policies", list(REINVEST_POLICIES),
+                                      default=list(REINVEST_POLICIES), key="sweep_policies")
+
+        with sw_col2:
+            if not policies:
+                st.info("Pick at least one reinvestment policy")
+            else:
+                holdings = calculate_current_metrics()["holdings"]
+                usable, missing = priced_positions(holdings)
+                if missing:
+                    st.warning(f"⚠️ No current quote for {', '.join(missing)} - left out of the sweep")
+                deposits = np.linspace(deposit_range[0], deposit_range[1], SWEEP_STEPS)
+                targets = np.linspace(target_range[0], target_range[1], SWEEP_STEPS)
+                sweep = compute_scenario_sweep(
+                    tuple(holdings["shares"][usable].tolist()), tuple(holdings["div"][usable].tolist()),
+                    tuple(holdings["price"][usable].tolist()), tuple(deposits), tuple(targets), tuple(policies)
+                )
+
+                policy = st.radio("Policy", policies, horizontal=True, key="sweep_policy")
+                fig = px.imshow(
+                    sweep[policy],
+                    x=[f"${t:,.0f}" for t in targets],
+                    y=[f"${d:,.0f}" for d in deposits],
+                    labels=dict(x="Monthly Income Target", y="Monthly Deposit", color="Years"),
+                    color_continuous_scale="RdYlGn_r",
+                    text_auto=".1f",
+                    aspect="auto",
+                    origin="lower"
+                )
+                fig.update_layout(height=500)
+                st.plotly_chart(fig, use_container_width=True)
+
+                pick_col1, pick_col2 = st.columns(2)
+                deposit_pick = pick_col1.select_slider("Deposit", options=list(range(SWEEP_STEPS)),
+                                                       format_func=lambda i: f"${deposits[i]:,.0f}",
+                                                       key="sweep_pick_deposit")
+                target_pick = pick_col2.select_slider("Target", options=list(range(SWEEP_STEPS)),
+                                                      format_func=lambda i: f"${targets[i]:,.0f}",
+                                                      key="sweep_pick_target")
+                metric_cols = st.columns(len(policies))
+                for col, name in zip(metric_cols, policies):
+                    years = sweep[name][deposit_pick, target_pick]
+                    col.metric(name, "Not reached" if np.isnan(years) else f"{years:.1f} yrs")
+
+        # GOAL SOLVER
+        st.divider()
+        st.subheader("🎯 Goal Solver")
+        st.caption(f"What it takes to reach ${st.session_state.target_income:,.0f}/month by a chosen date, "
+                   "with everything else as it is today.")
+
+        goal_col1, goal_col2 = st.columns([1, 2])
+        with goal_col1:
+            solve_for = st.radio("Solve for", list(GOAL_OPTIONS), format_func=GOAL_OPTIONS.get, key="goal_solve_for")
+            goal_date = st.date_input("Reach target by", value=datetime.now().date() + timedelta(days=5 * 365),
+                                      min_value=datetime.now().date() + timedelta(days=31), key="goal_date")
+
+        with goal_col2:
+            holdings = calculate_current_metrics()["holdings"]
+            usable, missing = priced_positions(holdings)
+            if missing:
+                st.warning(f"⚠️ No current quote for {', '.join(missing)} - solved without them")
+            today = datetime.now().date()
+            goal_months = (goal_date.year - today.year) * 12 + goal_date.month - today.month
+            goal = solve_goal(
+                holdings["shares"][usable], holdings["div"][usable], holdings["price"][usable],
+                st.session_state.monthly_deposit, st.session_state.target_income, goal_months, solve_for
+            )
+
+            if goal["value"] is None:
+                st.error("⚠️ Not reachable by that date - add holdings or pick a later date")
+            elif goal["value"] == 0:
+                st.success(f"✅ Already on track - current settings reach the target within {goal_months} months")
+            else:
+                label = GOAL_OPTIONS[solve_for]
+                value = f"{goal['value']:.2f}%" if solve_for == "yield" else f"${goal['value']:,.0f}"
+                st.metric(f"Required {label.lower()}", value)
+                st.caption(f"Projected income after {goal_months} months: ${goal['income']:,.0f}/month")
+
 # =====================================================
 # TAB 7: PORTFOLIO EDITOR
 # =====================================================
 with tab7:
     st.subheader("📁 Portfolio Editor")
     
-    for ticker in ETF_LIST:
-        price = get_price(ticker)
+    col1, col2 = st.columns([2, 1])
+    with col1:
+        risk_filter = st.multiselect("Risk level", sorted(UNIVERSE.by_risk, key=str), key="editor_risk_filter")
+    with col2:
+        held_only = st.toggle("Held positions only", value=len(ETF_LIST) > PAGE_SIZE, key="editor_held_only")
+    
+    editable = ETF_LIST
+    if risk_filter:
+        in_risk = set().union(*(UNIVERSE.by_risk[r] for r in risk_filter))
+        editable = [t for t in editable if t in in_risk]
+    if held_only:
+        editable = [t for t in editable if st.session_state.holdings[t]["shares"] > 0]
+    
+    for ticker in paginate(editable, key="editor_page"):
+        price = get_price_snapshot()["prices"][ticker] or 0.0
         
         st.markdown(f"""
         <div style="background: linear-gradient(135deg, #1e293b 0%, #0f172a 100%); border: 1px solid #334155; border-radius: 1rem; padding: 1.5rem; margin-bottom: 1rem;">
@@ -2596,19 +3327,13 @@ with tab7:
             )
         
         # Calculate and display metrics
-        shares = st.session_state.holdings[ticker]["shares"]
-        div = st.session_state.holdings[ticker]["div"]
-        cost_basis = st.session_state.holdings[ticker].get("cost_basis", price)
-        
-        weekly = shares * div
-        monthly = weekly * 52 / 12
-        annual = weekly * 52
-        value = shares * price
-        yield_pct = (annual / value * 100) if value > 0 else 0
-        
-        cost_total = shares * cost_basis
-        gain_loss = value - cost_total
-        gain_loss_pct = ((value / cost_total) - 1) * 100 if cost_total > 0 else 0
+        position = calculate_current_metrics()["holdings"].row(ticker)
+        weekly = position["weekly"]
+        monthly = position["monthly"]
+        annual = position["annual"]
+        value = position["value"]
+        gain_loss = position["gain_loss"]
+        gain_loss_pct = position["gain_loss_pct"]
         
         metrics = calculate_current_metrics()
         portfolio_pct = (value / metrics['total_value'] * 100) if metrics['total_value'] > 0 else 0
@@ -2728,5 +3453,210 @@ with tab9:
         else:
             st.info("No snapshots yet. Save your first one above!")
 
+# =====================================================
+# TAB 10: BACKTESTS
+# =====================================================
+with tab10:
+    st.subheader("💡 Weekly Advisor Backtest")
+    st.caption("Replays the Weekly Advisor's scoring rules over stored prices and distributions: every week "
+               "it buys the top-scoring fund, compared with splitting the same amount across every fund. "
+               "Headlines have no history, so sentiment scores neutral. Distributions are paid out, not reinvested.")
+
+    bt_col1, bt_col2 = st.columns([1, 3])
+    with bt_col1:
+        bt_years = st.selectbox("History", BACKTEST_YEARS, index=len(BACKTEST_YEARS) - 1,
+                                format_func=lambda y: f"Last {y} year{'s' if y > 1 else ''}", key="bt_years")
+        bt_amount = st.number_input("Weekly investment ($)", min_value=10.0,
+                                    value=float(max(10, round(st.session_state.monthly_deposit / 4.33))),
+                                    step=50.0, key="bt_amount")
+        bt_universe = st.radio("Funds", ["My portfolio", "Whole universe"], key="bt_universe")
+        if st.button("▶️ Run Backtest", key="run_bt"):
+            bt_tickers = tuple(ETF_LIST) if bt_universe == "Whole universe" else tuple(held_tickers())
+            with st.spinner(f"Replaying {len(bt_tickers)} funds..."):
+                started = time.time()
+                st.session_state.advisor_backtest = compute_advisor_backtest(
+                    bt_tickers, bt_years, bt_amount, st.session_state.dividend_drop_threshold
+                )
+                st.session_state.advisor_backtest_seconds = time.time() - started
+
+    with bt_col2:
+        bt = st.session_state.get("advisor_backtest")
+        if "advisor_backtest" in st.session_state and bt is None:
+            st.warning("No stored price history for these funds yet")
+        elif bt is not None and len(bt["dates"]):
+            strategies = {"advisor": "Advisor picks", "equal": "Buy everything equally"}
+            m1, m2, m3, m4 = st.columns(4)
+            m1.metric("Invested", f"${bt['invested'][-1]:,.0f}")
+            m2.metric("Advisor Value + Income", f"${bt['advisor']['value'][-1] + bt['advisor']['income'][-1]:,.0f}",
+                      f"{bt['advisor']['total_return_pct'][-1]:+.1f}%")
+            m3.metric("Equal-Weight Value + Income", f"${bt['equal']['value'][-1] + bt['equal']['income'][-1]:,.0f}",
+                      f"{bt['equal']['total_return_pct'][-1]:+.1f}%")
+            income_edge = bt["advisor"]["income"][-1] - bt["equal"]["income"][-1]
+            m4.metric("Income Edge", signed_dollars(income_edge))
+
+            fig = go.Figure()
+            for name, label in strategies.items():
+                fig.add_trace(go.Scatter(x=bt["dates"], y=bt[name]["total_return_pct"], mode="lines", name=label))
+            fig.update_layout(yaxis_title="Total Return (%)", hovermode="x unified", height=350,
+                              legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1))
+            st.plotly_chart(fig, use_container_width=True)
+
+            fig = go.Figure()
+            for name, label in strategies.items():
+                fig.add_trace(go.Scatter(x=bt["dates"], y=bt[name]["income"], mode="lines", name=label))
+            fig.update_layout(yaxis_title="Cumulative Income ($)", hovermode="x unified", height=300,
+                              legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1))
+            st.plotly_chart(fig, use_container_width=True)
+
+            picked = pd.Series(bt["picks"][bt["picks"] >= 0]).value_counts()
+            st.dataframe(pd.DataFrame({
+                "Ticker": [bt["tickers"][i] for i in picked.index],
+                "Weeks Picked": picked.values,
+                "Share of Buys": [f"{n / picked.sum():.0%}" for n in picked.values]
+            }), use_container_width=True, hide_index=True)
+            st.caption(f"{len(bt['dates'])} weeks x {len(bt['tickers'])} funds replayed in "
+                       f"{st.session_state.advisor_backtest_seconds:.2f}s")
+
+    # REBALANCER WALK-FORWARD
+    st.divider()
+    st.subheader("⚖️ Auto-Rebalancer Walk-Forward")
+    st.caption("Starts from today's holdings (by value) and follows the auto-rebalance plan every week, paying "
+               "commissions and half the bid/ask spread on each order. Each row is simulated separately, "
+               "next to simply holding the starting portfolio.")
+
+    wf_col1, wf_col2 = st.columns([1, 3])
+    with wf_col1:
+        wf_years = st.selectbox("History", BACKTEST_YEARS, index=len(BACKTEST_YEARS) - 1,
+                                format_func=lambda y: f"Last {y} year{'s' if y > 1 else ''}", key="wf_years")
+    with wf_col2:
+        wf_params = st.data_editor(
+            pd.DataFrame([dict(cost, **{k: st.session_state.autopilot[k] for k in ("risk_tolerance", "max_action_size")})
+                          for cost in WALK_FORWARD_COSTS]),
+            column_config={
+                "commission": st.column_config.NumberColumn("Commission ($/order)", min_value=0.0, step=0.5, format="$%.2f"),
+                "spread_pct": st.column_config.NumberColumn("Spread (%)", min_value=0.0, max_value=5.0, step=0.05),
+                "whole_shares": st.column_config.CheckboxColumn("Whole shares"),
+                "risk_tolerance": st.column_config.SelectboxColumn("Risk tolerance", options=list(RISK_BUDGETS), required=True),
+                "max_action_size": st.column_config.NumberColumn("Max action (%)", min_value=1.0, max_value=50.0, step=1.0)
+            },
+            num_rows="dynamic", use_container_width=True, hide_index=True, key="wf_params"
+        )
+
+    if st.button("▶️ Run Walk-Forward", key="run_wf"):
+        param_sets = wf_params.dropna().to_dict("records")
+        with st.spinner(f"Simulating {len(param_sets)} parameter sets..."):
+            started = time.time()
+            st.session_state.walk_forward = run_rebalance_walk_forward(param_sets, wf_years)
+            st.session_state.walk_forward_seconds = time.time() - started
+
+    wf = st.session_state.get("walk_forward")
+    if "walk_forward" in st.session_state and wf is None:
+        st.warning("Needs stored price history and at least one holding")
+    elif wf is not None and len(wf["dates"]):
+        hold = wf["results"][0]["hold"]
+        rows = [{
+            "Run": "Hold (no rebalancing)",
+            "Final Value": f"${hold['value'][-1]:,.0f}",
+            "Income Received": f"${hold['income'][-1]:,.0f}",
+            "Trading Costs": "$0",
+            "Income Lost to Costs": "$0",
+            "Turnover / yr": "0%",
+            "Max Drawdown": f"{hold['max_drawdown_pct']:.1f}%"
+        }]
+        fig = go.Figure()
+        fig.add_trace(go.Scatter(x=wf["dates"], y=hold["value"], mode="lines", name="Hold",
+                                 line=dict(color="#64748b", dash="dot")))
+        for i, (params, result) in enumerate(zip(wf["params"], wf["results"]), 1):
+            run = result["rebalance"]
+            label = (f"#{i}: ${params['commission']:.2f} + {params['spread_pct']:.2f}% spread, "
+                     f"{'whole' if params['whole_shares'] else 'fractional'}, "
+                     f"{params['risk_tolerance']}, {params['max_action_size']:.0f}% max")
+            rows.append({
+                "Run": label,
+                "Final Value": f"${run['value'][-1]:,.0f}",
+                "Income Received": f"${run['income'][-1]:,.0f}",
+                "Trading Costs": f"${run['costs'][-1]:,.0f}",
+                "Income Lost to Costs": f"${run['income_lost']:,.0f}",
+                "Turnover / yr": f"{run['turnover_pct']:.0f}%",
+                "Max Drawdown": f"{run['max_drawdown_pct']:.1f}%"
+            })
+            fig.add_trace(go.Scatter(x=wf["dates"], y=run["value"], mode="lines", name=f"Run #{i}"))
+        st.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+        fig.update_layout(yaxis_title="Portfolio Value ($)", hovermode="x unified", height=350,
+                          legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1))
+        st.plotly_chart(fig, use_container_width=True)
+        st.caption(f"{len(wf['params'])} runs x {len(wf['dates'])} weeks in {st.session_state.walk_forward_seconds:.1f}s")
+
+    # STOP-LOSS & TARGET BACKTEST
+    st.divider()
+    st.subheader("🛑 Stop-Loss & Target Backtest")
+    st.caption("Buys each holding (at today's value) at the start of the stored bars and sells it the first time "
+               "the price falls to a stop-loss or rises to a target, both measured from that entry. Shows how "
+               "every combination would have changed capital and distributions against holding throughout.")
+
+    sl_col1, sl_col2 = st.columns([1, 3])
+    with sl_col1:
+        sl_interval = st.selectbox("Bars", list(ALERT_BACKTEST_INTERVALS),
+                                   format_func=ALERT_BACKTEST_INTERVALS.get, key="sl_interval")
+        sl_years = st.selectbox("History", BACKTEST_YEARS, index=len(BACKTEST_YEARS) - 1,
+                                format_func=lambda y: f"Last {y} year{'s' if y > 1 else ''}",
+                                disabled=sl_interval != "1d", key="sl_years")
+        if st.button("▶️ Run Sweep", key="run_sl"):
+            holdings = calculate_current_metrics()["holdings"]
+            positions = tuple((t, float(v)) for t, v in zip(holdings.tickers, holdings["value"]) if v > 0)
+            with st.spinner(f"Sweeping {len(positions)} holdings..."):
+                st.session_state.alert_backtest = compute_alert_backtest(positions, sl_interval, sl_years)
+
+    with sl_col2:
+        sl = st.session_state.get("alert_backtest")
+        if sl is not None and not sl["positions"]:
+            st.warning("No stored bars at this interval for your holdings yet")
+        elif sl is not None:
+            def rule_label(pct, kind):
+                return f"No {kind}" if np.isinf(pct) else f"{pct:.0f}%"
+
+            stop_labels = [rule_label(p, "stop") for p in ALERT_STOP_LOSS_PCTS]
+            target_labels = [rule_label(p, "target") for p in ALERT_TARGET_PCTS]
+            hold_total = sl["hold_capital"] + sl["hold_income"]
+            change = sl["capital"] + sl["income"] - hold_total
+            fig = px.imshow(
+                change, x=target_labels, y=stop_labels, text_auto=",.0f", aspect="auto",
+                color_continuous_scale="RdYlGn", color_continuous_midpoint=0,
+                labels=dict(x="Target gain", y="Stop loss", color="vs Hold ($)")
+            )
+            fig.update_layout(height=420)
+            st.plotly_chart(fig, use_container_width=True)
+            st.caption(f"Capital + income change against holding every position "
+                       f"(${sl['hold_capital']:,.0f} capital + ${sl['hold_income']:,.0f} income)")
+
+            p1, p2 = st.columns(2)
+            with p1:
+                pick_stop = st.selectbox("Stop loss", range(len(stop_labels)), format_func=stop_labels.__getitem__,
+                                         index=stop_labels.index("20%"), key="sl_pick_stop")
+            with p2:
+                pick_target = st.selectbox("Target gain", range(len(target_labels)),
+                                           format_func=target_labels.__getitem__,
+                                           index=len(target_labels) - 1, key="sl_pick_target")
+
+            m1, m2, m3 = st.columns(3)
+            m1.metric("Capital", f"${sl['capital'][pick_stop, pick_target]:,.0f}",
+                      f"{signed_dollars(sl['capital'][pick_stop, pick_target] - sl['hold_capital'])} vs hold")
+            m2.metric("Income", f"${sl['income'][pick_stop, pick_target]:,.0f}",
+                      f"{signed_dollars(sl['income'][pick_stop, pick_target] - sl['hold_income'])} vs hold")
+            m3.metric("Stops / Targets Hit",
+                      f"{sl['stopped'][pick_stop, pick_target]} / {sl['targeted'][pick_stop, pick_target]}")
+
+            outcomes = ["Held", "🛑 Stopped", "🎯 Target"]
+            st.dataframe(pd.DataFrame([{
+                "Ticker": pos["ticker"],
+                "Outcome": outcomes[pos["kind"][pick_stop, pick_target]],
+                "Exit": pd.Timestamp(pos["exit_time"][pick_stop, pick_target]).strftime("%Y-%m-%d %H:%M")
+                        if pos["kind"][pick_stop, pick_target] else "-",
+                "Capital": f"${pos['capital'][pick_stop, pick_target]:,.0f}",
+                "Income": f"${pos['income'][pick_stop, pick_target]:,.0f}",
+                "Hold Capital": f"${pos['hold_capital']:,.0f}",
+                "Hold Income": f"${pos['hold_income']:,.0f}"
+            } for pos in sl["positions"]]), use_container_width=True, hide_index=True)
+
 st.divider()
 st.caption("Income Strategy Engine v4.0 - AI Powered Edition • " + datetime.now().strftime("%b %d, %Y %I:%M %p"))
@@ -0,0 +1,1196 @@
+"""
+Pure computation for the Income Strategy Engine.
+
+Nothing here touches Streamlit or the network, so the same code runs inside a
+rerun, a background thread or a worker process.
+"""
+import hashlib
+import re
+import threading
+from collections.abc import Mapping
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.optimize import linprog
+
+
+# =====================================================
+# DERIVED ANALYTICS GRAPH
+# =====================================================
+
+def fingerprint(value):
+    """Stable digest of plain data: dicts, lists, scalars, datetimes, numpy arrays and pandas objects"""
+    digest = hashlib.blake2b(digest_size=16)
+    _feed(digest, value)
+    return digest.hexdigest()
+
+
+def _feed(digest, value):
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        labels = value.columns if isinstance(value, pd.DataFrame) else value.name
+        digest.update(b"pd:" + repr(labels).encode())
+        digest.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+    elif isinstance(value, np.ndarray):
+        digest.update(f"nd:{value.dtype}:{value.shape}".encode())
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, Mapping):
+        digest.update(b"{")
+        for key in sorted(value, key=repr):
+            _feed(digest, key)
+            _feed(digest, value[key])
+        digest.update(b"}")
+    elif isinstance(value, (list, tuple)):
+        digest.update(b"[")
+        for item in value:
+            _feed(digest, item)
+        digest.update(b"]")
+    else:
+        digest.update(f"{type(value).__name__}:{value!r};".encode())
+
+
+class AnalyticsGraph:
+    """
+    Derived quantities declared as nodes of a small DAG.
+
+    A node's key is the fingerprint of its name and the keys of its dependencies,
+    so it is recomputed only when something upstream actually changed. Results
+    live in `memo` (one entry per node), which the caller keeps across reruns.
+    """
+
+    def __init__(self, memo):
+        self._memo = memo
+        self._inputs = {}
+        self._nodes = {}
+        self._values = {}
+        self._keys = {}
+        self.recomputed = []
+
+    def input(self, name, loader, volatile=False):
+        """
+        Register a leaf. Stable inputs are loaded once per graph; volatile ones
+        (session state that widgets edit mid-rerun) are re-read on every lookup.
+        """
+        self._inputs[name] = (loader, volatile)
+
+    def node(self, name, deps, fn):
+        """Register fn(*values_of_deps) under `name`"""
+        self._nodes[name] = (tuple(deps), fn)
+
+    def key(self, name):
+        if name in self._inputs:
+            loader, volatile = self._inputs[name]
+            if volatile or name not in self._keys:
+                self._values[name] = loader()
+                self._keys[name] = fingerprint(self._values[name])
+            return self._keys[name]
+        deps, _ = self._nodes[name]
+        return fingerprint((name, [self.key(dep) for dep in deps]))
+
+    def get(self, name):
+        key = self.key(name)
+        if name in self._inputs:
+            return self._values[name]
+
+        cached = self._memo.get(name)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        deps, fn = self._nodes[name]
+        value = fn(*[self.get(dep) for dep in deps])
+        self._memo[name] = (key, value)
+        self.recomputed.append(name)
+        return value
+
+
+# =====================================================
+# PORTFOLIO METRICS
+# =====================================================
+
+class HoldingsTable:
+    """
+    Per-holding metrics stored as NumPy columns with a ticker -> row index.
+    table["value"] is a whole column; table.row(ticker) and iteration give plain dicts.
+    """
+
+    def __init__(self, tickers, columns):
+        self.tickers = tuple(tickers)
+        self.columns = columns
+        self.index = {ticker: i for i, ticker in enumerate(self.tickers)}
+
+    def __len__(self):
+        return len(self.tickers)
+
+    def __contains__(self, ticker):
+        return ticker in self.index
+
+    def __getitem__(self, field):
+        return self.columns[field]
+
+    def __iter__(self):
+        for i in range(len(self.tickers)):
+            yield self._row(i)
+
+    def row(self, ticker):
+        return self._row(self.index[ticker])
+
+    def _row(self, i):
+        row = {"ticker": self.tickers[i]}
+        row.update((field, column[i].item()) for field, column in self.columns.items())
+        return row
+
+
+def compute_portfolio_metrics(tickers, holdings, prices, cash):
+    """
+    Per-holding and portfolio metrics in one vectorized pass.
+    holdings maps ticker -> {"shares", "div", "cost_basis"}; prices maps ticker -> last price.
+    """
+    tickers = tuple(tickers)
+    shares = np.array([holdings[t]["shares"] for t in tickers])
+    div = np.array([holdings[t]["div"] for t in tickers], dtype=float)
+    price = np.array([np.nan if prices.get(t) is None else prices[t] for t in tickers], dtype=float)
+    cost_basis = np.array([holdings[t].get("cost_basis", np.nan) for t in tickers], dtype=float)
+    cost_basis = np.where(np.isnan(cost_basis), price, cost_basis)
+
+    weekly = shares * div
+    annual = weekly * 52
+    value = np.nan_to_num(shares * price)
+    cost_total = np.nan_to_num(shares * cost_basis)
+    gain_loss = value - cost_total
+    with np.errstate(divide="ignore", invalid="ignore"):
+        yield_pct = np.where(value > 0, annual / value * 100, 0.0)
+        gain_loss_pct = np.where(cost_total > 0, (value / cost_total - 1) * 100, 0.0)
+
+    total_weekly = weekly.sum()
+    total_cost_basis = cost_total.sum()
+    total_value = value.sum() + cash
+    weight = value / total_value if total_value > 0 else np.zeros(len(tickers))
+
+    monthly_income = total_weekly * 52 / 12
+    annual_income = monthly_income * 12
+    total_yield = (annual_income / total_value * 100) if total_value > 0 else 0
+    total_gain_loss = total_value - total_cost_basis - cash
+    invested = total_cost_basis + cash
+    total_gain_loss_pct = ((total_value / invested) - 1) * 100 if invested > 0 else 0
+
+    table = HoldingsTable(tickers, {
+        "shares": shares,
+        "div": div,
+        "price": price,
+        "weekly": weekly,
+        "monthly": weekly * 52 / 12,
+        "annual": annual,
+        "value": value,
+        "yield_pct": yield_pct,
+        "cost_basis": cost_basis,
+        "cost_total": cost_total,
+        "gain_loss": gain_loss,
+        "gain_loss_pct": gain_loss_pct,
+        "weight": weight
+    })
+
+    return {
+        "holdings": table,
+        "prices": dict(zip(tickers, price.tolist())),
+        "total_weekly": float(total_weekly),
+        "monthly_income": float(monthly_income),
+        "annual_income": float(annual_income),
+        "total_value": float(total_value),
+        "total_yield": float(total_yield),
+        "total_gain_loss": float(total_gain_loss),
+        "total_gain_loss_pct": float(total_gain_loss_pct)
+    }
+
+
+# =====================================================
+# DIVIDEND TRENDS
+# =====================================================
+
+# Change in average distribution (%) beyond which a trend is reported
+DIVIDEND_DECLINE_PCT = -5
+DIVIDEND_INCREASE_PCT = 10
+
+
+class DividendTrendDetector:
+    """
+    Recent vs earlier average distribution for a whole universe of tickers.
+
+    Each ticker keeps its last `history` distributions in a ring buffer with
+    running sums of the newest `window` and of the ones before them, so a new
+    distribution is O(1) and evaluating every ticker is a handful of array
+    operations. Each push bumps `version`; evaluations are cached per version
+    and threshold. Safe to share between sessions and the background refresher.
+    """
+
+    def __init__(self, tickers, window=4, history=8):
+        self.tickers = list(tickers)
+        self.window = window
+        self.history = history
+        self.version = 0
+        self._index = {ticker: i for i, ticker in enumerate(self.tickers)}
+        self._buffer = np.zeros((len(self.tickers), history))
+        self._head = np.zeros(len(self.tickers), dtype=int)
+        self._count = np.zeros(len(self.tickers), dtype=int)
+        self._recent_sum = np.zeros(len(self.tickers))
+        self._previous_sum = np.zeros(len(self.tickers))
+        self._last = {}
+        self._evaluated = {}
+        self._lock = threading.Lock()
+
+    def push(self, ticker, amount):
+        """Record the next distribution for `ticker`"""
+        with self._lock:
+            self._push(self._index[ticker], float(amount))
+            self.version += 1
+
+    def _push(self, i, amount):
+        head, count, buffer = self._head[i], self._count[i], self._buffer[i]
+        if count >= self.history:
+            self._previous_sum[i] -= buffer[head]
+        if count >= self.window:
+            leaving = buffer[(head - self.window) % self.history]
+            self._recent_sum[i] -= leaving
+            self._previous_sum[i] += leaving
+        self._recent_sum[i] += amount
+        buffer[head] = amount
+        self._head[i] = (head + 1) % self.history
+        self._count[i] = min(count + 1, self.history)
+
+    def _revise(self, i, amount):
+        # The newest slot always sits inside the recent window
+        newest = (self._head[i] - 1) % self.history
+        self._recent_sum[i] += amount - self._buffer[i, newest]
+        self._buffer[i, newest] = amount
+
+    def update(self, distributions):
+        """
+        Push every distribution newer than the last one seen, from
+        {ticker: frame with ex_date and amount in ex-date order}. A revised
+        amount for the last ex-date seen replaces it in place.
+        Returns the number of distributions added or revised.
+        """
+        changed = 0
+        with self._lock:
+            for ticker, frame in distributions.items():
+                if ticker not in self._index or frame.empty:
+                    continue
+                i = self._index[ticker]
+                last = self._last.get(ticker)
+                new = frame
+                if last is not None:
+                    last_ex_date, last_amount = last
+                    restated = frame.loc[frame["ex_date"] == last_ex_date, "amount"]
+                    if not restated.empty and float(restated.iloc[-1]) != last_amount:
+                        self._revise(i, float(restated.iloc[-1]))
+                        self._last[ticker] = (last_ex_date, float(restated.iloc[-1]))
+                        changed += 1
+                    new = frame[frame["ex_date"] > last_ex_date]
+                for amount in new["amount"].tolist():
+                    self._push(i, amount)
+                if not new.empty:
+                    self._last[ticker] = (new["ex_date"].iloc[-1], float(new["amount"].iloc[-1]))
+                    changed += len(new)
+            if changed:
+                self.version += 1
+        return changed
+
+    def evaluate(self, drop_threshold):
+        """
+        Trend of every ticker with more than `window` distributions:
+        {"version", "tickers", "kind", "change_pct", "recent_avg", "previous_avg"},
+        kind being dividend_drop / dividend_decline / dividend_increase or "".
+        """
+        with self._lock:
+            key = (self.version, drop_threshold)
+            if key in self._evaluated:
+                return self._evaluated[key]
+
+            ready = self._count > self.window
+            recent_avg = self._recent_sum / self.window
+            with np.errstate(divide="ignore", invalid="ignore"):
+                previous_avg = np.where(ready, self._previous_sum / (self._count - self.window), 0.0)
+                change_pct = np.where(previous_avg > 0, (recent_avg / previous_avg - 1) * 100, 0.0)
+            kind = np.select(
+                [change_pct < -drop_threshold, change_pct < DIVIDEND_DECLINE_PCT, change_pct > DIVIDEND_INCREASE_PCT],
+                ["dividend_drop", "dividend_decline", "dividend_increase"],
+                default=""
+            )
+            kind = np.where(ready, kind, "")
+            result = {
+                "version": self.version,
+                "tickers": self.tickers,
+                "kind": kind,
+                "change_pct": change_pct,
+                "recent_avg": recent_avg,
+                "previous_avg": previous_avg
+            }
+            self._evaluated = {key: result}
+            return result
+
+
+# =====================================================
+# FACTOR SCORING
+# =====================================================
+
+LADDER_OPS = {
+    "<": np.less,
+    "<=": np.less_equal,
+    ">": np.greater,
+    ">=": np.greater_equal,
+    "==": np.equal
+}
+
+
+def ladder(values, rungs):
+    """
+    Vectorized if/elif ladder: for each value, the index of the first (op, threshold)
+    rung it satisfies, len(rungs) when none does and len(rungs) + 1 when it is NaN.
+    """
+    values = np.asarray(values, dtype=float)
+    conditions = [np.isnan(values)] + [LADDER_OPS[op](values, threshold) for op, threshold in rungs]
+    return np.select(conditions, [len(rungs) + 1] + list(range(len(rungs))), default=len(rungs))
+
+
+def score_factors(values, factors):
+    """
+    Score a whole universe on several factors at once.
+
+    values maps factor -> one value per candidate. Each factor config has
+    "rungs" for ladder() plus either "points" (one per case: each rung, the
+    default, then NaN) or "weight" to score value * weight whatever the case.
+    Returns (total, {factor: (points, case)}) with one entry per candidate.
+    """
+    total = 0.0
+    breakdown = {}
+    for name, factor in factors.items():
+        value = np.asarray(values[name], dtype=float)
+        case = ladder(value, factor["rungs"])
+        if "weight" in factor:
+            points = np.nan_to_num(value) * factor["weight"]
+        else:
+            points = np.asarray(factor["points"])[case]
+        breakdown[name] = (points, case)
+        total = total + points
+    return total, breakdown
+
+
+def top_k(scores, k):
+    """
+    Indices of the k highest scores, best first, via a partial sort.
+    Ties go to the earlier candidate, as max() over the candidates would.
+    """
+    scores = np.asarray(scores)
+    k = min(k, len(scores))
+    if k == 0:
+        return np.array([], dtype=int)
+    cutoff = np.partition(scores, len(scores) - k)[len(scores) - k]
+    candidates = np.flatnonzero(scores >= cutoff)
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order[:k]]
+
+
+# =====================================================
+# REBALANCE OPTIMIZER
+# =====================================================
+
+# Objective weight per $ of cap or risk-budget overshoot - far above any income per $
+REBALANCE_VIOLATION_PENALTY = 1.0
+
+
+class RebalanceOptimizer:
+    """
+    Whole-share rebalancing that maximizes monthly income.
+
+    The trades come from a linear program (HiGHS):
+
+        maximize    income(x + b - s) - trade_cost * p.(b + s)
+        subject to  p.b - p.s <= cash                      (self-funded)
+                    p.s <= turnover * V,  p.b <= turnover * V + cash
+                    p_i (x_i + b_i - s_i) <= cap * V       (concentration)
+                    sum_i risk_i p_i (x_i + b_i - s_i) <= risk_budget * V
+                    0 <= s <= x,  0 <= b (0 where buying is not allowed)
+
+    Cap and risk rows carry penalized slack, so a portfolio that already breaks
+    them still gets the plan that moves furthest towards compliance within the
+    turnover limit. The relaxed solution is then repaired to whole shares.
+
+    HiGHS exposes no basis warm start through scipy, so the previous whole-share
+    plan is the warm start instead: when the holdings and every constraint are
+    unchanged and that plan is still feasible and within `tolerance` of the new
+    LP optimum, it is kept, which also stops plans flickering between reruns on
+    small price moves.
+    """
+
+    def __init__(self, tolerance=0.005):
+        self.tolerance = tolerance
+        self._previous = None
+
+    def solve(self, shares, price, income, risk, cash, cap, risk_budget, turnover,
+              buyable=None, trade_cost=0.001, whole_shares=True):
+        """
+        shares, price, income (monthly per share) and risk (per-$ weight) are
+        per-ticker arrays. Returns {"buy", "sell"} whole-share arrays (fractional
+        with whole_shares=False) plus "income_change" and "status" ("optimal",
+        "warm_start" or the LP message).
+        """
+        # Funds without a usable price can be neither bought nor sold
+        p = np.nan_to_num(np.asarray(price, dtype=float))
+        x = np.where(p > 0, np.asarray(shares, dtype=float), 0.0)
+        w = np.nan_to_num(np.asarray(income, dtype=float))
+        rho = np.asarray(risk, dtype=float)
+        n = len(x)
+        buyable = np.ones(n, dtype=bool) if buyable is None else np.asarray(buyable, dtype=bool)
+        buyable = buyable & (p > 0)
+        value = float(np.dot(x, p))
+        none = {"buy": np.zeros(n, dtype=int), "sell": np.zeros(n, dtype=int), "income_change": 0.0}
+        if n == 0 or value <= 0:
+            return dict(none, status="empty")
+
+        # Variables: buys b (n), sells s (n), cap slack u (n), risk slack r (1)
+        identity = sparse.identity(n, format="csr")
+        price_diag = sparse.diags(p)
+        zeros = sparse.csr_matrix((1, n))
+        a_ub = sparse.vstack([
+            sparse.hstack([p[None, :], -p[None, :], zeros, [[0]]]),
+            sparse.hstack([zeros, p[None, :], zeros, [[0]]]),
+            sparse.hstack([p[None, :], zeros, zeros, [[0]]]),
+            sparse.hstack([price_diag, -price_diag, -identity, sparse.csr_matrix((n, 1))]),
+            sparse.hstack([(rho * p)[None, :], -(rho * p)[None, :], zeros, [[-1]]])
+        ], format="csr")
+        b_ub = np.concatenate([
+            [cash, turnover * value, turnover * value + cash],
+            cap * value - p * x,
+            [risk_budget * value - np.dot(rho * p, x)]
+        ])
+        c = np.concatenate([
+            -w + trade_cost * p,
+            w + trade_cost * p,
+            np.full(n + 1, REBALANCE_VIOLATION_PENALTY)
+        ])
+        bounds = (
+            [(0, None) if ok else (0, 0) for ok in buyable]
+            + [(0, held) for held in x]
+            + [(0, None)] * (n + 1)
+        )
+        lp = linprog(c, A_ub=a_ub, b_ub=b_ub, bounds=bounds, method="highs")
+        if not lp.success:
+            return dict(none, status=lp.message)
+
+        if whole_shares:
+            buy, sell = self._whole_shares(lp.x[:n], lp.x[n:2 * n], x, p, w, rho, cash, cap * value,
+                                           risk_budget * value, turnover * value)
+        else:
+            buy, sell = np.maximum(lp.x[:n], 0), np.clip(lp.x[n:2 * n], 0, x)
+        objective = lambda b, s: float(np.dot(c[:2 * n], np.concatenate([b, s])) + self._violation(
+            b, s, x, p, rho, cap * value, risk_budget * value))
+
+        # The previous plan only carries over when every constraint is unchanged
+        key = (tuple(x), tuple(buyable), tuple(rho), cash, cap, risk_budget, turnover, trade_cost, whole_shares)
+        status = "optimal"
+        if self._previous is not None and self._previous[0] == key:
+            prev_buy, prev_sell = self._previous[1]
+            if (self._feasible(prev_buy, prev_sell, x, p, cash, turnover * value)
+                    and objective(prev_buy, prev_sell) <= objective(buy, sell) + self.tolerance * abs(lp.fun)):
+                buy, sell, status = prev_buy, prev_sell, "warm_start"
+        self._previous = (key, (buy, sell))
+
+        return {
+            "buy": buy,
+            "sell": sell,
+            "income_change": float(np.dot(w, buy - sell)),
+            "status": status
+        }
+
+    @staticmethod
+    def _violation(buy, sell, x, p, rho, cap_value, risk_value):
+        held = p * (x + buy - sell)
+        overshoot = np.maximum(held - cap_value, 0).sum() + max(np.dot(rho, held) - risk_value, 0)
+        return REBALANCE_VIOLATION_PENALTY * overshoot
+
+    @staticmethod
+    def _feasible(buy, sell, x, p, cash, turnover_value):
+        bought, sold = np.dot(p, buy), np.dot(p, sell)
+        return (np.all(sell <= x) and bought - sold <= cash + 1e-9
+                and sold <= turnover_value + 1e-9 and bought <= turnover_value + cash + 1e-9)
+
+    @staticmethod
+    def _whole_shares(buy, sell, x, p, w, rho, cash, cap_value, risk_value, turnover_value):
+        """
+        Round the relaxed trades to whole shares without breaking cash or turnover.
+        Top-up buys also stay within the cap and the risk budget, but flooring a
+        sell can leave a position a fraction of a share over either.
+        """
+        candidates = buy > 1e-6
+        sell = np.minimum(np.floor(sell + 1e-6), x).astype(int)
+        buy = np.floor(buy + 1e-6).astype(int)
+        budget = lambda: min(cash + np.dot(p, sell), turnover_value + cash) - np.dot(p, buy)
+
+        # Drop the least productive buys until the budget holds, then top up the best ones
+        order = [i for i in np.argsort(-np.divide(w, p, out=np.zeros_like(w), where=p > 0)) if candidates[i]]
+        for i in reversed(order):
+            while buy[i] > 0 and budget() < -1e-9:
+                buy[i] -= 1
+        risk = lambda: np.dot(rho * p, x + buy - sell)
+        for i in order:
+            while (p[i] <= budget() + 1e-9 and p[i] * (x[i] + buy[i] - sell[i] + 1) <= cap_value + 1e-9
+                   and risk() + rho[i] * p[i] <= risk_value + 1e-9):
+                buy[i] += 1
+        return buy, sell
+
+
+# =====================================================
+# HEADLINE SENTIMENT
+# =====================================================
+
+def _trie_pattern(words):
+    """Regex alternation of `words` factored into a prefix trie, so matching never backtracks across words"""
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if "" in node:
+            return (body if len(branches) == 1 and len(body) == 1 else "(?:" + body + ")") + "?"
+        return body
+
+    return build(trie)
+
+
+class HeadlineSentiment:
+    """
+    Keyword sentiment for headlines in [-damping, damping].
+
+    Keywords match whole words, as written or in the forms `inflections` lists
+    for them, through a single compiled, trie-factored regex ("rise" with
+    ["rising", ...] matches "rising" but not "enterprise"). Each keyword
+    counts once per headline; the score is (positive - negative) / (positive +
+    negative), damped. score_many() runs the regex once over a whole batch, and
+    scores are memoized by a hash of the normalized headline, so repeated
+    articles cost a dict lookup.
+    """
+
+    def __init__(self, positive, negative, inflections=None, damping=0.8, max_memo=100_000):
+        self.damping = damping
+        self.max_memo = max_memo
+        self._keywords = list(positive) + list(negative)
+        self._weights = np.array(list(positive.values()) + [-w for w in negative.values()], dtype=float)
+        self._form_to_keyword = {}
+        for k, word in enumerate(self._keywords):
+            for form in [word, *(inflections or {}).get(word, ())]:
+                self._form_to_keyword.setdefault(form.lower(), k)
+        self._pattern = re.compile(r"\b" + _trie_pattern(self._form_to_keyword) + r"\b")
+        self._memo = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(normalized):
+        return hashlib.blake2b(normalized.encode("utf-8"), digest_size=8).digest()
+
+    def score(self, title):
+        """Sentiment of one headline"""
+        return float(self.score_many([title])[0])
+
+    def score_many(self, titles):
+        """Sentiment of every headline, as an array in input order"""
+        normalized = [" ".join(str(title).lower().split()) for title in titles]
+        keys = [self._key(text) for text in normalized]
+        scores = np.empty(len(titles))
+        missing = {}
+        with self._lock:
+            for i, key in enumerate(keys):
+                cached = self._memo.get(key)
+                if cached is None:
+                    missing.setdefault(key, []).append(i)
+                else:
+                    scores[i] = cached
+
+        if missing:
+            fresh = self._score_batch([normalized[positions[0]] for positions in missing.values()])
+            with self._lock:
+                if len(self._memo) + len(missing) > self.max_memo:
+                    self._memo.clear()
+                for (key, positions), value in zip(missing.items(), fresh.tolist()):
+                    self._memo[key] = value
+                    scores[positions] = value
+        return scores
+
+    def _score_batch(self, texts):
+        # One regex pass over all headlines joined by newlines, mapped back by offset
+        starts = np.cumsum([0] + [len(text) + 1 for text in texts[:-1]])
+        matches = [(match.start(), self._form_to_keyword[match.group()])
+                   for match in self._pattern.finditer("\n".join(texts))]
+
+        positive = np.zeros(len(texts))
+        negative = np.zeros(len(texts))
+        if matches:
+            offsets, keywords = np.array(matches).T
+            rows = np.searchsorted(starts, offsets, side="right") - 1
+            # Each keyword counts once per headline
+            rows, keywords = np.unique(np.stack([rows, keywords]), axis=1)
+            weights = self._weights[keywords]
+            np.add.at(positive, rows, np.maximum(weights, 0))
+            np.add.at(negative, rows, np.maximum(-weights, 0))
+        total = positive + negative
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(total > 0, (positive - negative) / total * self.damping, 0.0)
+
+
+# =====================================================
+# COMPOUND PROJECTION
+# =====================================================
+
+WEEKS_PER_MONTH = 52 / 12
+
+
+def project_compound_growth(shares, div, price, cash, monthly_deposit, target, max_months=360):
+    """
+    Month-by-month growth with all dividends plus a fixed deposit reinvested in
+    proportion to current holdings value, at constant prices and dividends.
+
+    Proportional reinvestment buys every position in the same ratio, so shares
+    stay s_k = c_k * s_0 with a scalar c_{k+1} = c_k * (1 + r) + D / M_0, where
+    M_0 is the starting market value and r the monthly income yield on it.
+    The whole trajectory is therefore one closed-form array expression.
+
+    Returns months, value, income (1-D) and shares (months x tickers), cut at
+    the first month whose income reaches `target`.
+    """
+    shares = np.asarray(shares, dtype=float)
+    income0 = WEEKS_PER_MONTH * float(np.dot(shares, div))
+    value0 = float(np.dot(shares, price))
+
+    k = np.arange(max_months + 1, dtype=float)
+    if value0 > 0:
+        r = income0 / value0
+        deposit = monthly_deposit / value0
+        if r > 0:
+            growth = (1 + r) ** k * (1 + deposit / r) - deposit / r
+        else:
+            growth = 1 + k * deposit
+    else:
+        # Nothing to weight purchases by, so nothing is ever bought
+        growth = np.ones_like(k)
+
+    income = income0 * growth
+    hits = np.flatnonzero(income[:max_months] >= target)
+    reached = hits.size > 0
+    end = int(hits[0]) if reached else max_months - 1
+    # When the target is never reached, the last month's purchases still happen
+    final_growth = growth[end] if reached else growth[max_months]
+
+    months = np.arange(end + 1)
+    return {
+        "months": months,
+        "value": cash + value0 * growth[:end + 1],
+        "income": income[:end + 1],
+        "shares": np.outer(growth[:end + 1], shares),
+        "final_shares": shares * final_growth,
+        "months_to_target": end if reached else max_months,
+        "reached": reached
+    }
+
+
+def sweep_compound_growth(shares, div, price, deposits, targets, reinvest_fractions, max_months=360):
+    """
+    Months to target for every (reinvest fraction, deposit, target) combination
+    in one batch. Reinvesting a fraction f of dividends turns the recurrence of
+    project_compound_growth into c_{k+1} = c_k * (1 + f * r) + D / M_0, evaluated
+    in closed form over the whole grid at once; the rest is paid out as cash.
+
+    Income never falls over time, so the first month reaching a target is the
+    number of months below it. Returns a (fractions x deposits x targets) int
+    array with max_months wherever the target is not reached.
+    """
+    shares = np.asarray(shares, dtype=float)
+    income0 = WEEKS_PER_MONTH * float(np.dot(shares, div))
+    value0 = float(np.dot(shares, price))
+    fractions = np.asarray(reinvest_fractions, dtype=float)[:, None, None]
+    deposits = np.asarray(deposits, dtype=float)[None, :, None]
+    targets = np.asarray(targets, dtype=float)
+
+    k = np.arange(max_months, dtype=float)[None, None, :]
+    if value0 > 0 and income0 > 0:
+        rate = fractions * income0 / value0
+        deposit = deposits / value0
+        with np.errstate(divide="ignore", invalid="ignore"):
+            compounding = (1 + rate) ** k * (1 + deposit / rate) - deposit / rate
+        growth = np.where(rate > 0, compounding, 1 + k * deposit)
+    else:
+        # No income to compound, or nothing to weight purchases by
+        growth = np.ones((fractions.shape[0], deposits.shape[1], max_months))
+
+    income = income0 * growth
+    return (income[..., None] < targets).sum(axis=2)
+
+
+# =====================================================
+# GOAL SOLVER
+# =====================================================
+
+# What solve_goal can solve for, with the largest value it will search up to
+GOAL_LIMITS = {
+    "deposit": 1e9,   # $ per month
+    "cash": 1e10,     # $ lump sum invested at the start
+    "yield": 1000.0   # annual portfolio yield, %
+}
+
+
+def _income_after(value0, income0, monthly_deposit, months):
+    """Monthly income after `months` of project_compound_growth, from its closed form"""
+    if value0 <= 0 or income0 <= 0:
+        return 0.0
+    r = income0 / value0
+    deposit = monthly_deposit / value0
+    return income0 * ((1 + r) ** months * (1 + deposit / r) - deposit / r)
+
+
+def solve_goal(shares, div, price, monthly_deposit, target, months, solve_for="deposit", tolerance=0.01):
+    """
+    Smallest monthly deposit, starting lump sum or annual portfolio yield (%) for
+    which the compound projection reaches `target` monthly income after `months`.
+    A lump sum is invested across holdings in proportion to their value; a yield
+    replaces the current one at today's prices. Income rises with each of these,
+    so the answer is bisected on the closed form, a few dozen cheap evaluations.
+
+    Returns {"solve_for", "value", "income", "months"}; value is None when the
+    goal is out of reach (no holdings to compound, or beyond GOAL_LIMITS).
+    """
+    if solve_for not in GOAL_LIMITS:
+        raise ValueError(f"Cannot solve for {solve_for!r}")
+
+    shares = np.asarray(shares, dtype=float)
+    income0 = WEEKS_PER_MONTH * float(np.dot(shares, div))
+    value0 = float(np.dot(shares, price))
+
+    if solve_for == "deposit":
+        income = lambda x: _income_after(value0, income0, x, months)
+    elif solve_for == "cash":
+        income = lambda x: _income_after(value0 + x, income0 * (1 + x / value0) if value0 > 0 else 0.0,
+                                         monthly_deposit, months)
+    else:
+        income = lambda x: _income_after(value0, value0 * x / 100 / 12, monthly_deposit, months)
+
+    result = {"solve_for": solve_for, "value": None, "income": None, "months": months}
+    low, high = 0.0, 1.0
+    if income(low) >= target:
+        high = low
+    else:
+        while income(high) < target:
+            if high >= GOAL_LIMITS[solve_for]:
+                return result
+            high = min(high * 2, GOAL_LIMITS[solve_for])
+        while high - low > tolerance:
+            middle = (low + high) / 2
+            if income(middle) >= target:
+                high = middle
+            else:
+                low = middle
+
+    result.update(value=high, income=income(high))
+    return result
+
+
+# =====================================================
+# MONTE CARLO PROJECTION
+# =====================================================
+
+MC_PERCENTILES = (10, 25, 50, 75, 90)
+
+
+def _months(index):
+    """Calendar months of a (possibly tz-aware) DatetimeIndex"""
+    return pd.DatetimeIndex(index).tz_localize(None).to_period("M")
+
+
+def monthly_scenarios(closes, distributions):
+    """
+    Joint monthly scenarios for a bootstrap: one row per calendar month, one
+    column per ticker, holding that month's price return and change in average
+    distribution. closes / distributions map ticker -> Series indexed by date;
+    closes must be raw, not dividend-adjusted, or the income simulated on top
+    of the price path would be counted twice. Only months where every ticker with history has both values are kept, so a
+    sampled row moves all funds together. Tickers with no history stay flat.
+    """
+    returns = {}
+    changes = {}
+    for ticker, series in closes.items():
+        dist = distributions.get(ticker)
+        if series is None or series.empty or dist is None or dist.empty:
+            continue
+        monthly_close = series.groupby(_months(series.index)).last()
+        monthly_dist = dist.groupby(_months(dist.index)).mean()
+        returns[ticker] = monthly_close.pct_change()
+        changes[ticker] = monthly_dist.pct_change()
+
+    tickers = list(closes)
+    if not returns:
+        return np.zeros((0, len(tickers))), np.zeros((0, len(tickers)))
+
+    columns = {("r", t): s for t, s in returns.items()}
+    columns.update({("d", t): s for t, s in changes.items()})
+    frame = pd.concat(columns, axis=1).dropna()
+    flat = pd.Series(0.0, index=frame.index)
+    price_returns = np.column_stack([frame[("r", t)] if t in returns else flat for t in tickers])
+    dist_changes = np.column_stack([frame[("d", t)] if t in changes else flat for t in tickers])
+    return price_returns, dist_changes
+
+
+def simulate_income_paths(shares, div, price, cash, monthly_deposit, target, price_returns, dist_changes,
+                          n_paths, seed, max_months=360):
+    """
+    One shard of Monte Carlo paths. Each month records income and value, reinvests
+    dividends plus the deposit proportionally (as project_compound_growth does),
+    then applies a bootstrapped joint row of price returns and distribution changes.
+
+    Proportional reinvestment keeps every path's shares at c * s_0, so only the
+    scalar c is tracked per path, next to per-ticker value and income weights
+    laid out (tickers x paths) so each month is a few contiguous passes.
+
+    Returns value and monthly income at every year mark (years x paths, float32)
+    and each path's month of first reaching `target` (-1 if it never does).
+    """
+    rng = np.random.default_rng(seed)
+    shares = np.asarray(shares, dtype=float)
+    value_weights = np.tile((shares * price)[:, None], (1, n_paths))
+    income_weights = np.tile((WEEKS_PER_MONTH * shares * div)[:, None], (1, n_paths))
+    growth_factors = np.ascontiguousarray(1 + np.asarray(price_returns, dtype=float).T)
+    dist_factors = np.ascontiguousarray(1 + np.asarray(dist_changes, dtype=float).T)
+    scale = np.ones(n_paths)
+
+    years = max_months // 12 + 1
+    value_marks = np.empty((years, n_paths), dtype=np.float32)
+    income_marks = np.empty((years, n_paths), dtype=np.float32)
+    hit_month = np.full(n_paths, -1, dtype=np.int16)
+
+    for month in range(max_months + 1):
+        income = scale * income_weights.sum(axis=0)
+        market_value = scale * value_weights.sum(axis=0)
+        if month % 12 == 0:
+            value_marks[month // 12] = cash + market_value
+            income_marks[month // 12] = income
+        if month < max_months:
+            hit_month[(hit_month < 0) & (income >= target)] = month
+        if month == max_months:
+            break
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            scale *= np.where(market_value > 0, 1 + (income + monthly_deposit) / market_value, 1.0)
+
+        if growth_factors.shape[1]:
+            rows = rng.integers(0, growth_factors.shape[1], n_paths)
+            value_weights *= np.take(growth_factors, rows, axis=1)
+            income_weights *= np.take(dist_factors, rows, axis=1)
+
+    return {"value": value_marks, "income": income_marks, "hit_month": hit_month}
+
+
+def summarize_paths(shards, percentiles=MC_PERCENTILES):
+    """Percentile bands per year for value and income, plus time-to-target percentiles"""
+    value = np.concatenate([shard["value"] for shard in shards], axis=1)
+    income = np.concatenate([shard["income"] for shard in shards], axis=1)
+    hit_month = np.concatenate([shard["hit_month"] for shard in shards])
+
+    # Nearest-rank percentiles; paths that never reach the target sort last and read as None
+    months = np.sort(np.where(hit_month >= 0, hit_month, np.inf))
+    ranks = {q: months[int(q / 100 * (len(months) - 1))] for q in percentiles}
+    return {
+        "paths": len(hit_month),
+        "years": np.arange(value.shape[0]),
+        "value_bands": dict(zip(percentiles, np.percentile(value, percentiles, axis=1))),
+        "income_bands": dict(zip(percentiles, np.percentile(income, percentiles, axis=1))),
+        "months_to_target": {q: None if np.isinf(m) else int(m) for q, m in ranks.items()},
+        "reach_probability": float((hit_month >= 0).mean())
+    }
+
+
+def run_monte_carlo(pool, n_paths, shards, seed=None, **params):
+    """
+    Split n_paths across `shards` independent seeds, run them on `pool`
+    (any concurrent.futures executor; None runs inline) and summarize.
+    """
+    seeds = np.random.SeedSequence(seed).spawn(shards)
+    sizes = [n_paths // shards + (1 if i < n_paths % shards else 0) for i in range(shards)]
+    if pool is None:
+        results = [simulate_income_paths(n_paths=size, seed=s, **params) for size, s in zip(sizes, seeds)]
+    else:
+        futures = [pool.submit(simulate_income_paths, n_paths=size, seed=s, **params) for size, s in zip(sizes, seeds)]
+        results = [future.result() for future in futures]
+    return summarize_paths(results)
+
+
+# =====================================================
+# HISTORICAL BACKTEST
+# =====================================================
+
+def _days(index):
+    """Calendar days of a (possibly tz-aware) DatetimeIndex"""
+    return pd.DatetimeIndex(index).tz_localize(None).normalize()
+
+
+def daily_panel(closes, distributions):
+    """
+    Align per-ticker history on one trading calendar, one column per ticker.
+    closes / distributions map ticker -> Series indexed by date; closes should be
+    raw prices, since every replay pays the distributions on top. Returns
+    (dates, close, dist): close is forward-filled and NaN before a fund's first
+    bar; dist holds each distribution on the first trading day on or after its
+    ex-date and 0 elsewhere.
+    """
+    tickers = list(closes)
+    series = {t: s.groupby(_days(s.index)).last() for t, s in closes.items() if s is not None and not s.empty}
+    if not series:
+        return pd.DatetimeIndex([]), np.zeros((0, len(tickers))), np.zeros((0, len(tickers)))
+
+    frame = pd.concat(series, axis=1).sort_index().ffill().reindex(columns=tickers)
+    dates = frame.index
+    close = frame.to_numpy(dtype=float)
+    dist = np.zeros_like(close)
+    for col, ticker in enumerate(tickers):
+        amounts = distributions.get(ticker)
+        if amounts is None or amounts.empty:
+            continue
+        rows = dates.searchsorted(_days(amounts.index))
+        keep = rows < len(dates)
+        np.add.at(dist[:, col], rows[keep], np.asarray(amounts, dtype=float)[keep])
+    return dates, close, dist
+
+
+def week_ends(dates):
+    """Row index of the last trading day of every calendar week in `dates`"""
+    weeks = pd.DatetimeIndex(dates).to_period("W").asi8
+    return np.flatnonzero(np.append(weeks[1:] != weeks[:-1], True))
+
+
+def trailing_change(close, bars):
+    """% change over the last `bars` closes of every row, NaN without enough data"""
+    change = np.full(close.shape, np.nan)
+    if len(close) >= bars:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            change[bars - 1:] = (close[bars - 1:] / close[:len(close) - bars + 1] - 1) * 100
+    return change
+
+
+def trailing_sum(dates, values, days):
+    """Sum of each column over the `days` calendar days ending at (and including) every row"""
+    dates = pd.DatetimeIndex(dates)
+    total = np.vstack([np.zeros(values.shape[1]), np.cumsum(values, axis=0)])
+    start = dates.searchsorted(dates - pd.Timedelta(days=days), side="right")
+    return total[1:] - total[start]
+
+
+def distribution_change(dist, window=4, history=8):
+    """
+    DividendTrendDetector's change (%) of the newest `window` distributions'
+    average against the (up to) `history - window` before them, as of every
+    row at once. NaN until a ticker has more than `window` distributions.
+    """
+    paid = dist > 0
+    count = np.cumsum(paid, axis=0)
+    # Running total after each ticker's k-th distribution: cum[ticker, k]
+    cum = np.zeros((dist.shape[1], int(count[-1].max(initial=0)) + 1 if len(dist) else 1))
+    rows, cols = np.nonzero(paid)
+    cum[cols, count[rows, cols]] = dist[rows, cols]
+    cum = np.cumsum(cum, axis=1)
+
+    column = np.arange(dist.shape[1])
+    upto = lambda k: cum[column, np.maximum(k, 0)]
+    earlier = np.clip(np.minimum(count, history) - window, 1, None)
+    recent_avg = (upto(count) - upto(count - window)) / window
+    previous_avg = (upto(count - window) - upto(count - window - earlier)) / earlier
+    with np.errstate(divide="ignore", invalid="ignore"):
+        change = np.where(previous_avg > 0, (recent_avg / previous_avg - 1) * 100, 0.0)
+    return np.where(count > window, change, np.nan)
+
+
+def simulate_weekly_buys(close, dist, weeks, amount, score, concentration):
+    """
+    Replay a weekly buying rule against buying everything equally.
+
+    Each row index in `weeks` invests `amount`: the rule buys the priced fund
+    with the best score[w] plus the points the `concentration` factor config
+    gives its current weight (% of holdings); the benchmark splits `amount`
+    over every priced fund. Shares are fractional and distributions are paid
+    out, not reinvested. Income for a week is what the shares held before that
+    week's buy received since the previous week.
+    Returns {"picks", "invested", "advisor", "equal"}, each strategy holding
+    per-week "value", "income" (cumulative) and "total_return_pct".
+    """
+    paid = np.cumsum(dist, axis=0)[weeks]
+    weekly_dist = np.diff(paid, axis=0, prepend=np.zeros((1, dist.shape[1])))
+    prices = np.nan_to_num(close[weeks])
+    n_weeks, n = prices.shape
+
+    shares = {"advisor": np.zeros(n), "equal": np.zeros(n)}
+    curves = {name: {"value": np.zeros(n_weeks), "income": np.zeros(n_weeks)} for name in shares}
+    picks = np.full(n_weeks, -1)
+    invested = np.zeros(n_weeks)
+    income = dict.fromkeys(shares, 0.0)
+    spent = 0.0
+    for w in range(n_weeks):
+        price = prices[w]
+        priced = price > 0
+        for name, held in shares.items():
+            income[name] += held @ weekly_dist[w]
+
+        if priced.any():
+            held_value = shares["advisor"] * price
+            total_value = held_value.sum()
+            weight = held_value / total_value * 100 if total_value > 0 else np.zeros(n)
+            points, _ = score_factors({"concentration": weight}, {"concentration": concentration})
+            pick = top_k(np.where(priced, score[w] + points, -np.inf), 1)[0]
+            shares["advisor"][pick] += amount / price[pick]
+            shares["equal"][priced] += amount / priced.sum() / price[priced]
+            picks[w] = pick
+            spent += amount
+
+        invested[w] = spent
+        for name, held in shares.items():
+            curves[name]["value"][w] = held @ price
+            curves[name]["income"][w] = income[name]
+
+    for curve in curves.values():
+        with np.errstate(divide="ignore", invalid="ignore"):
+            gain = (curve["value"] + curve["income"]) / invested - 1
+        curve["total_return_pct"] = np.where(invested > 0, gain * 100, 0.0)
+    return {"picks": picks, "invested": invested, **curves}
+
+
+def walk_forward_rebalance(close, dist, weeks, income, weights, capital, risk, score, concentration, min_score,
+                           cap, risk_budget, turnover, commission=0.0, spread_pct=0.0, whole_shares=True):
+    """
+    Follow RebalanceOptimizer every week over history and pay for the trades.
+
+    `capital` starts in `weights` (renormalized over the funds priced on the
+    first week, whole shares when whole_shares). Each row index in `weeks` then
+    rebalances on that day's prices and income[w] (monthly income per share known
+    by then), buying only funds whose score[w] plus the points the
+    `concentration` factor gives their weight reaches min_score. Buys fill at the
+    ask and sells at the bid (price +/- spread_pct / 2) plus `commission` per
+    order; leftover cash waits for the next rebalance and distributions are
+    paid out, so close must be raw rather than dividend-adjusted prices. The
+    same start held untouched is tracked as "hold".
+
+    Returns per-week "value" (holdings + cash), "income" (cumulative), "costs"
+    (cumulative) and "traded" ($ bought + sold) for both runs, plus
+    "turnover_pct" (annualized traded / average value), "max_drawdown_pct" and
+    "income_lost": what the money spent on costs would have earned at the
+    portfolio's own yield.
+    """
+    paid = np.cumsum(dist, axis=0)[weeks]
+    weekly_dist = np.diff(paid, axis=0, prepend=np.zeros((1, dist.shape[1])))
+    prices = np.nan_to_num(close[weeks])
+    n_weeks, n = prices.shape
+    optimizer = RebalanceOptimizer()
+    half_spread = spread_pct / 200
+
+    start = prices[0] > 0
+    weights = np.where(start, np.asarray(weights, dtype=float), 0.0)
+    weights = weights / weights.sum() if weights.sum() > 0 else start / max(start.sum(), 1)
+    shares = np.divide(capital * weights, prices[0], out=np.zeros(n), where=start)
+    if whole_shares:
+        shares = np.floor(shares)
+    cash = capital - np.dot(shares, prices[0])
+    held = {"rebalance": [shares.copy(), cash], "hold": [shares.copy(), cash]}
+
+    curves = {name: {key: np.zeros(n_weeks) for key in ("value", "income", "costs", "traded")} for name in held}
+    income_lost = 0.0
+    for w in range(n_weeks):
+        price = prices[w]
+        for name, (x, _) in held.items():
+            curves[name]["income"][w] = (curves[name]["income"][w - 1] if w else 0.0) + x @ weekly_dist[w]
+
+        x, cash = held["rebalance"]
+        value = x @ price + cash
+        weight = np.divide(x * price, value, out=np.zeros(n), where=value > 0) * 100
+        points, _ = score_factors({"concentration": weight}, {"concentration": concentration})
+        plan = optimizer.solve(x, price, income[w], risk, cash, cap, risk_budget, turnover,
+                               buyable=score[w] + points >= min_score,
+                               trade_cost=half_spread, whole_shares=whole_shares)
+        buy, sell = plan["buy"].astype(float), plan["sell"].astype(float)
+
+        # Fill at the bid/ask; if that overdraws the cash, trim the buys to fit
+        orders = np.count_nonzero(buy) + np.count_nonzero(sell)
+        available = cash + np.dot(sell, price) * (1 - half_spread) - orders * commission
+        cost = np.dot(buy, price) * (1 + half_spread)
+        if cost > available and cost > 0:
+            buy = buy * max(available, 0) / cost
+            buy = np.floor(buy) if whole_shares else buy
+            orders = np.count_nonzero(buy) + np.count_nonzero(sell)
+        traded = np.dot(buy + sell, price)
+        costs = traded * half_spread + orders * commission
+        cash += np.dot(sell - buy, price) - costs
+        x = x + buy - sell
+        held["rebalance"] = [x, cash]
+
+        curve = curves["rebalance"]
+        curve["traded"][w] = traded
+        curve["costs"][w] = (curve["costs"][w - 1] if w else 0.0) + costs
+        for name, (x, cash) in held.items():
+            curves[name]["value"][w] = x @ price + cash
+        # Money already spent on costs would have earned this week's portfolio yield
+        if w and curve["value"][w - 1] > 0:
+            earned = curve["income"][w] - curve["income"][w - 1]
+            income_lost += curve["costs"][w - 1] * earned / curve["value"][w - 1]
+
+    years = max(n_weeks / 52, 1 / 52)
+    for curve in curves.values():
+        average = curve["value"].mean() if n_weeks else 0.0
+        curve["turnover_pct"] = curve["traded"].sum() / average / years * 100 if average > 0 else 0.0
+        peak = np.maximum.accumulate(curve["value"]) if n_weeks else curve["value"]
+        drawdown = np.divide(curve["value"], peak, out=np.ones(n_weeks), where=peak > 0) - 1
+        curve["max_drawdown_pct"] = float(-drawdown.min() * 100) if n_weeks else 0.0
+    curves["rebalance"]["income_lost"] = income_lost
+    return curves
+
+
+def first_crossings(low, high, stops, targets):
+    """
+    Index of the first bar whose low falls to each stop level and whose high
+    reaches each target level, len(low) for levels never crossed. The running
+    min of lows / max of highs are monotone, so every level is one binary search.
+    """
+    floor = np.minimum.accumulate(low)
+    ceiling = np.maximum.accumulate(high)
+    stop_bar = np.searchsorted(-floor, -np.asarray(stops, dtype=float), side="left")
+    target_bar = np.searchsorted(ceiling, np.asarray(targets, dtype=float), side="left")
+    return stop_bar, target_bar
+
+
+def exit_rule_sweep(open_, low, high, close, dist, stop_pcts, target_pcts):
+    """
+    Every stop-loss x target-gain setting for one share bought at the first close.
+    Bars must be raw prices - the ones alerts are judged on - with distributions
+    in dist rather than folded into an adjusted series.
+
+    A stop at s% sells at entry * (1 - s/100), or at the open when the bar gaps
+    below it; a target at g% sells at entry * (1 + g/100) or a higher open. When
+    both trigger on the same bar the stop is assumed to fill first; np.inf turns
+    a rule off. Settings that never trigger hold to the last close. dist is the
+    distribution per share paid on each bar, kept up to and including the exit bar.
+    Returns (stops x targets) arrays "kind" (0 held, 1 stopped, 2 target hit),
+    "exit_bar", "exit_price" and "income".
+    """
+    entry = close[0]
+    stop_levels = entry * (1 - np.asarray(stop_pcts, dtype=float) / 100)
+    target_levels = entry * (1 + np.asarray(target_pcts, dtype=float) / 100)
+    stop_bar, target_bar = first_crossings(low[1:], high[1:], stop_levels, target_levels)
+    stop_bar, target_bar = stop_bar[:, None] + 1, target_bar[None, :] + 1
+
+    n = len(close)
+    exit_bar = np.minimum(stop_bar, target_bar)
+    kind = np.where(exit_bar >= n, 0, np.where(stop_bar <= target_bar, 1, 2))
+    bar = np.minimum(exit_bar, n - 1)
+    exit_price = np.select(
+        [kind == 1, kind == 2],
+        [np.minimum(open_[bar], stop_levels[:, None]), np.maximum(open_[bar], target_levels[None, :])],
+        default=close[-1]
+    )
+    paid = np.cumsum(dist) - dist[0]
+    return {"kind": kind, "exit_bar": bar, "exit_price": exit_price, "income": paid[bar]}
@@ -0,0 +1,1277 @@
+"""
+Market data storage for the Income Strategy Engine.
+
+Nothing in this module touches Streamlit, so the same stores can be shared by
+app reruns, background threads and worker processes.
+"""
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import datetime
+from types import MappingProxyType
+
+import pandas as pd
+import yfinance as yf
+
+log = logging.getLogger(__name__)
+
+DATA_DIR = os.environ.get(
+    "INCOME_ENGINE_DATA_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+)
+DB_PATH = os.path.join(DATA_DIR, "market_data.db")
+UNIVERSE_PATH = os.environ.get(
+    "ETF_UNIVERSE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "etf_universe.json")
+)
+
+# How far back to go the first time a (ticker, interval) series is fetched
+BACKFILL_PERIODS = {"1d": "max", "1h": "730d", "1m": "7d"}
+
+PERIOD_UNITS = {"d": "days", "wk": "weeks", "mo": "months", "y": "years"}
+
+BAR_COLUMNS = ["Open", "High", "Low", "Close", "Volume"]
+
+
+def period_start(period, now=None):
+    """Convert a yfinance-style period ("5d", "3mo", "1y", "ytd", "max") to a start timestamp"""
+    now = now or pd.Timestamp.now(tz="UTC")
+    if period in (None, "max"):
+        return None
+    if period == "ytd":
+        return pd.Timestamp(year=now.year, month=1, day=1, tz="UTC")
+
+    match = re.fullmatch(r"(\d+)(d|wk|mo|y)", period)
+    if not match:
+        raise ValueError(f"Unsupported period: {period}")
+    amount, unit = int(match.group(1)), match.group(2)
+    return now - pd.DateOffset(**{PERIOD_UNITS[unit]: amount})
+
+
+def _to_epoch_seconds(index):
+    """Epoch seconds for a (possibly tz-naive) DatetimeIndex, treating naive stamps as UTC"""
+    index = pd.DatetimeIndex(index)
+    if index.tz is None:
+        index = index.tz_localize("UTC")
+    return (index.tz_convert("UTC").as_unit("s").asi8).tolist()
+
+
+class SQLiteStore:
+    """Thread-safe wrapper around one SQLite connection shared by a whole process"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sync_state (
+            dataset TEXT NOT NULL,
+            ticker TEXT NOT NULL,
+            interval TEXT NOT NULL,
+            synced_at REAL NOT NULL,
+            PRIMARY KEY (dataset, ticker, interval)
+        );
+    """
+
+    def __init__(self, path=DB_PATH):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SQLiteStore.SCHEMA + self.SCHEMA)
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _write_many(self, sql, rows):
+        with self._lock, self._conn:
+            self._conn.executemany(sql, rows)
+
+    def synced_within(self, dataset, ticker, interval, max_age):
+        """True if the series was synced less than max_age seconds ago"""
+        rows = self._query(
+            "SELECT synced_at FROM sync_state WHERE dataset = ? AND ticker = ? AND interval = ?",
+            (dataset, ticker, interval)
+        )
+        return bool(rows) and time.time() - rows[0][0] < max_age
+
+    def mark_synced(self, dataset, ticker, interval):
+        self._write_many(
+            "INSERT OR REPLACE INTO sync_state (dataset, ticker, interval, synced_at) VALUES (?, ?, ?, ?)",
+            [(dataset, ticker, interval, time.time())]
+        )
+
+
+class PriceHistoryStore(SQLiteStore):
+    """
+    On-disk raw (unadjusted) OHLCV bars keyed by (ticker, interval).
+    Only bars newer than the last stored timestamp are fetched; any period is
+    served by slicing locally.
+    """
+
+    # Bumped when stored bars must be refetched; 1 = raw prices instead of dividend-adjusted
+    BARS_VERSION = 1
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS price_bars (
+            ticker TEXT NOT NULL,
+            interval TEXT NOT NULL,
+            ts INTEGER NOT NULL,
+            open REAL,
+            high REAL,
+            low REAL,
+            close REAL,
+            volume REAL,
+            PRIMARY KEY (ticker, interval, ts)
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(self, fetcher, path=DB_PATH):
+        """fetcher(ticker, interval, start=None, period=None) returns a yfinance-style OHLCV frame"""
+        super().__init__(path)
+        self._fetch = fetcher
+        with self._lock, self._conn:
+            if self._conn.execute("PRAGMA user_version").fetchone()[0] < self.BARS_VERSION:
+                # Bars written before are adjusted - drop them so the next sync backfills raw ones
+                self._conn.execute("DELETE FROM price_bars")
+                self._conn.execute("DELETE FROM sync_state WHERE dataset = 'prices'")
+                self._conn.execute(f"PRAGMA user_version = {self.BARS_VERSION}")
+
+    def last_timestamp(self, ticker, interval="1d"):
+        rows = self._query(
+            "SELECT MAX(ts) FROM price_bars WHERE ticker = ? AND interval = ?",
+            (ticker, interval)
+        )
+        return rows[0][0]
+
+    def append(self, ticker, interval, bars):
+        """Insert or replace bars from a yfinance-style frame; returns the number of rows written"""
+        if bars is None or bars.empty:
+            return 0
+        bars = bars.dropna(subset=["Close"])
+        if bars.empty:
+            return 0
+
+        volume = bars["Volume"] if "Volume" in bars.columns else pd.Series(0.0, index=bars.index)
+        rows = list(zip(
+            [ticker] * len(bars),
+            [interval] * len(bars),
+            _to_epoch_seconds(bars.index),
+            bars["Open"].astype(float).tolist(),
+            bars["High"].astype(float).tolist(),
+            bars["Low"].astype(float).tolist(),
+            bars["Close"].astype(float).tolist(),
+            volume.astype(float).tolist()
+        ))
+        self._write_many(
+            "INSERT OR REPLACE INTO price_bars (ticker, interval, ts, open, high, low, close, volume) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            rows
+        )
+        return len(rows)
+
+    def sync(self, ticker, interval="1d", max_age=3600):
+        """Fetch only the bars missing since the last stored one; returns the number of rows written"""
+        if max_age and self.synced_within("prices", ticker, interval, max_age):
+            return 0
+
+        last_ts = self.last_timestamp(ticker, interval)
+        if last_ts is None:
+            bars = self._fetch(ticker, interval, period=BACKFILL_PERIODS.get(interval, "1y"))
+        else:
+            # Refetch the last stored bar as well - it may have been partial when it was written
+            bars = self._fetch(ticker, interval, start=pd.Timestamp(last_ts, unit="s", tz="UTC"))
+
+        written = self.append(ticker, interval, bars)
+        self.mark_synced("prices", ticker, interval)
+        return written
+
+    def _session_start(self, ticker, interval, sessions):
+        """Epoch second at which the last `sessions` stored trading days begin"""
+        rows = self._query(
+            "SELECT DISTINCT ts / 86400 AS day FROM price_bars WHERE ticker = ? AND interval = ? "
+            "ORDER BY day DESC LIMIT 1 OFFSET ?",
+            (ticker, interval, sessions - 1)
+        )
+        return rows[0][0] * 86400 if rows else 0
+
+    def load(self, ticker, interval="1d", period=None, start=None):
+        """
+        Read stored bars as a yfinance-style frame with a UTC DatetimeIndex.
+        Day periods count trading sessions ("5d" = last 5 sessions), as in yfinance.
+        """
+        match = re.fullmatch(r"(\d+)d", period or "")
+        if match:
+            start_ts = self._session_start(ticker, interval, int(match.group(1)))
+        else:
+            start = start if start is not None else period_start(period)
+            start_ts = int(pd.Timestamp(start).timestamp()) if start is not None else 0
+
+        rows = self._query(
+            "SELECT ts, open, high, low, close, volume FROM price_bars "
+            "WHERE ticker = ? AND interval = ? AND ts >= ? ORDER BY ts",
+            (ticker, interval, start_ts)
+        )
+
+        frame = pd.DataFrame(rows, columns=["ts"] + BAR_COLUMNS)
+        frame.index = pd.to_datetime(frame.pop("ts"), unit="s", utc=True)
+        frame.index.name = "Date"
+        return frame
+
+
+class DividendStore(SQLiteStore):
+    """
+    On-disk distribution history, one row per (ticker, ex-date).
+    Yahoo only publishes ex-dates, so pay_date stays NULL unless a provider supplies it.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS dividends (
+            ticker TEXT NOT NULL,
+            ex_date INTEGER NOT NULL,
+            pay_date INTEGER,
+            amount REAL NOT NULL,
+            PRIMARY KEY (ticker, ex_date)
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(self, fetcher, path=DB_PATH):
+        """fetcher(ticker) returns a yfinance-style Series of amounts indexed by ex-date"""
+        super().__init__(path)
+        self._fetch = fetcher
+
+    def last_ex_date(self, ticker):
+        rows = self._query("SELECT MAX(ex_date) FROM dividends WHERE ticker = ?", (ticker,))
+        return rows[0][0]
+
+    def append(self, ticker, series, since=None):
+        """Insert or replace distributions on or after `since` (epoch seconds); returns rows written"""
+        if series is None or series.empty:
+            return 0
+        series = series.dropna()
+        ex_dates = _to_epoch_seconds(series.index)
+        rows = [
+            (ticker, ex_date, None, float(amount))
+            for ex_date, amount in zip(ex_dates, series.tolist())
+            if since is None or ex_date >= since
+        ]
+        self._write_many(
+            "INSERT OR REPLACE INTO dividends (ticker, ex_date, pay_date, amount) VALUES (?, ?, ?, ?)",
+            rows
+        )
+        return len(rows)
+
+    def sync(self, ticker, max_age=21600):
+        """Store distributions newer than the last stored ex-date; returns rows written"""
+        if max_age and self.synced_within("dividends", ticker, "", max_age):
+            return 0
+        written = self.append(ticker, self._fetch(ticker), since=self.last_ex_date(ticker))
+        self.mark_synced("dividends", ticker, "")
+        return written
+
+    def load(self, ticker, start=None):
+        """Distributions as a frame (ex_date, pay_date, amount) in ex-date order"""
+        start_ts = int(pd.Timestamp(start).timestamp()) if start is not None else 0
+        rows = self._query(
+            "SELECT ex_date, pay_date, amount FROM dividends WHERE ticker = ? AND ex_date >= ? ORDER BY ex_date",
+            (ticker, start_ts)
+        )
+        return self._frame(rows)
+
+    def recent(self, tickers, count):
+        """{ticker: frame of its last `count` distributions} read in a single query"""
+        tickers = list(tickers)
+        if not tickers:
+            return {}
+        rows = self._query(
+            "SELECT ticker, ex_date, pay_date, amount FROM ("
+            "  SELECT *, ROW_NUMBER() OVER (PARTITION BY ticker ORDER BY ex_date DESC) AS n FROM dividends"
+            f"  WHERE ticker IN ({','.join('?' * len(tickers))})"
+            ") WHERE n <= ? ORDER BY ticker, ex_date",
+            (*tickers, count)
+        )
+        grouped = {ticker: [] for ticker in tickers}
+        for ticker, *row in rows:
+            grouped[ticker].append(row)
+        return {ticker: self._frame(grouped[ticker]) for ticker in tickers}
+
+    @staticmethod
+    def _frame(rows):
+        frame = pd.DataFrame(rows, columns=["ex_date", "pay_date", "amount"])
+        frame["ex_date"] = pd.to_datetime(frame["ex_date"], unit="s", utc=True)
+        frame["pay_date"] = pd.to_datetime(frame["pay_date"], unit="s", utc=True)
+        return frame
+
+
+class ArticleStore(SQLiteStore):
+    """
+    On-disk headlines, deduplicated by article id, and per-ticker news sentiment.
+
+    An article is folded into a ticker's sentiment once, when it is first linked
+    to that ticker. A ticker's score is the exponentially time-decayed average of
+    weight * sentiment over every article linked to it; the running numerator and
+    denominator are kept as of the last update, so a refresh costs only its new
+    articles and old headlines fade instead of dropping out all at once.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS articles (
+            id TEXT PRIMARY KEY,
+            title TEXT NOT NULL,
+            publisher TEXT,
+            link TEXT,
+            published INTEGER NOT NULL,
+            sentiment REAL NOT NULL
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS article_tickers (
+            ticker TEXT NOT NULL,
+            article_id TEXT NOT NULL,
+            symbol TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            weight REAL NOT NULL,
+            PRIMARY KEY (ticker, article_id)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS article_tickers_article ON article_tickers (article_id);
+        CREATE INDEX IF NOT EXISTS articles_published ON articles (published);
+        CREATE VIRTUAL TABLE IF NOT EXISTS articles_fts USING fts5 (
+            title, publisher, article_id UNINDEXED
+        );
+        CREATE TABLE IF NOT EXISTS news_sentiment (
+            ticker TEXT PRIMARY KEY,
+            weighted_sum REAL NOT NULL,
+            decayed_count REAL NOT NULL,
+            as_of REAL NOT NULL
+        );
+    """
+
+    # Bound on ids per IN (...) clause
+    CHUNK = 500
+
+    def __init__(self, path=DB_PATH, half_life=3 * 86400):
+        super().__init__(path)
+        self.half_life = half_life
+        with self._lock, self._conn:
+            # Stores created before the full-text index existed
+            if not self._conn.execute("SELECT 1 FROM articles_fts LIMIT 1").fetchone():
+                self._conn.execute(
+                    "INSERT INTO articles_fts (title, publisher, article_id) SELECT title, publisher, id FROM articles"
+                )
+
+    def known(self, article_ids):
+        """{(ticker, article_id)} links that already exist for any of `article_ids`"""
+        article_ids = list(set(article_ids))
+        links = set()
+        for i in range(0, len(article_ids), self.CHUNK):
+            chunk = article_ids[i:i + self.CHUNK]
+            rows = self._query(
+                f"SELECT ticker, article_id FROM article_tickers WHERE article_id IN ({','.join('?' * len(chunk))})",
+                chunk
+            )
+            links.update(rows)
+        return links
+
+    def ingest(self, links, now=None):
+        """
+        Store new (ticker, symbol, kind, weight, article) links, where article has
+        id, title, publisher, link, published and sentiment, and fold each into
+        its ticker's decayed sentiment. Links already stored are skipped.
+        Returns the number of links added.
+        """
+        now = now or time.time()
+        inserted_links = 0
+        with self._lock, self._conn:
+            added = {}
+            for ticker, symbol, kind, weight, article in links:
+                inserted = self._conn.execute(
+                    "INSERT OR IGNORE INTO article_tickers (ticker, article_id, symbol, kind, weight) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (ticker, article["id"], symbol, kind, weight)
+                ).rowcount
+                if not inserted:
+                    continue
+                inserted_links += 1
+                new_article = self._conn.execute(
+                    "INSERT OR IGNORE INTO articles (id, title, publisher, link, published, sentiment) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (article["id"], article["title"], article.get("publisher"), article.get("link"),
+                     int(article.get("published") or now), float(article["sentiment"]))
+                ).rowcount
+                if new_article:
+                    self._conn.execute(
+                        "INSERT INTO articles_fts (title, publisher, article_id) VALUES (?, ?, ?)",
+                        (article["title"], article.get("publisher"), article["id"])
+                    )
+                age = max(now - (article.get("published") or now), 0)
+                decay = 0.5 ** (age / self.half_life)
+                total = added.setdefault(ticker, [0.0, 0.0])
+                total[0] += decay * weight * article["sentiment"]
+                total[1] += decay
+
+            for ticker, (weighted_sum, decayed_count) in added.items():
+                row = self._conn.execute(
+                    "SELECT weighted_sum, decayed_count, as_of FROM news_sentiment WHERE ticker = ?", (ticker,)
+                ).fetchone()
+                if row:
+                    decay = 0.5 ** (max(now - row[2], 0) / self.half_life)
+                    weighted_sum += row[0] * decay
+                    decayed_count += row[1] * decay
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO news_sentiment (ticker, weighted_sum, decayed_count, as_of) "
+                    "VALUES (?, ?, ?, ?)",
+                    (ticker, weighted_sum, decayed_count, now)
+                )
+        return inserted_links
+
+    def sentiment(self, tickers, now=None):
+        """
+        {ticker: (score, articles)} - the decayed average sentiment and the decayed
+        article count behind it, as of `now`
+        """
+        now = now or time.time()
+        tickers = list(tickers)
+        scores = {ticker: (0.0, 0.0) for ticker in tickers}
+        for i in range(0, len(tickers), self.CHUNK):
+            chunk = tickers[i:i + self.CHUNK]
+            rows = self._query(
+                "SELECT ticker, weighted_sum, decayed_count, as_of FROM news_sentiment "
+                f"WHERE ticker IN ({','.join('?' * len(chunk))})",
+                chunk
+            )
+            for ticker, weighted_sum, decayed_count, as_of in rows:
+                if decayed_count > 0:
+                    decay = 0.5 ** (max(now - as_of, 0) / self.half_life)
+                    scores[ticker] = (weighted_sum / decayed_count, decayed_count * decay)
+        return scores
+
+    def recent(self, tickers, count):
+        """{ticker: list of its `count` newest articles (dicts with symbol, kind and sentiment)}"""
+        tickers = list(tickers)
+        grouped = {ticker: [] for ticker in tickers}
+        for i in range(0, len(tickers), self.CHUNK):
+            chunk = tickers[i:i + self.CHUNK]
+            rows = self._query(
+                "SELECT ticker, id, title, publisher, link, published, sentiment, symbol, kind FROM ("
+                "  SELECT t.ticker, a.*, t.symbol, t.kind,"
+                "         ROW_NUMBER() OVER (PARTITION BY t.ticker ORDER BY a.published DESC) AS n"
+                "  FROM article_tickers t JOIN articles a ON a.id = t.article_id"
+                f"  WHERE t.ticker IN ({','.join('?' * len(chunk))})"
+                ") WHERE n <= ? ORDER BY ticker, published DESC",
+                (*chunk, count)
+            )
+            for ticker, *row in rows:
+                grouped[ticker].append(dict(zip(
+                    ["id", "title", "publisher", "link", "published", "sentiment", "symbol", "kind"], row
+                )))
+        return grouped
+
+    def publishers(self):
+        """Every publisher seen, alphabetically"""
+        rows = self._query("SELECT DISTINCT publisher FROM articles WHERE publisher IS NOT NULL ORDER BY publisher")
+        return [row[0] for row in rows]
+
+    @staticmethod
+    def _match_query(text):
+        """FTS5 query matching every word of `text` as a prefix, with FTS syntax neutralized"""
+        words = re.findall(r"\w+", text or "")
+        return " ".join(f'"{word}"*' for word in words)
+
+    def _search_filter(self, text=None, ticker=None, publisher=None, sentiment=None, start=None, end=None):
+        clauses, params = [], []
+        match = self._match_query(text)
+        if match:
+            clauses.append("a.id IN (SELECT article_id FROM articles_fts WHERE articles_fts MATCH ?)")
+            params.append(match)
+        if ticker:
+            clauses.append("EXISTS (SELECT 1 FROM article_tickers t"
+                           " WHERE t.article_id = a.id AND (t.ticker = ? OR t.symbol = ?))")
+            params += [ticker, ticker]
+        if publisher:
+            clauses.append("a.publisher = ?")
+            params.append(publisher)
+        if sentiment is not None:
+            clauses.append("a.sentiment BETWEEN ? AND ?")
+            params += list(sentiment)
+        if start is not None:
+            clauses.append("a.published >= ?")
+            params.append(int(start))
+        if end is not None:
+            clauses.append("a.published < ?")
+            params.append(int(end))
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def search_count(self, **filters):
+        """Number of articles matching search() filters"""
+        where, params = self._search_filter(**filters)
+        return self._query(f"SELECT COUNT(*) FROM articles a{where}", params)[0][0]
+
+    def search(self, limit=20, offset=0, **filters):
+        """
+        Newest-first page of stored articles. Filters: text (every word, as a prefix,
+        in the title or publisher), ticker (an ETF or a symbol it was found through),
+        publisher, sentiment (inclusive (low, high)) and start / end (epoch seconds).
+        Each result lists the ETFs the article is linked to.
+        """
+        where, params = self._search_filter(**filters)
+        rows = self._query(
+            "SELECT a.id, a.title, a.publisher, a.link, a.published, a.sentiment,"
+            "       (SELECT group_concat(ticker, ',') FROM article_tickers WHERE article_id = a.id)"
+            f" FROM articles a{where} ORDER BY a.published DESC, a.id LIMIT ? OFFSET ?",
+            (*params, limit, offset)
+        )
+        columns = ["id", "title", "publisher", "link", "published", "sentiment", "tickers"]
+        return [dict(zip(columns, row), tickers=(row[-1] or "").split(",")) for row in rows]
+
+
+class MarketDataRefresher:
+    """
+    Background thread that keeps shared market data current for a whole server process.
+    Each job's latest result is published into an immutable snapshot, so readers
+    never wait on network I/O.
+    """
+
+    def __init__(self, jobs, tick=1.0):
+        """jobs maps a snapshot key to (interval_seconds, fn); fn's return value is published under that key"""
+        self._jobs = dict(jobs)
+        self._tick = tick
+        self._last_run = {}
+        self._snapshot = MappingProxyType({"updated_at": MappingProxyType({})})
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="market-data-refresher", daemon=True)
+        self._started_at = None
+
+    def start(self):
+        self._started_at = time.monotonic()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def snapshot(self):
+        """Latest published snapshot (read-only mapping)"""
+        return self._snapshot
+
+    def wait_ready(self, timeout=None):
+        """Block until every job has run once; returns False on timeout"""
+        return self._ready.wait(timeout)
+
+    def wait_warmup(self, budget):
+        """
+        Like wait_ready, but `budget` counts from start(): once a slow first pass
+        has used it up, later callers no longer wait at all.
+        """
+        return self._ready.wait(max(0.0, self._started_at + budget - time.monotonic()))
+
+    def refresh_now(self, *keys):
+        """Make the given jobs (or all of them) due on the next tick"""
+        for key in keys or self._jobs:
+            self._last_run.pop(key, None)
+
+    def _publish(self, key, value):
+        # Swap in a new mapping instead of mutating, so readers always see a consistent snapshot
+        snapshot = dict(self._snapshot)
+        snapshot[key] = value
+        snapshot["updated_at"] = MappingProxyType(dict(self._snapshot["updated_at"], **{key: datetime.now()}))
+        self._snapshot = MappingProxyType(snapshot)
+
+    def _run(self):
+        while not self._stop.is_set():
+            for key, (interval, fn) in self._jobs.items():
+                last_run = self._last_run.get(key)
+                if last_run is not None and time.monotonic() - last_run < interval:
+                    continue
+                self._last_run[key] = time.monotonic()
+                try:
+                    self._publish(key, fn())
+                except Exception:
+                    log.exception("Background refresh of %s failed", key)
+            self._ready.set()
+            self._stop.wait(self._tick)
+
+
+class TTLCache:
+    """Small thread-safe cache whose entries expire after a fixed number of seconds"""
+
+    _MISSING = object()
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key, self._MISSING)
+        if entry is self._MISSING or time.monotonic() - entry[0] > self.ttl:
+            return default
+        return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+
+
+class SWRCache:
+    """
+    Stale-while-revalidate cache. Entries older than `ttl` are still served
+    immediately (flagged stale) while a single background load replaces them;
+    only keys that were never loaded block the caller.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def put_many(self, values, fetched_at=None):
+        fetched_at = fetched_at or time.time()
+        with self._lock:
+            for key, value in values.items():
+                self._entries[key] = (value, fetched_at)
+
+    def get_many(self, keys, loader):
+        """
+        {key: (value, fetched_at, stale)} for every key that could be loaded.
+        loader(list_of_keys) must return {key: value}.
+        """
+        with self._lock:
+            entries = {key: self._entries.get(key) for key in keys}
+
+        missing = [key for key, entry in entries.items() if entry is None]
+        if missing:
+            self.put_many(loader(missing))
+            with self._lock:
+                entries.update({key: self._entries.get(key) for key in missing})
+
+        now = time.time()
+        expired = [key for key, entry in entries.items() if entry is not None and now - entry[1] > self.ttl]
+        if expired:
+            self._revalidate(expired, loader)
+
+        return {
+            key: (entry[0], entry[1], now - entry[1] > self.ttl)
+            for key, entry in entries.items() if entry is not None
+        }
+
+    def _revalidate(self, keys, loader):
+        with self._lock:
+            keys = [key for key in keys if key not in self._refreshing]
+            self._refreshing.update(keys)
+        if not keys:
+            return
+
+        def refresh():
+            try:
+                self.put_many(loader(keys))
+            except Exception:
+                log.warning("Background revalidation of %s failed", keys, exc_info=True)
+            finally:
+                with self._lock:
+                    self._refreshing.difference_update(keys)
+
+        io_pool().submit(refresh)
+
+
+_IO_POOL = None
+_IO_POOL_LOCK = threading.Lock()
+IO_POOL_WORKERS = 8
+
+
+def io_pool():
+    """Bounded thread pool shared by all network fan-outs in this process"""
+    global _IO_POOL
+    with _IO_POOL_LOCK:
+        if _IO_POOL is None:
+            _IO_POOL = ThreadPoolExecutor(max_workers=IO_POOL_WORKERS, thread_name_prefix="market-data-io")
+        return _IO_POOL
+
+
+def fetch_concurrently(keys, fetch, cache=None, timeout=10.0):
+    """
+    Fetch each distinct key once through the shared I/O pool.
+    Returns {key: result} for keys that are cached or finished within `timeout`;
+    failures and stragglers are left out (stragglers still fill the cache when they land).
+    """
+    results = {}
+    pending = {}
+    for key in dict.fromkeys(keys):
+        cached = cache.get(key) if cache is not None else None
+        if cached is not None:
+            results[key] = cached
+            continue
+        future = io_pool().submit(fetch, key)
+        if cache is not None:
+            future.add_done_callback(lambda f, key=key: f.exception() is None and cache.put(key, f.result()))
+        pending[future] = key
+
+    done, _ = wait(pending, timeout=timeout)
+    for future in done:
+        try:
+            results[pending[future]] = future.result()
+        except Exception:
+            log.warning("Fetching %s failed", pending[future], exc_info=True)
+    return results
+
+
+class MarketDataProvider:
+    """
+    Interface every market data backend implements.
+    Methods raise on transport errors; callers decide how to degrade.
+    """
+
+    name = "base"
+
+    def download(self, tickers, period="1d", interval="1m"):
+        """Close prices for many tickers in one request: a frame with one column per ticker"""
+        raise NotImplementedError
+
+    def history(self, ticker, interval="1d", period=None, start=None):
+        """OHLCV bars for one ticker (yfinance column names)"""
+        raise NotImplementedError
+
+    def last_price(self, ticker):
+        """Last trade price from a lightweight quote endpoint, or None"""
+        raise NotImplementedError
+
+    def dividends(self, ticker):
+        """Distribution amounts indexed by ex-date"""
+        raise NotImplementedError
+
+    def news(self, ticker):
+        """Raw news items as returned by Yahoo Finance"""
+        raise NotImplementedError
+
+    def info(self, ticker):
+        """Fund/company profile dict"""
+        raise NotImplementedError
+
+
+class YFinanceProvider(MarketDataProvider):
+    """Live data from Yahoo Finance via yfinance"""
+
+    name = "yfinance"
+
+    def download(self, tickers, period="1d", interval="1m"):
+        tickers = list(tickers)
+        data = yf.download(tickers, period=period, interval=interval,
+                           group_by="column", progress=False, threads=True)
+        if data.empty:
+            return pd.DataFrame()
+        closes = data["Close"]
+        if isinstance(closes, pd.Series):
+            closes = closes.to_frame(name=tickers[0])
+        return closes
+
+    def history(self, ticker, interval="1d", period=None, start=None):
+        # Raw OHLC: adjusted series are rescaled on every ex-date, which would leave the
+        # append-only store mixing adjustments. Distributions live in DividendStore.
+        return yf.Ticker(ticker).history(period=period, interval=interval, start=start, auto_adjust=False)
+
+    def last_price(self, ticker):
+        stock = yf.Ticker(ticker)
+        if hasattr(stock, "fast_info"):
+            return stock.fast_info.get("last_price")
+        return None
+
+    def dividends(self, ticker):
+        return yf.Ticker(ticker).dividends
+
+    def news(self, ticker):
+        return yf.Ticker(ticker).news or []
+
+    def info(self, ticker):
+        return yf.Ticker(ticker).info
+
+
+class ReplayProvider(MarketDataProvider):
+    """
+    Serves previously recorded data from local files at a configurable latency,
+    for offline benchmarks and reproducible load tests.
+
+    Layout under `root` (see record_replay):
+        prices/<TICKER>_<interval>.csv   OHLCV bars, UTC timestamps
+        dividends/<TICKER>.csv           ex-date, amount
+        news/<TICKER>.json               raw news items
+        info/<TICKER>.json               profile dict
+    Periods are measured back from the last recorded bar, so results do not
+    drift as wall-clock time moves on.
+    """
+
+    name = "replay"
+
+    def __init__(self, root, latency=0.0):
+        self.root = root
+        self.latency = latency
+        self._frames = {}
+        self._lock = threading.Lock()
+
+    def _wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _path(self, kind, name):
+        return os.path.join(self.root, kind, name)
+
+    def _bars(self, ticker, interval):
+        key = (ticker, interval)
+        with self._lock:
+            if key not in self._frames:
+                path = self._path("prices", f"{ticker}_{interval}.csv")
+                if os.path.exists(path):
+                    frame = pd.read_csv(path, index_col=0)
+                    frame.index = pd.to_datetime(frame.index, utc=True)
+                else:
+                    frame = pd.DataFrame(columns=BAR_COLUMNS, index=pd.DatetimeIndex([], tz="UTC"))
+                self._frames[key] = frame
+            return self._frames[key]
+
+    def _json(self, kind, ticker, default):
+        path = self._path(kind, f"{ticker}.json")
+        if not os.path.exists(path):
+            return default
+        with open(path) as f:
+            return json.load(f)
+
+    def download(self, tickers, period="1d", interval="1m"):
+        self._wait()
+        closes = {t: self._slice(self._bars(t, interval), period, None)["Close"] for t in tickers}
+        closes = {t: c for t, c in closes.items() if not c.empty}
+        return pd.DataFrame(closes) if closes else pd.DataFrame()
+
+    def history(self, ticker, interval="1d", period=None, start=None):
+        self._wait()
+        return self._slice(self._bars(ticker, interval), period, start)
+
+    def _slice(self, bars, period, start):
+        if bars.empty:
+            return bars
+        if start is not None:
+            start = pd.Timestamp(start)
+            return bars[bars.index >= (start.tz_localize("UTC") if start.tzinfo is None else start)]
+
+        match = re.fullmatch(r"(\d+)d", period or "")
+        if match:
+            days = bars.index.normalize().unique()[-int(match.group(1)):]
+            return bars[bars.index >= days[0]]
+        start = period_start(period, now=bars.index[-1])
+        return bars if start is None else bars[bars.index >= start]
+
+    def last_price(self, ticker):
+        self._wait()
+        bars = self._bars(ticker, "1d")
+        return None if bars.empty else float(bars["Close"].iloc[-1])
+
+    def dividends(self, ticker):
+        self._wait()
+        path = self._path("dividends", f"{ticker}.csv")
+        if not os.path.exists(path):
+            return pd.Series(dtype=float, name="Dividends")
+        series = pd.read_csv(path, index_col=0).iloc[:, 0]
+        series.index = pd.to_datetime(series.index, utc=True)
+        return series.rename("Dividends")
+
+    def news(self, ticker):
+        self._wait()
+        return self._json("news", ticker, [])
+
+    def info(self, ticker):
+        self._wait()
+        return self._json("info", ticker, {})
+
+
+class GatewayUnavailable(Exception):
+    """A call was rejected or failed and there is no last-known-good value to serve instead"""
+
+
+class TokenBucket:
+    """Token-bucket rate limiter: `rate` calls per second with bursts of up to `burst`"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout):
+        """Take one token, waiting at most `timeout` seconds; returns False if none became available"""
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait_for = (1 - self._tokens) / self.rate
+            if now + wait_for > deadline:
+                return False
+            time.sleep(wait_for)
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects calls for
+    `reset_timeout` seconds, then lets a single trial call through (half-open).
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=60):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = "half-open"
+                return True
+            return self.state == "closed"
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self.state = "closed"
+
+    def abandon_trial(self):
+        """The half-open trial call never ran (e.g. throttled): reopen for another reset_timeout"""
+        with self._lock:
+            if self.state == "half-open":
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+    def record_failure(self):
+        """Returns True if this failure tripped the breaker open"""
+        with self._lock:
+            self._failures += 1
+            if self.state == "half-open" or self._failures >= self.failure_threshold:
+                tripped = self.state != "open"
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                return tripped
+            return False
+
+
+class FetchGateway:
+    """
+    Shared front door for upstream market data calls:
+    - single-flight: concurrent identical requests share one in-flight call
+    - token-bucket rate limiting across all endpoints
+    - a circuit breaker per endpoint that fails fast while the endpoint is down
+    - every call bounded by a timeout
+    - last-known-good values served when a call is throttled, rejected or fails
+    """
+
+    COUNTERS = ("requests", "hits", "coalesced", "throttled", "breaker_trips", "failures", "stale_served")
+
+    def __init__(self, rate=4.0, burst=12, call_timeout=15.0, throttle_wait=5.0,
+                 failure_threshold=5, reset_timeout=60, max_last_good=2048):
+        self.call_timeout = call_timeout
+        self.throttle_wait = throttle_wait
+        self._bucket = TokenBucket(rate, burst)
+        self._breaker_args = (failure_threshold, reset_timeout)
+        self._breakers = {}
+        self._inflight = {}
+        self._last_good = OrderedDict()
+        self._max_last_good = max_last_good
+        self._counters = dict.fromkeys(self.COUNTERS, 0)
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="fetch-gateway")
+
+    def _count(self, counter):
+        with self._lock:
+            self._counters[counter] += 1
+
+    def stats(self):
+        """Counter snapshot plus the state of every endpoint's breaker"""
+        with self._lock:
+            stats = dict(self._counters)
+            stats["breakers"] = {endpoint: b.state for endpoint, b in self._breakers.items()}
+        return stats
+
+    def _breaker(self, endpoint):
+        with self._lock:
+            if endpoint not in self._breakers:
+                self._breakers[endpoint] = CircuitBreaker(*self._breaker_args)
+            return self._breakers[endpoint]
+
+    def call(self, endpoint, key, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) through the gateway; `key` identifies identical requests"""
+        flight_key = (endpoint, key)
+        with self._lock:
+            self._counters["requests"] += 1
+            future = self._inflight.get(flight_key)
+            leader = future is None
+            if leader:
+                future = self._inflight[flight_key] = Future()
+            else:
+                self._counters["coalesced"] += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = self._execute(endpoint, flight_key, fn, args, kwargs)
+            future.set_result(result)
+            return result
+        except Exception as exc:
+            future.set_exception(exc)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(flight_key, None)
+
+    def _execute(self, endpoint, flight_key, fn, args, kwargs):
+        breaker = self._breaker(endpoint)
+        if not breaker.allow():
+            return self._fallback(flight_key, f"{endpoint} circuit open")
+        if not self._bucket.acquire(self.throttle_wait):
+            breaker.abandon_trial()
+            self._count("throttled")
+            return self._fallback(flight_key, f"{endpoint} rate limited")
+
+        try:
+            result = self._pool.submit(fn, *args, **kwargs).result(timeout=self.call_timeout)
+        except Exception as exc:
+            self._count("failures")
+            if breaker.record_failure():
+                self._count("breaker_trips")
+                log.warning("Circuit breaker for %s opened after: %r", endpoint, exc)
+            return self._fallback(flight_key, f"{endpoint} failed: {exc!r}")
+
+        breaker.record_success()
+        self._count("hits")
+        with self._lock:
+            self._last_good[flight_key] = result
+            self._last_good.move_to_end(flight_key)
+            if len(self._last_good) > self._max_last_good:
+                self._last_good.popitem(last=False)
+        return result
+
+    def _fallback(self, flight_key, reason):
+        with self._lock:
+            if flight_key in self._last_good:
+                self._counters["stale_served"] += 1
+                return self._last_good[flight_key]
+        raise GatewayUnavailable(reason)
+
+
+class GatewayProvider(MarketDataProvider):
+    """Wraps another provider so every call goes through a FetchGateway"""
+
+    def __init__(self, provider, gateway):
+        self.provider = provider
+        self.gateway = gateway
+        self.name = provider.name
+
+    def download(self, tickers, period="1d", interval="1m"):
+        tickers = tuple(tickers)
+        return self.gateway.call("download", (tickers, period, interval),
+                                 self.provider.download, tickers, period, interval)
+
+    def history(self, ticker, interval="1d", period=None, start=None):
+        return self.gateway.call("history", (ticker, interval, period, str(start)),
+                                 self.provider.history, ticker, interval, period=period, start=start)
+
+    def last_price(self, ticker):
+        return self.gateway.call("quote", ticker, self.provider.last_price, ticker)
+
+    def dividends(self, ticker):
+        return self.gateway.call("dividends", ticker, self.provider.dividends, ticker)
+
+    def news(self, ticker):
+        return self.gateway.call("news", ticker, self.provider.news, ticker)
+
+    def info(self, ticker):
+        return self.gateway.call("info", ticker, self.provider.info, ticker)
+
+
+class QuoteLadder:
+    """
+    Single-symbol last price. The lightweight quote endpoint gets a short head
+    start; if it has not produced a valid price by then, the bar-based
+    fallbacks are raced alongside it and the first valid answer wins.
+    Per-source wins and latencies are kept so the ladder can be tuned.
+    """
+
+    def __init__(self, provider, head_start=0.3, deadline=5.0, latency_window=200):
+        self.provider = provider
+        self.head_start = head_start
+        self.deadline = deadline
+        self.steps = (
+            ("quote", lambda t: provider.last_price(t)),
+            ("intraday", lambda t: self._last_close(provider.history(t, "1m", period="1d"))),
+            ("daily", lambda t: self._last_close(provider.history(t, "1d", period="5d"))),
+        )
+        self._latencies = {source: deque(maxlen=latency_window) for source, _ in self.steps}
+        self._counters = {source: {"attempts": 0, "wins": 0, "failures": 0} for source, _ in self.steps}
+        self._deadline_misses = 0
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=12, thread_name_prefix="quote-ladder")
+
+    @staticmethod
+    def _last_close(bars):
+        return None if bars is None or bars.empty else float(bars["Close"].iloc[-1])
+
+    def _attempt(self, source, fn, ticker):
+        started = time.monotonic()
+        try:
+            price = fn(ticker)
+            valid = price is not None and price == price and price > 0
+        except Exception:
+            price, valid = None, False
+        with self._lock:
+            self._counters[source]["attempts"] += 1
+            if valid:
+                self._latencies[source].append(time.monotonic() - started)
+            else:
+                self._counters[source]["failures"] += 1
+        return float(price) if valid else None
+
+    def fetch(self, ticker):
+        """(price, source) from the first step to answer, or (None, None) by the deadline"""
+        started = time.monotonic()
+        source, fn = self.steps[0]
+        pending = {self._pool.submit(self._attempt, source, fn, ticker): source}
+        raced = False
+
+        while pending:
+            remaining = self.deadline - (time.monotonic() - started)
+            if remaining <= 0:
+                break
+            timeout = remaining if raced else min(remaining, self.head_start)
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                source = pending.pop(future)
+                price = future.result()
+                if price is not None:
+                    with self._lock:
+                        self._counters[source]["wins"] += 1
+                    return round(price, 2), source
+            if not raced:
+                raced = True
+                for source, fn in self.steps[1:]:
+                    pending[self._pool.submit(self._attempt, source, fn, ticker)] = source
+
+        if pending:
+            with self._lock:
+                self._deadline_misses += 1
+        return None, None
+
+    def stats(self):
+        """{"sources": {source: {"attempts", "wins", "failures", "p50_ms", "p95_ms"}}, "deadline_misses"}"""
+        with self._lock:
+            sources = {source: dict(counters) for source, counters in self._counters.items()}
+            latencies = {source: sorted(values) for source, values in self._latencies.items()}
+            deadline_misses = self._deadline_misses
+        for source, values in latencies.items():
+            sources[source]["p50_ms"] = round(values[len(values) // 2] * 1000) if values else None
+            sources[source]["p95_ms"] = round(values[int(len(values) * 0.95)] * 1000) if values else None
+        return {"sources": sources, "deadline_misses": deadline_misses}
+
+
+def record_replay(provider, root, tickers, news_symbols=(), intervals=("1d", "1m")):
+    """Record everything the app reads for `tickers` from `provider` into a ReplayProvider directory"""
+    for kind in ("prices", "dividends", "news", "info"):
+        os.makedirs(os.path.join(root, kind), exist_ok=True)
+
+    for ticker in tickers:
+        for interval in intervals:
+            bars = provider.history(ticker, interval, period=BACKFILL_PERIODS.get(interval, "1y"))
+            if not bars.empty:
+                bars = bars[[c for c in BAR_COLUMNS if c in bars.columns]]
+                bars.index = pd.DatetimeIndex(bars.index).tz_convert("UTC")
+                bars.to_csv(os.path.join(root, "prices", f"{ticker}_{interval}.csv"))
+
+        dividends = provider.dividends(ticker)
+        if dividends is not None and not dividends.empty:
+            dividends.index = pd.DatetimeIndex(dividends.index).tz_convert("UTC")
+            dividends.rename("Dividends").to_csv(os.path.join(root, "dividends", f"{ticker}.csv"))
+
+        with open(os.path.join(root, "info", f"{ticker}.json"), "w") as f:
+            json.dump(provider.info(ticker), f, default=str)
+
+    for symbol in dict.fromkeys(list(tickers) + list(news_symbols)):
+        with open(os.path.join(root, "news", f"{symbol}.json"), "w") as f:
+            json.dump(provider.news(symbol), f, default=str)
+
+
+class EtfUniverse:
+    """
+    Tracked funds and their metadata, loaded from a JSON file.
+    Lookup indexes: by ticker (info), by risk level, by underlying index and by top holding.
+    An optional "position" per fund (shares, div, cost_basis) seeds new sessions.
+    """
+
+    FIELDS = ("name", "underlying_index", "top_holdings", "strategy", "risk_level")
+
+    def __init__(self, funds, index_proxies=None):
+        self.tickers = []
+        self.info = {}
+        self.by_risk = {}
+        self.by_index = {}
+        self.by_holding = {}
+        self.positions = {}
+        self.index_proxies = dict(index_proxies or {})
+        for fund in funds:
+            ticker = fund["ticker"].upper()
+            if ticker in self.info:
+                raise ValueError(f"Duplicate ticker in ETF universe: {ticker}")
+            self.tickers.append(ticker)
+            self.info[ticker] = {field: fund.get(field) for field in self.FIELDS}
+            self.info[ticker]["top_holdings"] = list(fund.get("top_holdings") or [])
+            if fund.get("position"):
+                self.positions[ticker] = dict(fund["position"])
+            self.by_risk.setdefault(fund.get("risk_level"), []).append(ticker)
+            self.by_index.setdefault(fund.get("underlying_index"), []).append(ticker)
+            for stock in self.info[ticker]["top_holdings"]:
+                self.by_holding.setdefault(stock, []).append(ticker)
+
+    @classmethod
+    def load(cls, path=UNIVERSE_PATH):
+        with open(path) as f:
+            data = json.load(f)
+        return cls(data["funds"], data.get("index_proxies"))
+
+
+def provider_from_env():
+    """
+    Pick the market data backend from the environment:
+    MARKET_DATA_PROVIDER=replay with MARKET_DATA_REPLAY_DIR (and optional
+    MARKET_DATA_REPLAY_LATENCY in seconds) serves recorded files; anything
+    else uses live yfinance.
+    """
+    if os.environ.get("MARKET_DATA_PROVIDER", "yfinance") == "replay":
+        return ReplayProvider(
+            os.environ.get("MARKET_DATA_REPLAY_DIR", os.path.join(DATA_DIR, "replay")),
+            latency=float(os.environ.get("MARKET_DATA_REPLAY_LATENCY", "0"))
+        )
+    return YFinanceProvider()
+
+
+def store_path(provider):
+    """Keep replayed data out of the live database"""
+    return DB_PATH if provider.name == "yfinance" else os.path.join(DATA_DIR, f"market_data_{provider.name}.db")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Record live market data for offline replay")
+    parser.add_argument("root", help="output directory for the replay files")
+    parser.add_argument("tickers", nargs="+", help="fund tickers to record prices, dividends and news for")
+    parser.add_argument("--news", nargs="*", default=[], help="extra symbols to record news for (holdings, index proxies)")
+    args = parser.parse_args()
+
+    record_replay(YFinanceProvider(), args.root, args.tickers, news_symbols=args.news)